@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+"""
+Benchmark de rendimiento del análisis con IA contra un servidor Ollama falso.
+
+Lanza `src/fake_ollama.py` en local y ejecuta analyze_submission,
+evaluate_forum_as_task y generate_forum_response con distintos niveles de
+concurrencia. Para cada combinación muestra peticiones/s, latencias p50/p95/p99,
+reintentos, respuestas por defecto y el coste de recuperar un fallo de parseo
+(latencia extra media de las peticiones que necesitaron reintento).
+
+Uso:
+    python benchmark_llm.py                              # Valores por defecto
+    python benchmark_llm.py --requests 40 --concurrency 1,4,8
+    python benchmark_llm.py --token-rate 60 --ttft 0.5 --malformed-rate 0.1 --error-rate 0.02
+    python benchmark_llm.py --scenario submission --export bench.json
+    python benchmark_llm.py --host http://10.2.50.232:11434   # Servidor real en lugar del falso
+"""
+
+import os
+import sys
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+
+from ai_analyzer import AIAnalyzer
+from fake_ollama import FakeOllamaConfig, FakeOllamaServer
+
+SCENARIOS = ['submission', 'forum_task', 'forum_response']
+
+
+def percentile(values, pct):
+    """Percentil por interpolación lineal"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * pct / 100
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def build_workload(scenario, index, workdir):
+    """Devuelve una función que ejecuta una petición del escenario"""
+    if scenario == 'submission':
+        path = os.path.join(workdir, f"entrega_{index}.py")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# Entrega {index}\n" + "def suma(a, b):\n    return a + b\n" * (5 + index % 20))
+        submission = {'filenames': [path], 'student_id': index, 'status': 'submitted'}
+        return lambda analyzer: analyzer.analyze_submission(
+            submission, "Implementar funciones aritméticas documentadas")
+
+    if scenario == 'forum_task':
+        posts = [{
+            'message': f"Aportación {index}: en mi opinión el patrón observer desacopla los componentes. " * 3,
+            'subject': 'Re: Patrones de diseño',
+            'parentid': j,
+            'timecreated': 1700000000 + j
+        } for j in range(1 + index % 3)]
+        forum_info = {'name': 'Debate patrones', 'type': 'general', 'intro': 'Debatir patrones de diseño'}
+        student_info = {'id': index, 'fullname': f"Estudiante {index}"}
+        return lambda analyzer: analyzer.evaluate_forum_as_task(
+            posts, forum_info, "Al menos dos aportaciones argumentadas", student_info)
+
+    discussion = {
+        'id': index,
+        'name': f"Duda ejercicio {index}",
+        'userfullname': f"Estudiante {index}",
+        'message': f"No entiendo por qué falla el ejercicio {index} cuando la lista está vacía.",
+        'numreplies': 0
+    }
+    return lambda analyzer: analyzer.generate_forum_response(discussion, [discussion], "Programación I")
+
+
+def run_level(host, scenario, concurrency, total, workdir, stream):
+    """Ejecuta `total` peticiones con `concurrency` hilos y devuelve las métricas"""
+    # Foro-erantzunen indizerik gabe: bestela lehen eskaeraren ondoren dena indizetik letorke
+    analyzer = AIAnalyzer(hosts=[host], stream=stream, max_concurrency=concurrency, cache_size=0,
+                          use_response_cache=False)
+    engine_generate = analyzer.engine.generate
+    local = threading.local()
+
+    # Gorde saiakera kopurua eskaera bakoitzeko (berreskurapen-kostua kalkulatzeko)
+    def tracked_generate(*args, **kwargs):
+        result = engine_generate(*args, **kwargs)
+        local.attempts = getattr(local, 'attempts', 0) + result.attempts
+        local.ok = getattr(local, 'ok', True) and result.ok
+        return result
+
+    analyzer.engine.generate = tracked_generate
+    workloads = [build_workload(scenario, i, workdir) for i in range(total)]
+
+    def timed(workload):
+        local.attempts = 0
+        local.ok = True
+        started = time.perf_counter()
+        workload(analyzer)
+        return time.perf_counter() - started, local.attempts, local.ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, workloads))
+    wall = time.perf_counter() - started
+
+    latencies = [s[0] for s in samples]
+    clean = [s[0] for s in samples if s[1] <= 1 and s[2]]
+    retried = [s[0] for s in samples if s[1] > 1 and s[2]]
+    recovery_cost = None
+    if clean and retried:
+        recovery_cost = sum(retried) / len(retried) - sum(clean) / len(clean)
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': total,
+        'wall_seconds': round(wall, 3),
+        'requests_per_second': round(total / wall, 2) if wall else None,
+        'p50': round(percentile(latencies, 50), 3),
+        'p95': round(percentile(latencies, 95), 3),
+        'p99': round(percentile(latencies, 99), 3),
+        'retries': sum(max(0, s[1] - 1) for s in samples),
+        'recovered': len(retried),
+        'fallbacks': sum(1 for s in samples if not s[2]),
+        'recovery_cost_seconds': round(recovery_cost, 3) if recovery_cost is not None else None
+    }
+
+
+def print_table(results):
+    print("\n" + "=" * 100)
+    print("📊 BENCHMARK LLM")
+    print("=" * 100)
+    print(f"{'Escenario':<16}{'Conc.':>6}{'Req/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}"
+          f"{'Reint.':>8}{'Recup.':>8}{'Defecto':>9}{'Coste recup.':>14}")
+    print("-" * 100)
+    for r in results:
+        cost = f"{r['recovery_cost_seconds']:.3f}s" if r['recovery_cost_seconds'] is not None else '-'
+        print(f"{r['scenario']:<16}{r['concurrency']:>6}{r['requests_per_second']:>9}"
+              f"{r['p50']:>8.3f}{r['p95']:>8.3f}{r['p99']:>8.3f}"
+              f"{r['retries']:>8}{r['recovered']:>8}{r['fallbacks']:>9}{cost:>14}")
+    print("=" * 100)
+
+
+def main():
+    config = FakeOllamaConfig(token_rate=200.0, ttft=0.05, seed=42)
+    total = 24
+    levels = [1, 2, 4, 8]
+    scenarios = list(SCENARIOS)
+    export_file = None
+    host = None
+    stream = True
+
+    float_options = {
+        '--token-rate': 'token_rate',
+        '--ttft': 'ttft',
+        '--error-rate': 'error_rate',
+        '--malformed-rate': 'malformed_rate',
+        '--load-duration': 'load_duration'
+    }
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        value = sys.argv[i + 1] if i + 1 < len(sys.argv) else None
+        if arg in float_options and value is not None:
+            setattr(config, float_options[arg], float(value))
+            i += 2
+        elif arg in ['--requests', '-n'] and value is not None:
+            total = int(value)
+            i += 2
+        elif arg in ['--concurrency', '-c'] and value is not None:
+            levels = [int(v) for v in value.split(',') if v.strip()]
+            i += 2
+        elif arg in ['--scenario', '-s'] and value is not None:
+            scenarios = [s for s in value.split(',') if s in SCENARIOS]
+            i += 2
+        elif arg in ['--export', '-e'] and value is not None:
+            export_file = value
+            i += 2
+        elif arg == '--host' and value is not None:
+            host = value
+            i += 2
+        elif arg == '--no-stream':
+            stream = False
+            i += 1
+        else:
+            i += 1
+
+    server = None
+    if host is None:
+        server = FakeOllamaServer(config).start()
+        host = server.url
+        print(f"🧪 Fake Ollama en {host}: {config}")
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for scenario in scenarios:
+                for level in levels:
+                    print(f"▶️  {scenario} | concurrencia {level} | {total} peticiones")
+                    results.append(run_level(host, scenario, level, total, workdir, stream))
+    finally:
+        if server:
+            server.stop()
+
+    print_table(results)
+    if server:
+        print(f"Servidor: {server.counters}")
+
+    if export_file:
+        with open(export_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generated_at': datetime.now().isoformat(),
+                'host': host,
+                'fake_config': vars(config) if server else None,
+                'stream': stream,
+                'results': results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"✅ Resultados exportados a {export_file}")
+
+
+if __name__ == "__main__":
+    main()
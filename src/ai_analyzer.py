@@ -3,18 +3,63 @@ Módulo de análisis inteligente de entregas con IA
 Analiza entregas, genera feedback y detecta estudiantes en riesgo
 """
 import os
-import json
+import copy
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Callable
 from logger_config import get_logger
-import ollama
+from generation import GenerationEngine, GenerationSpec, GenerationResult, TokenUsage
+from ollama_pool import OllamaHostPool
+from forum_analytics import build_forum_metrics, format_metrics, student_metrics
+from response_cache import ForumResponseCache, cluster_questions, personalize, question_text, strip_greeting
 
 logger = get_logger(__name__)
 
 # Konfigurazioa - Urruneko Ollama zerbitzaria
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://10.2.50.232:11434")
+# Zerbitzari anitz (komaz bereizita); hutsik bada OLLAMA_HOST bakarra
+OLLAMA_HOSTS = [h.strip() for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]
+# Erori den zerbitzari bat berriro egiaztatzeko tartea (segundoak)
+HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "30"))
 DEFAULT_MODEL = os.getenv("OLLAMA_MODEL", "qwen3:30b-a3b")
+# Irteera-token kopuru maximoa streaming bakoitzeko (amaigabeko sorkuntzak mozteko)
+MAX_OUTPUT_TOKENS = int(os.getenv("OLLAMA_MAX_OUTPUT_TOKENS", "2048"))
+# Testuinguru-leihoa (hutsik bada zerbitzariaren balioa)
+NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0")) or None
+# Eskaera bakoitzeko epea (segundoak) eta berriro saiakera kopurua
+REQUEST_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))
+MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+# Modeloa memorian mantentzeko denbora dei bakoitzaren ondoren (hutsik = zerbitzariaren balioa)
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "") or None
+# Aldi bereko eskaera kopuru maximoa
+MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+
+# Kaskada modua: eredu txiki azkarra lehenengo, zalantzazko kasuak eredu handira
+CASCADE_MODEL = os.getenv("OLLAMA_CASCADE_MODEL", "")
+CASCADE_MIN_CONFIDENCE = float(os.getenv("OLLAMA_CASCADE_MIN_CONFIDENCE", "0.7"))
+# Aprobatu/suspentsoaren inguruko notak beti eredu handiak berrikusten ditu
+CASCADE_BORDERLINE = (4.0, 6.0)
+# Luzera honetatik gorako edukiak zuzenean eredu handira
+CASCADE_MAX_CONTENT = int(os.getenv("OLLAMA_CASCADE_MAX_CONTENT", "4000"))
+
+# Modu paketatua: K ikasleren entrega laburrak eskaera bakarrean (1 = desaktibatuta)
+PACK_SIZE = int(os.getenv("OLLAMA_PACK_SIZE", "1"))
+# Luzera honetatik beherako edukiak bakarrik paketatzen dira
+PACK_MAX_CONTENT = int(os.getenv("OLLAMA_PACK_MAX_CONTENT", "1500"))
+
+# Foro-galdera antzekoen erantzunak berrerabili (response_cache); 0 = beti sortu
+FORUM_RESPONSE_CACHE = os.getenv("FORUM_RESPONSE_CACHE", "1") == "1"
+# Berrerabil daitezkeen erantzunaren eremuak
+FORUM_RESPONSE_FIELDS = ('proposed_response', 'tone', 'key_points', 'follow_up_questions', 'resources',
+                         'priority', 'category', 'summary')
+# Foro-tarea: modeloari aspektu kualitatiboak bakarrik galdetzen zaizkio; zenbaketak metriketan doaz
+FORUM_TASK_INSTRUCTIONS = """INSTRUCCIONES DE EVALUACIÓN:
+Las MÉTRICAS están calculadas de forma exacta: no cuentes mensajes, palabras, respuestas ni enlaces; úsalas tal cual.
+Evalúa solo lo que requiere leer los mensajes: relevancia, profundidad, originalidad, claridad y la calidad
+(no la cantidad) de la interacción. Indica si la extensión es adecuada a las instrucciones, da feedback
+constructivo y concreto, áreas de mejora y una calificación de 0 a 10.
+"""
 
 # JSON Schema erantzunerako - Ollama-k formatu hau erabiliko du
 SUBMISSION_ANALYSIS_SCHEMA = {
@@ -89,6 +134,40 @@ SUBMISSION_ANALYSIS_SCHEMA = {
     "required": ["feedback", "grade", "strengths", "weaknesses", "recommendations", "completeness", "summary"]
 }
 
+# Kaskadaren lehen faserako schema: analisi bera + konfiantza-seinalea
+SUBMISSION_TRIAGE_SCHEMA = copy.deepcopy(SUBMISSION_ANALYSIS_SCHEMA)
+SUBMISSION_TRIAGE_SCHEMA["properties"]["confidence"] = {
+    "type": "number",
+    "minimum": 0,
+    "maximum": 1,
+    "description": "Confianza en la calificación y el diagnóstico (0 = ninguna, 1 = total)"
+}
+SUBMISSION_TRIAGE_SCHEMA["required"] = SUBMISSION_ANALYSIS_SCHEMA["required"] + ["confidence"]
+
+
+def _packed_schema(item_schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Elementu-schema bat ikasle-IDaren araberako emaitzen array bihurtu"""
+    item = copy.deepcopy(item_schema)
+    item["properties"]["student_id"] = {
+        "type": "integer",
+        "description": "ID del estudiante evaluado (tal como aparece en el prompt)"
+    }
+    item["required"] = ["student_id"] + item_schema["required"]
+    return {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": item,
+                "description": "Un resultado por cada estudiante, en cualquier orden"
+            }
+        },
+        "required": ["results"]
+    }
+
+
+PACKED_SUBMISSION_SCHEMA = _packed_schema(SUBMISSION_ANALYSIS_SCHEMA)
+
 # JSON Schema foro erantzunetarako
 FORUM_RESPONSE_SCHEMA = {
     "type": "object",
@@ -214,14 +293,6 @@ FORUM_TASK_EVALUATION_SCHEMA = {
             "type": "boolean",
             "description": "Si la extensión es adecuada"
         },
-        "cited_sources": {
-            "type": "boolean",
-            "description": "Si se citan fuentes o referencias"
-        },
-        "responded_to_others": {
-            "type": "boolean",
-            "description": "Si el estudiante ha respondido a otros compañeros"
-        },
         "summary": {
             "type": "string",
             "description": "Resumen breve de una línea sobre la participación"
@@ -230,6 +301,8 @@ FORUM_TASK_EVALUATION_SCHEMA = {
     "required": ["feedback", "grade", "participation_quality", "strengths", "weaknesses", "recommendations", "meets_requirements", "summary"]
 }
 
+PACKED_FORUM_TASK_SCHEMA = _packed_schema(FORUM_TASK_EVALUATION_SCHEMA)
+
 
 class AIAnalyzer:
     """
@@ -240,29 +313,133 @@ class AIAnalyzer:
     - Analizar progreso y patrones de entrega
     """
     
-    def __init__(self, model: str = None, host: str = None, stream: bool = True, think: bool = False):
+    def __init__(self, model: str = None, host: str = None, hosts: List[str] = None,
+                 stream: bool = True, think: bool = False,
+                 max_output_tokens: int = None, num_ctx: int = None, timeout: float = None,
+                 max_retries: int = None, max_concurrency: int = None, cache_size: int = 128,
+                 cascade_model: str = None, cascade_min_confidence: float = None,
+                 pack_size: int = None, keep_alive: str = None,
+                 response_cache: Optional[ForumResponseCache] = None, use_response_cache: bool = None,
+                 check_hosts: bool = True):
         """
         Inicializa el analizador de IA
         
         Args:
             model: Modelo a usar (por defecto desde env o qwen3:30b-a3b)
             host: URL del servidor Ollama (por defecto desde env o http://10.2.50.232:11434)
+            hosts: Lista de servidores Ollama entre los que repartir las peticiones
+                   (por defecto desde OLLAMA_HOSTS; tiene prioridad sobre `host`)
             stream: Si usar streaming para las respuestas
             think: Si habilitar el modo "thinking" del modelo (qwen3)
+            max_output_tokens: Máximo de tokens (chunks) a recibir por respuesta en streaming
+                               antes de cancelar la generación (por defecto desde env o 2048)
+            num_ctx: Tamaño de la ventana de contexto (por defecto desde env o el del servidor)
+            timeout: Plazo en segundos por petición (por defecto desde env o 300)
+            max_retries: Reintentos por petición (por defecto desde env o 2)
+            max_concurrency: Peticiones simultáneas por servidor (por defecto desde env o 2)
+            cache_size: Respuestas recordadas en memoria para prompts idénticos (0 = sin caché)
+            cascade_model: Modelo pequeño para el modo cascada (por defecto desde env; vacío = desactivado)
+            cascade_min_confidence: Confianza mínima del modelo pequeño para no escalar (por defecto 0.7)
+            pack_size: Entregas cortas por petición en modo empaquetado (por defecto desde env; 1 = desactivado)
+            keep_alive: Tiempo que el modelo sigue cargado tras cada petición, p. ej. "30m"
+                        (por defecto desde env OLLAMA_KEEP_ALIVE o el del servidor)
+            response_cache: Índice de respuestas de foro a usar (por defecto RESPONSE_CACHE_FILE, al primer uso)
+            use_response_cache: Reutilizar respuestas de foro parecidas (por defecto desde env FORUM_RESPONSE_CACHE)
+            check_hosts: Comprobar los servidores Ollama al crear el analizador (False para solo
+                         generar informes, que no llaman al modelo)
         """
         self.model = model or DEFAULT_MODEL
-        self.host = host or OLLAMA_HOST
+        self.hosts = list(hosts or ([host] if host else None) or OLLAMA_HOSTS or [OLLAMA_HOST])
+        self.host = self.hosts[0]
         self.stream = stream
         self.think = think
-        
-        # Crear cliente Ollama con el host especificado
-        self.client = ollama.Client(host=self.host)
+        self.max_output_tokens = max_output_tokens or MAX_OUTPUT_TOKENS
+        self.timeout = timeout or REQUEST_TIMEOUT
+        self.cascade_model = cascade_model if cascade_model is not None else CASCADE_MODEL
+        self.cascade_min_confidence = (CASCADE_MIN_CONFIDENCE if cascade_min_confidence is None
+                                       else cascade_min_confidence)
+        self.pack_size = max(1, pack_size or PACK_SIZE)
+        # Foro-erantzunen indizea: lehen erabileran kargatzen da (emandakoa ez bada)
+        self.response_cache: Optional[ForumResponseCache] = response_cache
+        self.use_response_cache = FORUM_RESPONSE_CACHE if use_response_cache is None else use_response_cache
+        
+        # Pool de servidores Ollama: se usa como un cliente más (reparto por carga y failover)
+        self.pool = OllamaHostPool(self.hosts, timeout=self.timeout, health_interval=HEALTH_INTERVAL,
+                                   check_on_start=check_hosts)
+        self.client = self.pool
+        max_concurrency = (max_concurrency or MAX_CONCURRENCY) * len(self.hosts)
+        self.max_concurrency = max_concurrency
+        
+        # Sorkuntza-motor bakarra: bidalketak, foro erantzunak eta foro-tareak
+        self.engine = GenerationEngine(
+            client=self.client,
+            model=self.model,
+            stream=self.stream,
+            think=self.think,
+            max_output_tokens=self.max_output_tokens,
+            num_ctx=num_ctx or NUM_CTX,
+            timeout=self.timeout,
+            max_retries=MAX_RETRIES if max_retries is None else max_retries,
+            max_concurrency=max_concurrency,
+            cache_size=cache_size,
+            keep_alive=keep_alive or KEEP_ALIVE
+        )
+        self.submission_spec = GenerationSpec(
+            name='submission',
+            schema=SUBMISSION_ANALYSIS_SCHEMA,
+            validator=self._validate_response,
+            fallback=self._get_default_response,
+            required_keys=['feedback', 'grade']
+        )
+        self.submission_triage_spec = GenerationSpec(
+            name='submission_triage',
+            schema=SUBMISSION_TRIAGE_SCHEMA,
+            validator=self._validate_triage_response,
+            fallback=self._get_default_response,
+            required_keys=['feedback', 'grade']
+        )
+        self.packed_submission_spec = GenerationSpec(
+            name='submission_packed',
+            schema=PACKED_SUBMISSION_SCHEMA,
+            validator=lambda r: self._validate_packed(r, self._validate_response),
+            fallback=lambda msg: {'results': []},
+            required_keys=['results']
+        )
+        self.forum_response_spec = GenerationSpec(
+            name='forum_response',
+            schema=FORUM_RESPONSE_SCHEMA,
+            validator=self._validate_forum_response,
+            fallback=self._get_default_forum_response,
+            required_keys=['response']
+        )
+        self.forum_task_spec = GenerationSpec(
+            name='forum_task',
+            schema=FORUM_TASK_EVALUATION_SCHEMA,
+            validator=self._validate_forum_task_response,
+            fallback=self._get_default_forum_task_response,
+            required_keys=['feedback', 'grade']
+        )
+        self.packed_forum_task_spec = GenerationSpec(
+            name='forum_task_packed',
+            schema=PACKED_FORUM_TASK_SCHEMA,
+            validator=lambda r: self._validate_packed(r, self._validate_forum_task_response),
+            fallback=lambda msg: {'results': []},
+            required_keys=['results']
+        )
         
         logger.info(f"Inicializando AIAnalyzer:")
         logger.info(f"  - Modelo: {self.model}")
-        logger.info(f"  - Host: {self.host}")
+        logger.info(f"  - Host: {', '.join(self.hosts)}")
         logger.info(f"  - Streaming: {self.stream}")
         logger.info(f"  - Think mode: {self.think}")
+        logger.info(f"  - Max output tokens: {self.max_output_tokens}")
+        logger.info(f"  - Timeout: {self.timeout}s | Retries: {self.engine.max_retries} | "
+                    f"Concurrency: {max_concurrency}")
+        if self.pack_size > 1:
+            logger.info(f"  - Modo empaquetado: hasta {self.pack_size} entregas cortas por petición")
+        if self.cascade_model:
+            logger.info(f"  - Cascada: {self.cascade_model} → {self.model} "
+                        f"(confianza mínima {self.cascade_min_confidence})")
     
     def analyze_submission(self, 
                           submission_data: Dict[str, Any],
@@ -278,17 +455,7 @@ class AIAnalyzer:
             Dict con análisis, feedback, calificación sugerida
         """
         try:
-            # Leer contenido de archivos
-            content = self._read_submission_files(submission_data.get('filenames', []))
-            
-            # Extraer URLs del contenido
-            urls = self._extract_urls(content)
-            
-            # Analizar URLs si existen
-            url_analysis = []
-            if urls:
-                logger.info(f"  Encontradas {len(urls)} URLs en la entrega")
-                url_analysis = self._analyze_urls(urls)
+            content, urls, url_analysis = self._prepare_submission(submission_data)
             
             # Generar análisis con IA
             prompt = self._build_analysis_prompt(
@@ -298,23 +465,18 @@ class AIAnalyzer:
                 metadata=submission_data
             )
             
-            analysis = self._query_ai(prompt)
+            with self.engine.usage_scope() as usage:
+                if self.cascade_model:
+                    analysis, cascade = self._query_cascade(prompt, len(content))
+                else:
+                    analysis, cascade = self._query_ai(prompt), None
             
-            return {
-                'status': 'success',
-                'content_length': len(content),
-                'urls_found': len(urls),
-                'url_analysis': url_analysis,
-                'ai_feedback': analysis.get('feedback', ''),
-                'suggested_grade': analysis.get('grade'),
-                'strengths': analysis.get('strengths', []),
-                'weaknesses': analysis.get('weaknesses', []),
-                'recommendations': analysis.get('recommendations', []),
-                'code_quality': analysis.get('code_quality'),
-                'completeness': analysis.get('completeness', 0),
-                'summary': analysis.get('summary', ''),
-                'analyzed_at': datetime.now().isoformat()
-            }
+            result = self._build_submission_result(analysis, content, urls, url_analysis,
+                                                   cascade['final_model'] if cascade else self.model)
+            if cascade:
+                result['cascade'] = cascade
+            result['usage'] = usage.to_dict()
+            return result
             
         except Exception as e:
             logger.error(f"  Error analizando entrega: {e}")
@@ -324,6 +486,210 @@ class AIAnalyzer:
                 'analyzed_at': datetime.now().isoformat()
             }
     
+    def _prepare_submission(self, submission_data: Dict[str, Any]):
+        """Lee los archivos de la entrega y analiza sus URLs; devuelve (contenido, urls, url_analysis)"""
+        # Leer contenido de archivos
+        content = self._read_submission_files(submission_data.get('filenames', []))
+        
+        # Extraer URLs del contenido
+        urls = self._extract_urls(content)
+        
+        # Analizar URLs si existen
+        url_analysis = []
+        if urls:
+            logger.info(f"  Encontradas {len(urls)} URLs en la entrega")
+            url_analysis = self._analyze_urls(urls)
+        
+        return content, urls, url_analysis
+    
+    def _build_submission_result(self, analysis: Dict[str, Any], content: str, urls: List[str],
+                                 url_analysis: List[Dict[str, Any]], model: str) -> Dict[str, Any]:
+        """Construye el dict de resultado de analyze_submission a partir de la respuesta validada"""
+        return {
+            'status': 'success',
+            'content_length': len(content),
+            'urls_found': len(urls),
+            'url_analysis': url_analysis,
+            'ai_feedback': analysis.get('feedback', ''),
+            'suggested_grade': analysis.get('grade'),
+            'strengths': analysis.get('strengths', []),
+            'weaknesses': analysis.get('weaknesses', []),
+            'recommendations': analysis.get('recommendations', []),
+            'code_quality': analysis.get('code_quality'),
+            'completeness': analysis.get('completeness', 0),
+            'summary': analysis.get('summary', ''),
+            'model': model,
+            'fallback': analysis.get('fallback', False),
+            'analyzed_at': datetime.now().isoformat()
+        }
+    
+    def analyze_submissions_packed(self,
+                                   submissions: List[Dict[str, Any]],
+                                   assignment_criteria: Optional[str] = None) -> Dict[Any, Dict[str, Any]]:
+        """
+        Analiza varias entregas de la misma tarea agrupando las cortas en una sola petición
+        
+        Las instrucciones y criterios se envían una vez por paquete de `pack_size`
+        estudiantes. Las entregas largas, y cualquier estudiante que falte o aparezca
+        repetido en la respuesta del paquete, se analizan con `analyze_submission`.
+        
+        Args:
+            submissions: Lista de submission_data; cada uno debe incluir 'student_id'
+            assignment_criteria: Criterios de evaluación de la tarea
+        
+        Returns:
+            Dict {student_id: resultado} con el mismo formato que analyze_submission
+        """
+        results = {}
+        short = []
+        
+        for submission_data in submissions:
+            student_id = submission_data['student_id']
+            if self.pack_size <= 1:
+                results[student_id] = self.analyze_submission(submission_data, assignment_criteria)
+                continue
+            try:
+                content, urls, url_analysis = self._prepare_submission(submission_data)
+            except Exception as e:
+                logger.error(f"  Error leyendo entrega de {student_id}: {e}")
+                results[student_id] = self.analyze_submission(submission_data, assignment_criteria)
+                continue
+            if len(content) <= PACK_MAX_CONTENT:
+                short.append((submission_data, content, urls, url_analysis))
+            else:
+                results[student_id] = self.analyze_submission(submission_data, assignment_criteria)
+        
+        for start in range(0, len(short), self.pack_size):
+            pack = short[start:start + self.pack_size]
+            if len(pack) == 1:
+                submission_data = pack[0][0]
+                results[submission_data['student_id']] = self.analyze_submission(submission_data, assignment_criteria)
+                continue
+            
+            prompt = self._build_packed_analysis_prompt(pack, assignment_criteria)
+            generated = self._generate(self.packed_submission_spec, prompt,
+                                       max_output_tokens=self.max_output_tokens * len(pack),
+                                       timeout=self.timeout * len(pack))
+            by_student = self._match_packed_results(generated.data.get('results', []),
+                                                    [item[0]['student_id'] for item in pack])
+            logger.info(f"      📦 Paquete de {len(pack)} entregas: {len(by_student)} resultado(s) válidos")
+            # Paketearen kostua ikasleen artean banatu
+            share = generated.metrics['usage'].scaled(1 / len(pack))
+            
+            for submission_data, content, urls, url_analysis in pack:
+                student_id = submission_data['student_id']
+                analysis = by_student.get(student_id)
+                if analysis is None:
+                    logger.info(f"      ↩️  {student_id}: sin resultado en el paquete, análisis individual")
+                    result = self.analyze_submission(submission_data, assignment_criteria)
+                else:
+                    result = self._build_submission_result(analysis, content, urls, url_analysis, self.model)
+                    result['packed'] = len(pack)
+                result['usage'] = TokenUsage.from_dict(result.get('usage')).add(share).to_dict()
+                results[student_id] = result
+        
+        return results
+    
+    def _build_packed_analysis_prompt(self, pack: List[tuple], criteria: Optional[str]) -> str:
+        """Prompt con instrucciones y criterios una sola vez y las entregas de varios estudiantes"""
+        first = pack[0][0]
+        prompt = f"""Eres un profesor experto evaluando {len(pack)} entregas de estudiantes de la misma tarea.
+Evalúa cada entrega de forma independiente: no compares a los estudiantes entre sí.
+
+INFORMACIÓN DE LA TAREA:
+- Tarea: {first.get('assignment_name', 'Desconocida')}
+
+"""
+        if criteria:
+            prompt += f"""CRITERIOS DE EVALUACIÓN:
+{criteria}
+
+"""
+        prompt += f"ENTREGAS ({len(pack)}):\n"
+        for submission_data, content, urls, url_analysis in pack:
+            prompt += f"""
+=== ESTUDIANTE student_id={submission_data['student_id']} ({submission_data.get('student_username', 'Desconocido')}) ===
+Fecha de última modificación: {submission_data.get('timemodified', 'Desconocida')}
+"""
+            for url_data in url_analysis:
+                status = "✓ Accesible" if url_data.get('accessible') else "✗ No accesible"
+                prompt += f"Enlace: {url_data['url']} [{status}]\n"
+            prompt += f"""Contenido:
+{content}
+=== FIN student_id={submission_data['student_id']} ===
+"""
+        
+        prompt += f"""
+INSTRUCCIONES:
+1. Analiza cada entrega en base a los criterios de evaluación (si existen)
+2. Evalúa la calidad del trabajo y del código (si es programación)
+3. Verifica si los enlaces funcionan y son relevantes
+4. Proporciona feedback constructivo y específico para cada estudiante
+5. Sé justo pero exigente en la evaluación
+
+Responde ÚNICAMENTE con un objeto JSON válido con esta estructura:
+{{
+    "results": [
+        {{
+            "student_id": 123,
+            "feedback": "Feedback detallado para este estudiante",
+            "grade": 7.5,
+            "strengths": ["Punto fuerte 1"],
+            "weaknesses": ["Área de mejora 1"],
+            "recommendations": ["Recomendación 1"],
+            "code_quality": {{"readability": 4, "structure": 3, "documentation": 2, "best_practices": 3}},
+            "completeness": 75,
+            "summary": "Resumen de una línea"
+        }}
+    ]
+}}
+
+NOTAS:
+- Debe haber EXACTAMENTE un elemento en "results" por cada uno de los {len(pack)} student_id anteriores
+- "grade": número de 0 a 10 (puede tener decimales), o null si no se puede evaluar
+- "code_quality": solo incluir si es una entrega de programación, cada valor de 1 a 5
+- "completeness": porcentaje de 0 a 100 de requisitos cumplidos
+"""
+        return prompt
+    
+    def _validate_packed(self, response: Dict[str, Any], item_validator: Callable) -> Dict[str, Any]:
+        """Valida cada elemento de una respuesta empaquetada conservando su student_id"""
+        items = response.get('results')
+        if not isinstance(items, list):
+            raise ValueError("La respuesta empaquetada no contiene 'results'")
+        validated = []
+        for item in items:
+            if not isinstance(item, dict) or item.get('student_id') is None:
+                continue
+            entry = item_validator(item)
+            entry['student_id'] = item['student_id']
+            validated.append(entry)
+        return {'results': validated}
+    
+    def _match_packed_results(self, items: List[Dict[str, Any]], expected_ids: List[Any]) -> Dict[Any, Dict[str, Any]]:
+        """
+        Empareja los resultados con los estudiantes esperados
+        
+        Solo se aceptan estudiantes con exactamente un resultado; los ausentes,
+        repetidos o desconocidos quedan fuera para que se analicen por separado.
+        """
+        expected = {str(student_id): student_id for student_id in expected_ids}
+        found: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items:
+            key = str(item.get('student_id'))
+            if key in expected:
+                found.setdefault(key, []).append(item)
+        
+        matched = {}
+        for key, entries in found.items():
+            if len(entries) == 1:
+                entry = dict(entries[0])
+                entry.pop('student_id', None)
+                matched[expected[key]] = entry
+            else:
+                logger.warning(f"      Resultado duplicado para student_id={key} en el paquete, se descarta")
+        return matched
+    
     def analyze_submission_interactive(self, 
                                        submission_data: Dict[str, Any],
                                        assignment_criteria: Optional[str] = None,
@@ -534,44 +900,106 @@ NOTAS:
         Returns:
             Dict con la respuesta parseada del modelo
         """
-        try:
-            if self.stream:
-                return self._query_ai_streaming(prompt, on_chunk)
-            else:
-                return self._query_ai_sync(prompt)
-                
-        except Exception as e:
-            logger.error(f"  Error consultando IA: {e}")
-            return {
-                'feedback': f"Error: {str(e)}",
-                'grade': None,
-                'strengths': [],
-                'weaknesses': [],
-                'recommendations': []
-            }
+        return self._generate(self.submission_spec, prompt, on_chunk).data
     
-    def _query_ai_sync(self, prompt: str) -> Dict[str, Any]:
-        """Consulta síncrona (sin streaming) al modelo"""
-        try:
-            response = self.client.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                format="json",
-                think=self.think
-            )
-            
-            content = response['message']['content']
-            return json.loads(content)
+    def _query_cascade(self, prompt: str, content_length: int):
+        """
+        Modo cascada: el modelo pequeño evalúa primero y solo se escala al grande
+        cuando la respuesta es dudosa
+        
+        Se escala si el modelo pequeño falla, si su confianza es baja, si no da nota,
+        si la nota cae en la franja de aprobado/suspenso o si la entrega es larga.
+        
+        Args:
+            prompt: Prompt de análisis
+            content_length: Longitud del contenido leído de la entrega
+        
+        Returns:
+            (análisis, info_cascada) donde info_cascada registra ambas fases
+        """
+        cascade = {'stages': [], 'escalated': False, 'reason': None, 'final_model': self.cascade_model}
+        
+        if content_length > CASCADE_MAX_CONTENT:
+            cascade['reason'] = f"entrega larga ({content_length} caracteres)"
+        else:
+            triage_prompt = prompt + """- "confidence": número de 0 a 1 con tu confianza en la calificación (sé honesto: usa valores bajos si dudas)
+"""
+            triage = self._generate(self.submission_triage_spec, triage_prompt, model=self.cascade_model)
+            analysis = triage.data
+            confidence = analysis.get('confidence', 0.0)
+            grade = analysis.get('grade')
+            cascade['stages'].append({
+                'model': self.cascade_model,
+                'ok': triage.ok,
+                'grade': grade,
+                'confidence': confidence,
+                'seconds': triage.metrics.get('total_seconds')
+            })
             
-        except json.JSONDecodeError:
-            logger.warning("  Respuesta de IA no es JSON válido, extrayendo texto")
-            return {
-                'feedback': content if 'content' in locals() else "Error procesando respuesta",
-                'grade': None,
-                'strengths': [],
-                'weaknesses': [],
-                'recommendations': []
-            }
+            if not triage.ok:
+                cascade['reason'] = "fallo del modelo pequeño"
+            elif grade is None:
+                cascade['reason'] = "sin calificación"
+            elif confidence < self.cascade_min_confidence:
+                cascade['reason'] = f"confianza baja ({confidence:.2f})"
+            elif CASCADE_BORDERLINE[0] <= grade <= CASCADE_BORDERLINE[1]:
+                cascade['reason'] = f"nota límite ({grade})"
+            else:
+                logger.info(f"      ⚡ Cascada: resuelto con {self.cascade_model} "
+                            f"(nota {grade}, confianza {confidence:.2f})")
+                analysis.pop('confidence', None)
+                return analysis, cascade
+        
+        logger.info(f"      ⬆️  Cascada: escalando a {self.model} - {cascade['reason']}")
+        final = self._generate(self.submission_spec, prompt)
+        cascade['escalated'] = True
+        cascade['final_model'] = self.model
+        cascade['stages'].append({
+            'model': self.model,
+            'ok': final.ok,
+            'grade': final.data.get('grade'),
+            'confidence': None,
+            'seconds': final.metrics.get('total_seconds')
+        })
+        return final.data, cascade
+    
+    def _generate(self, spec: GenerationSpec, prompt: str,
+                  on_chunk: Optional[Callable[[str, bool], None]] = None,
+                  model: Optional[str] = None,
+                  max_output_tokens: Optional[int] = None,
+                  timeout: Optional[float] = None) -> GenerationResult:
+        """Punto único de generación para todas las rutas (entregas, foros, foros-tarea)"""
+        return self.engine.generate(spec, prompt, on_chunk=on_chunk, model=model,
+                                    max_output_tokens=max_output_tokens, timeout=timeout)
+    
+    def get_generation_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Métricas agregadas de generación por tipo (llamadas, fallos, reintentos, tiempo)"""
+        return self.engine.get_stats()
+    
+    def get_usage(self) -> Dict[str, Any]:
+        """Tokens y tiempos de GPU de todas las llamadas hechas por este analizador"""
+        return self.engine.get_usage().to_dict()
+    
+    def warm_up(self) -> bool:
+        """
+        Carga el modelo en los servidores sin generar nada (petición sin mensajes)
+
+        Returns:
+            True si al menos un servidor ha cargado el modelo
+        """
+        kwargs = {'keep_alive': self.engine.keep_alive} if self.engine.keep_alive else {}
+        loaded = False
+        for host in self.pool.hosts:
+            try:
+                host.client.chat(model=self.model, messages=[], **kwargs)
+                loaded = True
+            except Exception as e:
+                logger.warning(f"⚠️ No se pudo precargar {self.model} en {host.url}: {e}")
+        return loaded
+
+    def get_host_status(self) -> List[Dict[str, Any]]:
+        """Estado de cada servidor Ollama del pool (salud, carga, latencia, errores)"""
+        return self.pool.get_status()
     
     def _get_default_response(self, error_msg: str = "") -> Dict[str, Any]:
         """Erantzun lehenetsia erroreen kasuan"""
@@ -586,89 +1014,6 @@ NOTAS:
             'summary': "Error en el análisis"
         }
     
-    def _query_ai_sync(self, prompt: str) -> Dict[str, Any]:
-        """Consulta síncrona (sin streaming) al modelo"""
-        try:
-            response = self.client.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                format=SUBMISSION_ANALYSIS_SCHEMA,  # JSON Schema erabili
-                think=self.think
-            )
-            
-            content = response['message']['content']
-            result = json.loads(content)
-            return self._validate_response(result)
-            
-        except json.JSONDecodeError:
-            logger.warning("  Respuesta de IA no es JSON válido, extrayendo texto")
-            return self._get_default_response(content if 'content' in locals() else "")
-    
-    def _query_ai_streaming(self, prompt: str, on_chunk: Optional[Callable[[str, bool], None]] = None) -> Dict[str, Any]:
-        """
-        Consulta con streaming al modelo
-        
-        Args:
-            prompt: El prompt a enviar
-            on_chunk: Callback para procesar cada chunk (texto, es_thinking)
-        
-        Returns:
-            Dict con la respuesta completa parseada
-        """
-        try:
-            stream = self.client.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                format=SUBMISSION_ANALYSIS_SCHEMA,  # JSON Schema erabili
-                think=self.think
-            )
-            
-            in_thinking = False
-            content = ''
-            thinking = ''
-            
-            for chunk in stream:
-                # Procesar thinking (si el modelo lo soporta)
-                if hasattr(chunk.message, 'thinking') and chunk.message.thinking:
-                    if not in_thinking:
-                        in_thinking = True
-                        logger.debug("  [Thinking mode activado]")
-                    
-                    thinking += chunk.message.thinking
-                    
-                    if on_chunk:
-                        on_chunk(chunk.message.thinking, True)
-                
-                # Procesar contenido normal
-                elif hasattr(chunk.message, 'content') and chunk.message.content:
-                    if in_thinking:
-                        in_thinking = False
-                        logger.debug("  [Thinking mode finalizado]")
-                    
-                    content += chunk.message.content
-                    
-                    if on_chunk:
-                        on_chunk(chunk.message.content, False)
-            
-            # Log del thinking si existió
-            if thinking:
-                logger.debug(f"  Thinking del modelo ({len(thinking)} chars)")
-            
-            logger.debug(f"  Respuesta completa ({len(content)} chars)")
-            
-            # Intentar parsear como JSON
-            try:
-                result = json.loads(content)
-                return self._validate_response(result)
-            except json.JSONDecodeError:
-                logger.warning("  Respuesta no es JSON válido, intentando extraer")
-                return self._extract_json_from_text(content)
-                
-        except Exception as e:
-            logger.error(f"  Error en streaming: {e}")
-            raise
-    
     def _validate_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
         """Balidatu eta osatu erantzuna beharrezko eremuak dituela"""
         validated = {
@@ -697,24 +1042,14 @@ NOTAS:
         
         return validated
     
-    def _extract_json_from_text(self, text: str) -> Dict[str, Any]:
-        """Intenta extraer JSON de un texto que puede contener otros elementos"""
-        import re
-        
-        # Buscar bloques JSON en el texto
-        json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
-        matches = re.findall(json_pattern, text, re.DOTALL)
-        
-        for match in matches:
-            try:
-                parsed = json.loads(match)
-                if 'feedback' in parsed or 'grade' in parsed:
-                    return self._validate_response(parsed)
-            except json.JSONDecodeError:
-                continue
-        
-        # Si no se encuentra JSON válido, devolver el texto como feedback
-        return self._get_default_response(text)
+    def _validate_triage_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Kaskadaren lehen fasearen erantzuna: analisi arrunta + konfiantza 0-1 tartean"""
+        validated = self._validate_response(response)
+        try:
+            validated['confidence'] = max(0.0, min(1.0, float(response.get('confidence', 0.0))))
+        except (ValueError, TypeError):
+            validated['confidence'] = 0.0
+        return validated
     
     def generate_student_report(self, 
                                student_submissions: List[Dict[str, Any]],
@@ -1003,12 +1338,20 @@ NOTAS:
             Dict erantzun proposamenarekin
         """
         try:
+            # Galdera berria bada (elkarrizketarik gabe), lehenago erantzundako antzeko bat bilatu
+            cache = self._get_response_cache() if len(posts or []) <= 1 else None
+            question, scope = question_text(discussion), context or ""
+            found = cache.lookup(question, scope) if cache else None
+            if found:
+                return self._reused_forum_response(discussion, *found)
+
             prompt = self._build_forum_response_prompt(discussion, posts, context)
             
             # Foroentzako schema erabili
-            response = self._query_forum_ai(prompt)
+            with self.engine.usage_scope() as usage:
+                response = self._query_forum_ai(prompt)
             
-            return {
+            result = {
                 'status': 'success',
                 'discussion_id': discussion.get('id'),
                 'discussion_name': discussion.get('name'),
@@ -1020,8 +1363,14 @@ NOTAS:
                 'priority': response.get('priority', 'medium'),
                 'category': response.get('category', 'question'),
                 'summary': response.get('summary', ''),
+                'fallback': response.get('fallback', False),
+                'usage': usage.to_dict(),
                 'generated_at': datetime.now().isoformat()
             }
+            if cache and not result['fallback']:
+                cache.add(question, {key: result[key] for key in FORUM_RESPONSE_FIELDS}, scope,
+                          discussion_id=discussion.get('id'))
+            return result
             
         except Exception as e:
             logger.error(f"Error sortzen foro erantzuna: {e}")
@@ -1031,6 +1380,55 @@ NOTAS:
                 'generated_at': datetime.now().isoformat()
             }
     
+    def _get_response_cache(self) -> Optional[ForumResponseCache]:
+        """Índice de respuestas de foro (se carga la primera vez que se usa)"""
+        if not self.use_response_cache:
+            return None
+        if self.response_cache is None:
+            self.response_cache = ForumResponseCache()
+        return self.response_cache
+
+    def _reused_forum_response(self, discussion: Dict[str, Any], entry: Dict[str, Any],
+                               similarity: float) -> Dict[str, Any]:
+        """Respuesta de una pregunta parecida, con el saludo del estudiante y sin llamar al modelo"""
+        response = entry['response']
+        logger.info(f"♻️  Foro: respuesta reutilizada para '{discussion.get('name')}' "
+                    f"(similitud {similarity:.2f} con la discusión {entry.get('discussion_id')})")
+        return dict(
+            {key: copy.deepcopy(response.get(key)) for key in FORUM_RESPONSE_FIELDS},
+            status='success',
+            discussion_id=discussion.get('id'),
+            discussion_name=discussion.get('name'),
+            proposed_response=personalize(response.get('proposed_response', ''), discussion.get('userfullname')),
+            fallback=False,
+            usage=TokenUsage().to_dict(),
+            reused_from=entry.get('discussion_id'),
+            similarity=similarity,
+            generated_at=datetime.now().isoformat()
+        )
+
+    def accept_forum_response(self, discussion: Dict[str, Any], response_text: str,
+                              context: Optional[str] = None, **fields):
+        """
+        Guarda la respuesta publicada o aprobada por el profesor para una discusión
+
+        Las respuestas aceptadas tienen preferencia sobre las generadas al reutilizar.
+
+        Args:
+            discussion: Discusión respondida (título y mensaje original)
+            response_text: Texto de la respuesta
+            context: Mismo contexto que en generate_forum_response (ámbito de reutilización)
+            **fields: Otros campos de la respuesta (key_points, resources, category...)
+        """
+        cache = self._get_response_cache()
+        if cache:
+            fields.setdefault('summary', response_text[:120])
+            response = dict(self._validate_forum_response(dict(fields, response=response_text)),
+                            proposed_response=response_text)
+            response.pop('response', None)
+            cache.add(question_text(discussion), response, context or "", source='accepted',
+                      discussion_id=discussion.get('id'))
+
     def _build_forum_response_prompt(self, 
                                      discussion: Dict[str, Any],
                                      posts: List[Dict[str, Any]],
@@ -1103,46 +1501,24 @@ NOTAS:
     
     def _query_forum_ai(self, prompt: str) -> Dict[str, Any]:
         """Kontsultatu IA foroen erantzunetarako"""
-        try:
-            if self.stream:
-                return self._query_forum_streaming(prompt)
-            else:
-                response = self.client.chat(
-                    model=self.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    format=FORUM_RESPONSE_SCHEMA,
-                    think=self.think
-                )
-                content = response['message']['content']
-                return json.loads(content)
-                
-        except Exception as e:
-            logger.error(f"Error forum AI query: {e}")
-            return self._get_default_forum_response()
+        return self._generate(self.forum_response_spec, prompt).data
     
-    def _query_forum_streaming(self, prompt: str) -> Dict[str, Any]:
-        """Streaming bidezko kontsulta foroentzat"""
-        try:
-            stream = self.client.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                format=FORUM_RESPONSE_SCHEMA,
-                think=self.think
-            )
-            
-            content = ''
-            for chunk in stream:
-                if hasattr(chunk.message, 'content') and chunk.message.content:
-                    content += chunk.message.content
-            
-            return json.loads(content)
-            
-        except json.JSONDecodeError:
-            logger.warning("Forum response not valid JSON")
-            return self._get_default_forum_response()
+    def _validate_forum_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Foro erantzuna balidatu: enum balioak eta eremu lehenetsiak"""
+        validated = self._get_default_forum_response()
+        validated.update({k: v for k, v in response.items() if k in validated and v is not None})
+        
+        enums = FORUM_RESPONSE_SCHEMA['properties']
+        for key, default in (('tone', 'friendly'), ('priority', 'medium'), ('category', 'other')):
+            if validated[key] not in enums[key]['enum']:
+                validated[key] = default
+        
+        if not validated['summary'] and validated['response']:
+            validated['summary'] = validated['response'][:120]
+        
+        return validated
     
-    def _get_default_forum_response(self) -> Dict[str, Any]:
+    def _get_default_forum_response(self, error_msg: str = "") -> Dict[str, Any]:
         """Foroen erantzun lehenetsia"""
         return {
             'response': 'No se pudo generar una respuesta automática.',
@@ -1157,35 +1533,74 @@ NOTAS:
     
     def analyze_forum_discussions(self, 
                                   discussions: List[Dict[str, Any]],
-                                  generate_responses: bool = True) -> Dict[str, Any]:
+                                  generate_responses: bool = True,
+                                  context: Optional[str] = None) -> Dict[str, Any]:
         """
         Analiza múltiples discusiones de foro y genera respuestas
         
+        Las preguntas casi iguales sin conversación previa se agrupan
+        (cluster_questions): se genera una respuesta por grupo y se reparte a cada
+        estudiante con su saludo. Los grupos se generan en paralelo.
+        
         Args:
             discussions: Lista de eztabaidak mezu guztiekin
             generate_responses: Erantzunak sortu ala ez
+            context: Testuinguru gehigarria (kurtsoa), generate_forum_response-rentzat
         
         Returns:
-            Analisi osoa erantzun proposamenekin
+            Analisi osoa erantzun proposamenekin; 'clusters' taldeekin (mezu finkatu baterako)
         """
         results = {
             'total_discussions': len(discussions),
             'by_priority': {'urgent': [], 'high': [], 'medium': [], 'low': []},
             'by_category': {},
             'responses': [],
+            'clusters': [],
             'analyzed_at': datetime.now().isoformat()
         }
         
-        for disc in discussions:
-            posts = disc.get('posts', [])
+        if generate_responses and discussions:
+            # Elkarrizketarik gabeko galderak bakarrik taldekatu; besteak bakarka
+            single = [i for i, disc in enumerate(discussions) if len(disc.get('posts', [])) <= 1]
+            groups = [[single[i] for i in cluster]
+                      for cluster in cluster_questions([question_text(discussions[i]) for i in single])]
+            groups += [[i] for i, disc in enumerate(discussions) if len(disc.get('posts', [])) > 1]
+            
+            # Talde bakoitzeko erantzun bat (lehen eztabaidarena), aldi berean
+            self._get_response_cache()  # hari guztiek indize bera partekatzeko
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                generated = list(executor.map(
+                    lambda group: self.generate_forum_response(discussions[group[0]],
+                                                               discussions[group[0]].get('posts', []), context),
+                    groups))
             
-            if generate_responses:
-                response = self.generate_forum_response(disc, posts)
+            responses = {}
+            for cluster_id, (group, response) in enumerate(zip(groups, generated)):
+                responses.update(self._fan_out_forum_response(discussions, group, response, cluster_id))
+                if len(group) > 1:
+                    results['clusters'].append({
+                        'cluster_id': cluster_id,
+                        'size': len(group),
+                        'discussion_ids': [discussions[i].get('id') for i in group],
+                        'names': [discussions[i].get('name') for i in group],
+                        'representative': discussions[group[0]].get('id'),
+                        'summary': response.get('summary', ''),
+                        # Mezu finkatu bakar baterako proposamena
+                        'pinned_post': f"Hola a todos, {strip_greeting(response.get('proposed_response', ''))}"
+                    })
+            results['clusters'].sort(key=lambda cluster: -cluster['size'])
+            if results['clusters']:
+                reused = sum(1 for response in generated if response.get('reused_from'))
+                logger.info(f"🧩 Foro: {len(discussions)} discusiones, {len(groups) - reused} respuesta(s) generadas, "
+                            f"{reused} reutilizada(s) | {len(results['clusters'])} grupo(s) de preguntas repetidas")
+            
+            for index, disc in enumerate(discussions):
+                response = responses[index]
                 results['responses'].append(response)
                 
                 # Klasifikatu lehentasunaren arabera
                 priority = response.get('priority', 'medium')
-                results['by_priority'][priority].append({
+                results['by_priority'].setdefault(priority, []).append({
                     'discussion_id': disc.get('id'),
                     'name': disc.get('name'),
                     'response': response
@@ -1201,11 +1616,37 @@ NOTAS:
         results['summary'] = {
             'urgent_count': len(results['by_priority']['urgent']),
             'high_count': len(results['by_priority']['high']),
-            'needs_immediate_attention': len(results['by_priority']['urgent']) + len(results['by_priority']['high'])
+            'needs_immediate_attention': len(results['by_priority']['urgent']) + len(results['by_priority']['high']),
+            # Talde bakoitzeko erantzun bat: modeloak sortua edo indizetik berrerabilia
+            'generated_responses': len({r.get('cluster') for r in results['responses'] if not r.get('reused_from')}),
+            'reused_responses': len({r.get('cluster') for r in results['responses'] if r.get('reused_from')}),
+            'clusters': len(results['clusters'])
         }
         
         return results
 
+    def _fan_out_forum_response(self, discussions: List[Dict[str, Any]], group: List[int],
+                                response: Dict[str, Any], cluster_id: int) -> Dict[int, Dict[str, Any]]:
+        """Respuesta del grupo para cada discusión, con su saludo y su parte del coste"""
+        share = TokenUsage.from_dict(response.get('usage')).scaled(1 / len(group)).to_dict()
+        fanned = {}
+        for position, index in enumerate(group):
+            disc = discussions[index]
+            if position == 0:
+                result = dict(response)
+            else:
+                result = copy.deepcopy(response)
+                result['discussion_id'] = disc.get('id')
+                result['discussion_name'] = disc.get('name')
+                if result.get('status') == 'success':
+                    result['proposed_response'] = personalize(result.get('proposed_response', ''),
+                                                              disc.get('userfullname'))
+            result['cluster'] = cluster_id
+            result['cluster_size'] = len(group)
+            result['usage'] = share
+            fanned[index] = result
+        return fanned
+
     # =========================================================================
     # FORO-TAREA EBALUAZIOA - Foroak tarea moduan ebaluatzeko
     # =========================================================================
@@ -1214,7 +1655,8 @@ NOTAS:
                                student_posts: List[Dict[str, Any]],
                                forum_info: Dict[str, Any],
                                task_criteria: Optional[str] = None,
-                               student_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+                               student_info: Optional[Dict[str, Any]] = None,
+                               metrics: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Ikasle baten foro partaidetza ebaluatu tarea moduan
         
@@ -1223,34 +1665,22 @@ NOTAS:
             forum_info: Foroaren informazioa (izena, deskribapena, gaia)
             task_criteria: Ebaluazio irizpideak (rubrika)
             student_info: Ikaslearen informazioa (izena, id, etab.)
+            metrics: Partaidetzaren metrika zehatzak (build_forum_metrics); None bada, mezuetatik
         
         Returns:
-            Dict ebaluazio osoarekin (nota, feedback, irizpideak, etab.)
+            Dict ebaluazio osoarekin (nota, feedback, irizpideak, metrikak, etab.)
         """
         try:
-            prompt = self._build_forum_task_prompt(student_posts, forum_info, task_criteria, student_info)
+            metrics = metrics or student_metrics(student_posts)
+            prompt = self._build_forum_task_prompt(student_posts, forum_info, task_criteria, student_info, metrics)
             
             # Ebaluazio schema erabili
-            response = self._query_forum_task_ai(prompt)
+            with self.engine.usage_scope() as usage:
+                response = self._query_forum_task_ai(prompt)
             
-            return {
-                'status': 'success',
-                'student_id': student_info.get('id') if student_info else None,
-                'student_name': student_info.get('fullname') if student_info else 'Desconocido',
-                'forum_id': forum_info.get('id'),
-                'forum_name': forum_info.get('name'),
-                'posts_evaluated': len(student_posts),
-                'evaluation': response,
-                'feedback': response.get('feedback', ''),
-                'grade': response.get('grade'),
-                'participation_quality': response.get('participation_quality', {}),
-                'strengths': response.get('strengths', []),
-                'weaknesses': response.get('weaknesses', []),
-                'recommendations': response.get('recommendations', []),
-                'meets_requirements': response.get('meets_requirements', False),
-                'summary': response.get('summary', ''),
-                'evaluated_at': datetime.now().isoformat()
-            }
+            result = self._build_forum_task_result(response, student_posts, forum_info, student_info, metrics)
+            result['usage'] = usage.to_dict()
+            return result
             
         except Exception as e:
             logger.error(f"Error ebaluatzen foro-tarea: {e}")
@@ -1260,128 +1690,218 @@ NOTAS:
                 'evaluated_at': datetime.now().isoformat()
             }
     
-    def _build_forum_task_prompt(self,
-                                  student_posts: List[Dict[str, Any]],
-                                  forum_info: Dict[str, Any],
-                                  task_criteria: Optional[str] = None,
-                                  student_info: Optional[Dict[str, Any]] = None) -> str:
-        """Sortu foro-tarea ebaluaziorako prompt-a"""
+    def _build_forum_task_result(self,
+                                 response: Dict[str, Any],
+                                 student_posts: List[Dict[str, Any]],
+                                 forum_info: Dict[str, Any],
+                                 student_info: Optional[Dict[str, Any]],
+                                 metrics: Dict[str, Any]) -> Dict[str, Any]:
+        """Foro-tarea ebaluazioaren emaitza-dict-a eraiki erantzun balidatutik"""
+        # Kalkula daitezkeenak ez zaizkio modeloari galdetzen
+        response['cited_sources'] = bool(metrics['urls'] or metrics['citations'])
+        response['responded_to_others'] = metrics['replies_given'] > 0
+        return {
+            'status': 'success',
+            'student_id': student_info.get('id') if student_info else None,
+            'student_name': student_info.get('fullname') if student_info else 'Desconocido',
+            'forum_id': forum_info.get('id'),
+            'forum_name': forum_info.get('name'),
+            'posts_evaluated': len(student_posts),
+            'metrics': metrics,
+            'evaluation': response,
+            'feedback': response.get('feedback', ''),
+            'grade': response.get('grade'),
+            'participation_quality': response.get('participation_quality', {}),
+            'strengths': response.get('strengths', []),
+            'weaknesses': response.get('weaknesses', []),
+            'recommendations': response.get('recommendations', []),
+            'meets_requirements': response.get('meets_requirements', False),
+            'summary': response.get('summary', ''),
+            'fallback': response.get('fallback', False),
+            'evaluated_at': datetime.now().isoformat()
+        }
+    
+    def evaluate_forum_tasks_packed(self,
+                                    students: List[Dict[str, Any]],
+                                    forum_info: Dict[str, Any],
+                                    task_criteria: Optional[str] = None) -> Dict[Any, Dict[str, Any]]:
+        """
+        Hainbat ikasleren foro-partaidetza labur eskaera bakarrean ebaluatu
         
-        prompt = """Eres un profesor evaluando la participación de un estudiante en un foro que funciona como tarea evaluable.
-Tu objetivo es evaluar de forma justa y constructiva la calidad de las aportaciones del estudiante.
-
-"""
+        Foroaren informazioa eta irizpideak behin bakarrik bidaltzen dira
+        `pack_size` ikasleko pakete bakoitzeko. Mezu luzeak dituzten ikasleak eta
+        paketearen erantzunean falta direnak banaka ebaluatzen dira.
         
-        # Foroaren informazioa
-        prompt += f"""INFORMACIÓN DEL FORO/TAREA:
+        Args:
+            students: [{'posts': [...], 'student_info': {'id': ..., 'fullname': ...}, 'metrics': {...}}, ...]
+            forum_info: Foroaren informazioa
+            task_criteria: Ebaluazio irizpideak
+        
+        Returns:
+            Dict {student_id: ebaluazioa} evaluate_forum_as_task-en formatu berean
+        """
+        results = {}
+        short = []
+        students = [dict(student, metrics=student.get('metrics') or student_metrics(student['posts']))
+                    for student in students]
+        evaluate = lambda student: self.evaluate_forum_as_task(student['posts'], forum_info, task_criteria,
+                                                               student['student_info'], student['metrics'])
+        
+        for student in students:
+            info = student['student_info']
+            if self.pack_size <= 1:
+                results[info['id']] = evaluate(student)
+                continue
+            size = sum(len(p.get('message', '')) for p in student['posts'])
+            if size <= PACK_MAX_CONTENT:
+                short.append(student)
+            else:
+                results[info['id']] = evaluate(student)
+        
+        for start in range(0, len(short), self.pack_size):
+            pack = short[start:start + self.pack_size]
+            if len(pack) == 1:
+                results[pack[0]['student_info']['id']] = evaluate(pack[0])
+                continue
+            
+            prompt = self._build_packed_forum_task_prompt(pack, forum_info, task_criteria)
+            generated = self._generate(self.packed_forum_task_spec, prompt,
+                                       max_output_tokens=self.max_output_tokens * len(pack),
+                                       timeout=self.timeout * len(pack))
+            by_student = self._match_packed_results(generated.data.get('results', []),
+                                                    [student['student_info']['id'] for student in pack])
+            logger.info(f"      📦 Paquete de {len(pack)} participaciones: {len(by_student)} resultado(s) válidos")
+            # Paketearen kostua ikasleen artean banatu
+            share = generated.metrics['usage'].scaled(1 / len(pack))
+            
+            for student in pack:
+                info = student['student_info']
+                response = by_student.get(info['id'])
+                if response is None:
+                    logger.info(f"      ↩️  {info['id']}: sin resultado en el paquete, evaluación individual")
+                    result = evaluate(student)
+                else:
+                    result = self._build_forum_task_result(response, student['posts'], forum_info, info,
+                                                           student['metrics'])
+                    result['packed'] = len(pack)
+                result['usage'] = TokenUsage.from_dict(result.get('usage')).add(share).to_dict()
+                results[info['id']] = result
+        
+        return results
+    
+    def _forum_task_header(self, forum_info: Dict[str, Any], task_criteria: Optional[str]) -> str:
+        """Foroaren informazioa eta irizpideak, prompt bakarrean eta paketatuan berdinak"""
+        header = f"""INFORMACIÓN DEL FORO/TAREA:
 - Nombre: {forum_info.get('name', 'Sin nombre')}
 - Tipo: {forum_info.get('type', 'general')}
 - Descripción/Instrucciones: {forum_info.get('intro', 'No disponible')}
 
 """
-        
-        # Irizpideak badaude
         if task_criteria:
-            prompt += f"""CRITERIOS DE EVALUACIÓN:
+            header += f"""CRITERIOS DE EVALUACIÓN:
 {task_criteria}
 
 """
-        
-        # Ikaslearen informazioa
-        if student_info:
-            prompt += f"""ESTUDIANTE:
-- Nombre: {student_info.get('fullname', 'Desconocido')}
-- ID: {student_info.get('id', 'N/A')}
+        return header
+    
+    @staticmethod
+    def _forum_task_posts(posts: List[Dict[str, Any]]) -> str:
+        """Ikaslearen mezuak, mota eta gaiarekin bakarrik (datak eta zenbaketak metriketan)"""
+        text = ""
+        for i, post in enumerate(posts, 1):
+            post_type = "respuesta" if (post.get('parentid') or 0) > 0 else "inicial"
+            text += f"""--- Mensaje {i} ({post_type}) | Asunto: {post.get('subject', 'Sin asunto')} ---
+{post.get('message', '')}
+"""
+        return text
+    
+    def _build_packed_forum_task_prompt(self,
+                                        pack: List[Dict[str, Any]],
+                                        forum_info: Dict[str, Any],
+                                        task_criteria: Optional[str] = None) -> str:
+        """Foro-tarea paketatuaren prompt-a: argibideak behin, ikasle bakoitzaren metrikak eta mezuak ondoren"""
+        prompt = f"""Eres un profesor evaluando la participación de {len(pack)} estudiantes en un foro que funciona como tarea evaluable.
+Evalúa a cada estudiante de forma independiente, justa y constructiva.
+
+{self._forum_task_header(forum_info, task_criteria)}"""
+        for student in pack:
+            info = student['student_info']
+            prompt += f"""=== ESTUDIANTE student_id={info['id']} ({info.get('fullname', 'Desconocido')}) ===
+MÉTRICAS: {format_metrics(student['metrics'])}
+{self._forum_task_posts(student['posts'])}=== FIN student_id={info['id']} ===
 
 """
         
-        # Ikaslearen mezuak
-        prompt += f"""APORTACIONES DEL ESTUDIANTE ({len(student_posts)} mensaje(s)):
+        prompt += f"""{FORUM_TASK_INSTRUCTIONS}
+Responde ÚNICAMENTE con un objeto JSON válido siguiendo el schema proporcionado:
+un objeto con "results", un array con EXACTAMENTE un elemento por cada uno de los
+{len(pack)} student_id anteriores, cada uno con su campo "student_id".
 """
-        
-        total_words = 0
-        for i, post in enumerate(student_posts, 1):
-            message = post.get('message', '')
-            word_count = len(message.split())
-            total_words += word_count
-            
-            is_reply = post.get('parentid', 0) > 0
-            post_type = "Respuesta a otro compañero" if is_reply else "Aportación inicial"
-            
-            prompt += f"""
---- Mensaje {i} ({post_type}) ---
-Fecha: {post.get('timecreated', 'Desconocida')}
-Asunto: {post.get('subject', 'Sin asunto')}
-Contenido:
-{message}
+        return prompt
+    
+    def _build_forum_task_prompt(self,
+                                  student_posts: List[Dict[str, Any]],
+                                  forum_info: Dict[str, Any],
+                                  task_criteria: Optional[str] = None,
+                                  student_info: Optional[Dict[str, Any]] = None,
+                                  metrics: Optional[Dict[str, Any]] = None) -> str:
+        """Sortu foro-tarea ebaluaziorako prompt-a (metrika zehatzak + mezuak, balorazio kualitatiborako)"""
+        metrics = metrics or student_metrics(student_posts)
+        prompt = f"""Eres un profesor evaluando la participación de un estudiante en un foro que funciona como tarea evaluable.
+Evalúa de forma justa y constructiva la calidad de sus aportaciones.
 
-"""
+{self._forum_task_header(forum_info, task_criteria)}"""
         
-        prompt += f"""
-ESTADÍSTICAS:
-- Total de mensajes: {len(student_posts)}
-- Total de palabras: {total_words}
-- Mensajes con respuesta a otros: {sum(1 for p in student_posts if p.get('parentid', 0) > 0)}
-
-"""
+        if student_info:
+            prompt += f"ESTUDIANTE: {student_info.get('fullname', 'Desconocido')} (ID: {student_info.get('id', 'N/A')})\n"
         
-        prompt += """INSTRUCCIONES DE EVALUACIÓN:
-1. Evalúa la relevancia de las aportaciones respecto al tema del foro
-2. Valora la profundidad del análisis y la argumentación
-3. Considera la originalidad y el valor añadido a la discusión
-4. Evalúa la claridad de la expresión escrita
-5. Valora la interacción con otros compañeros (si hay respuestas)
-6. Proporciona feedback constructivo y específico
-7. Sugiere áreas de mejora concretas
-8. Asigna una calificación de 0 a 10
+        prompt += f"""MÉTRICAS: {format_metrics(metrics)}
 
+APORTACIONES DEL ESTUDIANTE:
+{self._forum_task_posts(student_posts)}
+{FORUM_TASK_INSTRUCTIONS}
 Responde ÚNICAMENTE con un objeto JSON válido siguiendo el schema proporcionado.
 """
-        
         return prompt
     
     def _query_forum_task_ai(self, prompt: str) -> Dict[str, Any]:
         """Kontsultatu IA foro-tarea ebaluaziorako"""
-        try:
-            if self.stream:
-                return self._query_forum_task_streaming(prompt)
-            else:
-                response = self.client.chat(
-                    model=self.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    format=FORUM_TASK_EVALUATION_SCHEMA,
-                    think=self.think
-                )
-                content = response['message']['content']
-                return json.loads(content)
-                
-        except Exception as e:
-            logger.error(f"Error forum-task AI query: {e}")
-            return self._get_default_forum_task_response()
+        return self._generate(self.forum_task_spec, prompt).data
     
-    def _query_forum_task_streaming(self, prompt: str) -> Dict[str, Any]:
-        """Streaming bidezko kontsulta foro-tarearentzat"""
-        try:
-            stream = self.client.chat(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                format=FORUM_TASK_EVALUATION_SCHEMA,
-                think=self.think
-            )
-            
-            content = ''
-            for chunk in stream:
-                if hasattr(chunk.message, 'content') and chunk.message.content:
-                    content += chunk.message.content
-            
-            return json.loads(content)
-            
-        except json.JSONDecodeError:
-            logger.warning("Forum-task response not valid JSON")
-            return self._get_default_forum_task_response()
+    def _validate_forum_task_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
+        """Foro-tarea ebaluazioa balidatu: nota 0-10 eta kalitate-puntuazioak 1-5"""
+        validated = self._get_default_forum_task_response()
+        validated['summary'] = ''
+        validated.update({k: v for k, v in response.items() if k in validated and v is not None})
+        
+        if response.get('grade') is None:
+            validated['grade'] = None
+        else:
+            try:
+                validated['grade'] = max(0, min(10, float(response['grade'])))
+            except (ValueError, TypeError):
+                validated['grade'] = None
+        
+        quality = validated.get('participation_quality')
+        if not isinstance(quality, dict):
+            quality = {}
+        for key in ('relevance', 'depth', 'originality', 'clarity', 'interaction'):
+            if key not in quality:
+                quality[key] = 0
+                continue
+            try:
+                quality[key] = max(1, min(5, int(quality[key])))
+            except (ValueError, TypeError):
+                quality[key] = 0
+        validated['participation_quality'] = quality
+        
+        for key in ('strengths', 'weaknesses', 'recommendations'):
+            if not isinstance(validated[key], list):
+                validated[key] = [str(validated[key])]
+        
+        return validated
     
-    def _get_default_forum_task_response(self) -> Dict[str, Any]:
+    def _get_default_forum_task_response(self, error_msg: str = "") -> Dict[str, Any]:
         """Foro-tarea ebaluazioaren erantzun lehenetsia"""
         return {
             'feedback': 'No se pudo generar una evaluación automática.',
@@ -1450,6 +1970,9 @@ Responde ÚNICAMENTE con un objeto JSON válido siguiendo el schema proporcionad
                         }
                     students_posts[user_id]['posts'].append(post)
         
+        # Metrikak foro osorako behin (erantzun-grafoa ikasle guztien artean)
+        metrics = build_forum_metrics(forum_data.get('discussions', []))
+        
         # Ebaluatu ikasle bakoitza
         grades = []
         for user_id, data in students_posts.items():
@@ -1457,7 +1980,8 @@ Responde ÚNICAMENTE con un objeto JSON válido siguiendo el schema proporcionad
                 student_posts=data['posts'],
                 forum_info=forum_data,
                 task_criteria=task_criteria,
-                student_info=data['info']
+                student_info=data['info'],
+                metrics=metrics.get(user_id)
             )
             
             results['evaluations'].append(evaluation)
@@ -0,0 +1,130 @@
+"""
+Trabajos de análisis con IA: construcción, ejecución y guardado en el caché.
+
+`main.py --queue` encola los trabajos en lugar de analizar en línea y
+`worker.py` los ejecuta. Ambos usan estas funciones, así que el resultado en
+el caché es el mismo que con el análisis en línea.
+"""
+from typing import Any, Dict, Tuple
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+
+def submission_job(course_id: int, course_name: str, assignment_type: str, assignment_id: int,
+                   assignment_name: str, item: Dict[str, Any], criteria: str) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Trabajo de análisis de una entrega (assign o VPL)
+
+    Args:
+        course_id / course_name: Curso
+        assignment_type: 'assign' o 'vpl'
+        assignment_id / assignment_name: Tarea
+        item: Entrada de `pending` en main (user, submission, filenames, submission_data)
+        criteria: Criterios completos de evaluación
+
+    Returns:
+        (job_key, kind, payload) para JobQueue.enqueue
+    """
+    user = item['user']
+    payload = {
+        'course_id': course_id,
+        'course_name': course_name,
+        'assignment_type': assignment_type,
+        'assignment_id': assignment_id,
+        'assignment_name': assignment_name,
+        'student_id': user['id'],
+        'student_username': user['username'],
+        'submission': item['submission'],
+        'submission_data': item['submission_data'],
+        'filenames': item['filenames'],
+        'criteria': criteria
+    }
+    return f"{assignment_type}_{course_id}_{assignment_id}_{user['id']}", 'submission', payload
+
+
+def forum_task_job(course_id: int, course_name: str, forum: Dict[str, Any], item: Dict[str, Any],
+                   criteria: str) -> Tuple[str, str, Dict[str, Any]]:
+    """
+    Trabajo de evaluación de la participación de un estudiante en un foro-tarea
+
+    Args:
+        forum: Datos del foro (id, name, intro, type)
+        item: Entrada de `pending` en main (user, posts, cache_data, metrics, student_info)
+        criteria: Criterios del foro-tarea
+
+    Returns:
+        (job_key, kind, payload) para JobQueue.enqueue
+    """
+    student_id = item['student_info']['id']
+    payload = {
+        'course_id': course_id,
+        'course_name': course_name,
+        'assignment_type': 'forum_task',
+        'assignment_id': forum['id'],
+        'assignment_name': forum.get('name', 'Foro-tarea'),
+        'student_id': student_id,
+        'student_username': item['user']['username'],
+        'posts': item['posts'],
+        'cache_data': item['cache_data'],
+        'metrics': item.get('metrics'),
+        'student_info': item['student_info'],
+        'forum_info': {key: forum.get(key) for key in ('id', 'name', 'intro', 'type')},
+        'criteria': criteria
+    }
+    return f"forum_task_{course_id}_{forum['id']}_{student_id}", 'forum_task', payload
+
+
+def run_job(kind: str, payload: Dict[str, Any], ai_analyzer) -> Dict[str, Any]:
+    """Ejecuta el análisis de un trabajo y devuelve el resultado del analizador"""
+    if kind == 'submission':
+        return ai_analyzer.analyze_submission(payload['submission_data'], payload['criteria'])
+    if kind == 'forum_task':
+        return ai_analyzer.evaluate_forum_as_task(payload['posts'], payload['forum_info'],
+                                                  payload['criteria'], payload['student_info'],
+                                                  payload.get('metrics'))
+    raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+
+
+def persist_job_result(cache, kind: str, payload: Dict[str, Any], ai_analysis: Dict[str, Any]):
+    """Guarda el resultado en el caché de entregas con el mismo formato que main"""
+    if kind == 'submission':
+        cache.update(
+            course_id=payload['course_id'],
+            assignment_id=payload['assignment_id'],
+            student_id=payload['student_id'],
+            submission_data=payload['submission'],
+            assignment_type=payload['assignment_type'],
+            student_username=payload['student_username'],
+            assignment_name=payload['assignment_name'],
+            status="processed",
+            additional_info={
+                "files_downloaded": len(payload['filenames']),
+                "ai_analyzed": ai_analysis is not None,
+                "suggested_grade": ai_analysis.get('suggested_grade') if ai_analysis else None,
+                "ai_analysis": ai_analysis
+            }
+        )
+        return
+
+    cache_data = payload['cache_data']
+    cache.update(
+        course_id=payload['course_id'],
+        assignment_id=payload['assignment_id'],
+        student_id=payload['student_id'],
+        submission_data=cache_data,
+        assignment_type="forum_task",
+        student_username=payload['student_username'],
+        assignment_name=payload['assignment_name'],
+        status="processed",
+        additional_info={
+            "posts_count": len(payload['posts']),
+            "total_words": cache_data['total_words'],
+            "ai_analyzed": ai_analysis.get('status') == 'success',
+            "suggested_grade": ai_analysis.get('grade'),
+            "meets_requirements": ai_analysis.get('meets_requirements', False),
+            "participation_quality": ai_analysis.get('participation_quality', {}),
+            "ai_analysis": ai_analysis
+        }
+    )
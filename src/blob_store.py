@@ -0,0 +1,240 @@
+"""
+Almacén de archivos descargados direccionado por contenido.
+
+Cada archivo se guarda una sola vez en `BLOB_DIR/<sha[:2]>/<sha256>`, con el
+hash calculado durante la descarga. La ruta de cada estudiante
+(`downloads/<curso>/<tarea>/<estudiante>/<archivo>`) es un enlace duro al blob,
+o una copia si el sistema de ficheros no admite enlaces. Así, las plantillas y
+los datos compartidos que entregan muchos estudiantes ocupan disco una vez.
+
+El índice (`BLOB_DIR/index.json`) asocia cada archivo de Moodle (su URL sin
+token) con su blob, su `filesize` y su `timemodified`. Si Moodle devuelve los
+mismos metadatos y el blob existe, no se vuelve a descargar.
+
+Los archivos que llegan en base64 dentro de la respuesta (VPL) se decodifican
+por trozos: primero se calcula el hash y solo se escriben si el blob no existe.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from download_manager import DOWNLOAD_BUFFER_SIZE, DOWNLOAD_CHUNK_SIZE, DownloadManager, hash_file
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join("downloads", "blobs"))
+BLOB_INDEX_SAVE_INTERVAL = float(os.getenv("BLOB_INDEX_SAVE_INTERVAL", "5"))
+# base64 karaktereak zati bakoitzeko (4ren multiploa): deskodetuta ~DOWNLOAD_CHUNK_SIZE
+BASE64_CHUNK_CHARS = max(4, DOWNLOAD_CHUNK_SIZE // 3 * 4)
+
+
+def iter_base64(data, chunk_chars: int = BASE64_CHUNK_CHARS) -> Iterator[bytes]:
+    """Decodifica base64 por trozos, sin crear el contenido completo en memoria"""
+    for start in range(0, len(data), chunk_chars):
+        yield base64.b64decode(data[start:start + chunk_chars])
+
+
+def _hash_chunks(chunks: Iterable[bytes]) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def decode_base64(data) -> Tuple[Callable[[], Iterable[bytes]], str, int]:
+    """
+    Hash y tamaño del contenido en base64 de `data`, decodificando por trozos
+
+    Returns:
+        (función que devuelve los trozos decodificados, sha256, tamaño); si `data`
+        no es base64, el contenido es el propio texto
+    """
+    chunks: Callable[[], Iterable[bytes]] = lambda: iter_base64(data)
+    try:
+        sha256, size = _hash_chunks(chunks())
+    except (binascii.Error, ValueError):
+        # Zatika ez bada (lerro-jauziak...), osorik; hori ere ez bada base64, testu laua
+        try:
+            raw = base64.b64decode(data)
+        except (binascii.Error, ValueError):
+            raw = data.encode('utf-8') if isinstance(data, str) else data
+        chunks = lambda: (raw,)
+        sha256, size = _hash_chunks(chunks())
+    return chunks, sha256, size
+
+
+class BlobStore:
+    """Blobs por SHA-256 con vistas por estudiante y tarea"""
+
+    def __init__(self, downloads: DownloadManager, root: str = None):
+        self.downloads = downloads
+        self.root = root or BLOB_DIR
+        self.index_path = os.path.join(self.root, "index.json")
+        self.index: Dict[str, Dict[str, Any]] = self._load_index()
+        self._dirty = False
+        self._last_save = time.time()
+        self._lock = threading.Lock()
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Índice de blobs ilegible ({e}), se reconstruye al descargar")
+            return {}
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def is_current(self, key: str, filesize: Optional[int], timemodified: Optional[int] = None) -> bool:
+        """True si el archivo `key` ya está en el almacén con esos metadatos (no hace falta descargarlo)"""
+        entry = self.index.get(key)
+        return bool(entry and filesize is not None and entry.get('filesize') == filesize and
+                    entry.get('timemodified') == timemodified and os.path.exists(self.blob_path(entry['sha256'])))
+
+    @staticmethod
+    def _link(blob: str, view: str):
+        """Crea (o rehace) la vista del estudiante apuntando al blob"""
+        os.makedirs(os.path.dirname(view) or '.', exist_ok=True)
+        if os.path.exists(view):
+            if os.path.samefile(blob, view):
+                return
+            os.remove(view)
+        try:
+            os.link(blob, view)
+        except OSError:
+            # Esteka gogorrik gabeko fitxategi-sistema (edo beste unitate bat): kopiatu
+            shutil.copyfile(blob, view)
+
+    def fetch(self, url: str, view: str, key: str = None, filesize: Optional[int] = None,
+              timemodified: Optional[int] = None) -> str:
+        """
+        Deja el archivo de `url` en la ruta `view`, descargándolo solo si hace falta
+
+        Args:
+            url: URL de descarga (con token)
+            view: Ruta del archivo para el estudiante
+            key: Identificador estable del archivo en Moodle (URL sin token); por defecto `url`
+            filesize, timemodified: Metadatos de Moodle para omitir la descarga
+
+        Returns:
+            `view`
+        """
+        key = key or url
+        if self.is_current(key, filesize, timemodified):
+            self._link(self.blob_path(self.index[key]['sha256']), view)
+            self.downloads.count(skipped=1, bytes_saved=filesize)
+            return view
+
+        # Izen egonkorra: etendako deskarga hurrengo exekuzioan berrekiten da, baina bertsio berean
+        # bakarrik (izen bereko fitxategi berri batek ez du aurrekoaren zatia jarraitzen)
+        incoming = os.path.join(self.root, "incoming",
+                                hashlib.md5(f"{key}|{filesize}|{timemodified}".encode('utf-8')).hexdigest())
+        _, sha256 = self.downloads.download_hashed(url, incoming)
+        size = os.path.getsize(incoming)
+        blob = self.blob_path(sha256)
+
+        if os.path.exists(blob):
+            os.remove(incoming)
+            self.downloads.count(deduplicated=1)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(incoming, blob)
+
+        with self._lock:
+            self.index[key] = {'sha256': sha256, 'filesize': size if filesize is None else filesize,
+                               'timemodified': timemodified}
+            self._dirty = True
+        self._link(blob, view)
+        if time.time() - self._last_save >= BLOB_INDEX_SAVE_INTERVAL:
+            self.flush()
+        return view
+
+    def put_base64(self, data, view: str, exclude: Iterable[str] = ()) -> Optional[bool]:
+        """
+        Guarda en `view` el contenido en base64 de `data` (texto plano si no es base64)
+
+        Primero se decodifica por trozos solo para calcular el hash; si ese blob ya
+        existe (o la vista ya tiene ese contenido) no se escribe nada.
+
+        Args:
+            data: Contenido en base64
+            view: Ruta del archivo para el estudiante
+            exclude: Hashes que no se guardan (archivos del profesor)
+
+        Returns:
+            True si se ha escrito el blob, False si ya estaba en disco, None si está excluido
+        """
+        chunks, sha256, size = decode_base64(data)
+        if sha256 in exclude:
+            self.downloads.count(excluded=1)
+            return None
+
+        blob = self.blob_path(sha256)
+        if not os.path.exists(blob) and os.path.isfile(view) and os.path.getsize(view) == size and \
+                hash_file(view) == sha256:
+            # Aurreko exekuzio batek idatzitako bista: blob bihurtu, berriro idatzi gabe
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            self._link(view, blob)
+
+        if os.path.exists(blob):
+            self._link(blob, view)
+            self.downloads.count(deduplicated=1, bytes_saved=size)
+            return False
+
+        incoming = os.path.join(self.root, "incoming", f"{sha256}.{threading.get_ident()}")
+        os.makedirs(os.path.dirname(incoming), exist_ok=True)
+        with open(incoming, 'wb', buffering=DOWNLOAD_BUFFER_SIZE) as f:
+            for chunk in chunks():
+                f.write(chunk)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(incoming, blob)
+        self._link(blob, view)
+        return True
+
+    def fetch_many(self, items: List[Tuple[str, str, Dict[str, Any]]]) -> List[Any]:
+        """
+        Varios fetch() en paralelo en el pool de descargas
+
+        Args:
+            items: (url, vista, {'key', 'filesize', 'timemodified'})
+
+        Returns:
+            Por cada elemento, en el mismo orden, la vista o la excepción
+        """
+        return self.downloads.run_many(lambda url, view, meta: self.fetch(url, view, **meta), items)
+
+    def flush(self):
+        """Guarda el índice (fusionado con el del disco, por si otro proceso también descarga)"""
+        with self._lock:
+            if not self._dirty:
+                return
+            index = dict(self.index)
+            self._dirty = False
+            self._last_save = time.time()
+
+        on_disk = self._load_index()
+        on_disk.update(index)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(on_disk, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Archivos indexados, blobs distintos y bytes en disco"""
+        with self._lock:
+            entries = list(self.index.values())
+        blobs = {entry['sha256']: entry.get('filesize') or 0 for entry in entries}
+        return {'files': len(entries), 'blobs': len(blobs), 'blob_bytes': sum(blobs.values())}
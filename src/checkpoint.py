@@ -0,0 +1,132 @@
+"""
+Puntos de control de la ejecución por curso (`main.py --resume`).
+
+Cada curso guarda periódicamente en `CHECKPOINT_DIR/<curso>.json`:
+
+- el índice del curso (datos, usuarios y actividades), para no volver a pedirlo
+- las partes terminadas (entregas, quizzes, foros-tarea)
+- las entregas, quizzes y foros ya procesados dentro de la parte en curso
+- el RunState parcial: contadores, uso de tokens y las entradas por
+  estudiante que necesitan los informes de riesgo
+
+Una ejecución normal empieza borrando los puntos de control y los borra al
+terminar. Con `--resume` los cursos terminados se restauran sin tocar Moodle y
+el curso interrumpido sigue donde se quedó.
+"""
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+CHECKPOINT_INTERVAL = float(os.getenv("CHECKPOINT_INTERVAL", "30"))
+
+
+def checkpoint_path(course, directory: str = None) -> str:
+    return os.path.join(directory or CHECKPOINT_DIR, f"{str(course).strip()}.json")
+
+
+def clear_checkpoints(directory: str = None) -> int:
+    """Borra los puntos de control de la ejecución anterior; devuelve cuántos había"""
+    paths = glob.glob(os.path.join(directory or CHECKPOINT_DIR, "*.json"))
+    for path in paths:
+        os.remove(path)
+    return len(paths)
+
+
+class CourseCheckpoint:
+    """
+    Punto de control de un curso
+
+    `mark_done` se puede llamar desde cualquier hilo; `save` lo llama solo el
+    hilo que modifica el RunState (la etapa persist o el bucle principal), así
+    que el estado guardado y las claves terminadas son coherentes.
+    """
+
+    def __init__(self, course, directory: str = None, interval: float = None):
+        self.course = str(course).strip()
+        self.path = checkpoint_path(self.course, directory)
+        self.interval = CHECKPOINT_INTERVAL if interval is None else interval
+        self.data: Dict[str, Any] = {
+            'course': self.course,
+            'status': 'running',
+            'index': None,
+            'parts_done': [],
+            'state': None,
+            'pipeline': None
+        }
+        self.done = set()
+        self._lock = threading.Lock()
+        self._last_save = 0.0
+
+    @classmethod
+    def load(cls, course, directory: str = None) -> Optional['CourseCheckpoint']:
+        """Punto de control guardado del curso, o None si no hay (o no se puede leer)"""
+        checkpoint = cls(course, directory)
+        try:
+            with open(checkpoint.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Punto de control ilegible {checkpoint.path}: {e}")
+            return None
+        checkpoint.done = set(data.pop('done', []))
+        checkpoint.data.update(data)
+        return checkpoint
+
+    @property
+    def finished(self) -> bool:
+        return self.data['status'] == 'done'
+
+    def is_done(self, key: str) -> bool:
+        with self._lock:
+            return key in self.done
+
+    def mark_done(self, key: str):
+        with self._lock:
+            self.done.add(key)
+
+    def part_done(self, part: str) -> bool:
+        return part in self.data['parts_done']
+
+    def finish_part(self, part: str, get_state: Callable[[], Dict[str, Any]]):
+        """Marca una parte como terminada; sus claves ya no hacen falta"""
+        with self._lock:
+            self.data['parts_done'].append(part)
+            self.done.clear()
+        self.save(get_state, force=True)
+
+    def save(self, get_state: Callable[[], Dict[str, Any]], force: bool = False):
+        """
+        Guarda el punto de control si ha pasado `interval` desde el anterior
+
+        Args:
+            get_state: Devuelve el RunState serializado (solo se llama si se guarda)
+            force: Guardar ya (fin de una parte o del curso)
+        """
+        if not force and time.time() - self._last_save < self.interval:
+            return
+        self.data['state'] = get_state()
+        with self._lock:
+            data = dict(self.data, done=sorted(self.done), updated_at=time.time())
+
+        # Idatzi fitxategi batean eta ordezkatu: etenaldi batek ez du erdizka idatzitakorik uzten
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.time()
+
+    def finish(self, get_state: Callable[[], Dict[str, Any]], pipeline: Dict[str, Any]):
+        """Curso terminado: en --resume se restaura tal cual"""
+        self.data['status'] = 'done'
+        self.data['pipeline'] = pipeline
+        self.save(get_state, force=True)
@@ -0,0 +1,285 @@
+"""
+Modo daemon: procesa los cursos de forma continua con el estado en memoria.
+
+A diferencia de `main.py`, que se lanza desde cron y lo vuelve a cargar todo en
+cada ejecución, el daemon mantiene abiertos la sesión HTTP con Moodle, el caché
+de entregas, el índice de cada curso (usuarios y actividades, renovado cada
+`DAEMON_COURSE_TTL` segundos) y el modelo cargado en Ollama.
+
+Cada curso se consulta con un intervalo adaptativo:
+
+- `DAEMON_MIN_INTERVAL` si alguna actividad vence pronto o acaba de vencer
+- `DAEMON_POLL_INTERVAL` si en la última pasada hubo cambios
+- el intervalo se duplica en cada pasada sin cambios, hasta `DAEMON_MAX_INTERVAL`
+
+Uso:
+    python src/daemon.py                    # Estado en http://127.0.0.1:8765/status
+    python src/daemon.py --queue            # Encola los análisis para worker.py
+    python src/daemon.py --port 9000        # Otro puerto (0 = sin servidor de estado)
+
+Endpoints: /status (JSON), /metrics (formato Prometheus), /healthz
+"""
+import json
+import math
+import os
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from logger_config import get_main_logger
+from main import build_context, load_settings, run_course, format_usage, RunContext
+
+logger = get_main_logger()
+
+POLL_INTERVAL = float(os.getenv("DAEMON_POLL_INTERVAL", "900"))
+MIN_INTERVAL = float(os.getenv("DAEMON_MIN_INTERVAL", "120"))
+MAX_INTERVAL = float(os.getenv("DAEMON_MAX_INTERVAL", "3600"))
+# Bikoizketa kopurua MAX_INTERVAL-era iristeko; idle_polls handiagoak ez du tartea aldatzen
+MAX_DOUBLINGS = max(0, math.ceil(math.log2(MAX_INTERVAL / POLL_INTERVAL)))
+# Epemugaren inguruko leihoa: aurretik eta ondoren (atzerapenez bidalitakoak)
+DUE_WINDOW_BEFORE = float(os.getenv("DAEMON_DUE_WINDOW_BEFORE", str(24 * 3600)))
+DUE_WINDOW_AFTER = float(os.getenv("DAEMON_DUE_WINDOW_AFTER", str(2 * 3600)))
+COURSE_TTL = float(os.getenv("DAEMON_COURSE_TTL", "3600"))
+WARM_INTERVAL = float(os.getenv("DAEMON_WARM_INTERVAL", "1200"))
+KEEP_ALIVE = os.getenv("DAEMON_KEEP_ALIVE", "30m")
+STATUS_HOST = os.getenv("DAEMON_STATUS_HOST", "127.0.0.1")
+STATUS_PORT = int(os.getenv("DAEMON_STATUS_PORT", "8765"))
+
+
+@dataclass
+class CourseSchedule:
+    """Estado de sondeo de un curso"""
+    course: str
+    name: str = ''
+    interval: float = POLL_INTERVAL
+    next_poll: float = 0.0
+    polls: int = 0
+    idle_polls: int = 0
+    errors: int = 0
+    last_poll: float = 0.0
+    last_duration: float = 0.0
+    last_changes: int = 0
+    last_error: Optional[str] = None
+    reason: str = 'inicio'
+
+
+def next_interval(schedule: CourseSchedule, due_dates: List[int], now: float) -> Tuple[float, str]:
+    """
+    Intervalo hasta la próxima consulta del curso
+
+    Returns:
+        (segundos, motivo)
+    """
+    if any(now - DUE_WINDOW_AFTER <= due <= now + DUE_WINDOW_BEFORE for due in due_dates if due):
+        return MIN_INTERVAL, 'entrega próxima'
+    if schedule.last_changes:
+        return POLL_INTERVAL, 'cambios'
+    return min(MAX_INTERVAL, POLL_INTERVAL * 2 ** min(schedule.idle_polls, MAX_DOUBLINGS)), 'sin cambios'
+
+
+class MoodleDaemon:
+    """Bucle de sondeo con intervalo adaptativo por curso sobre un RunContext persistente"""
+
+    def __init__(self, ctx: RunContext, courses: List[str]):
+        self.ctx = ctx
+        self.schedules = {course: CourseSchedule(course=course) for course in courses}
+        self.started = time.time()
+        self.current: Optional[str] = None
+        self.last_warm = 0.0
+        self.totals = {'polls': 0, 'errors': 0, 'new_submissions': 0, 'unchanged_submissions': 0,
+                       'queued_jobs': 0, 'busy_seconds': 0.0}
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def stop(self, *args):
+        logger.info("⏹️  Deteniendo el daemon al terminar la pasada en curso...")
+        self._stop.set()
+
+    def _due_dates(self, course: str) -> List[int]:
+        index = self.ctx.courses.get(str(course)) or {}
+        return [activity.get('duedate', 0) for activity in index.get('activities') or []]
+
+    def poll(self, schedule: CourseSchedule):
+        """Procesa los cambios de un curso y programa su próxima consulta"""
+        # Langileek idatzitakoa ikusteko (ilara moduan emaitzak haiek gordetzen dituzte)
+        if self.ctx.job_queue:
+            self.ctx.cache.reload()
+
+        with self._lock:
+            self.current = schedule.course
+        started = time.time()
+        result = run_course(self.ctx, schedule.course)
+        duration = time.time() - started
+        state = result.state
+        changes = state.new_submissions
+
+        with self._lock:
+            self.current = None
+            schedule.polls += 1
+            schedule.last_poll = started
+            schedule.last_duration = round(duration, 2)
+            schedule.last_changes = changes
+            schedule.last_error = result.error
+            schedule.idle_polls = 0 if changes else schedule.idle_polls + 1
+            if result.course_info:
+                schedule.name = result.course_info.fullname
+            if result.error:
+                schedule.errors += 1
+                self.totals['errors'] += 1
+            self.totals['polls'] += 1
+            self.totals['new_submissions'] += changes
+            self.totals['unchanged_submissions'] += state.unchanged_submissions
+            self.totals['queued_jobs'] += state.queued_jobs
+            self.totals['busy_seconds'] += duration
+
+            now = time.time()
+            schedule.interval, schedule.reason = next_interval(schedule, self._due_dates(schedule.course), now)
+            schedule.next_poll = now + schedule.interval
+
+        logger.info(f"🔄 {schedule.name or schedule.course}: {changes} cambio(s) en {duration:.1f}s | "
+                    f"próxima en {schedule.interval / 60:.0f} min ({schedule.reason})")
+
+    def run(self):
+        """Bucle principal hasta stop()"""
+        logger.info(f"🟢 Daemon iniciado con {len(self.schedules)} curso(s)")
+        while not self._stop.is_set():
+            if time.time() - self.last_warm >= WARM_INTERVAL:
+                self.ctx.ai_analyzer.warm_up()
+                self.last_warm = time.time()
+
+            schedule = min(self.schedules.values(), key=lambda s: s.next_poll)
+            wait = schedule.next_poll - time.time()
+            if wait > 0:
+                # Itxaron, baina ez beroketa hurrengoa baino gehiago
+                self._stop.wait(min(wait, max(1.0, WARM_INTERVAL - (time.time() - self.last_warm))))
+                continue
+            try:
+                self.poll(schedule)
+            except Exception as e:
+                schedule.errors += 1
+                schedule.last_error = f"{type(e).__name__}: {e}"
+                schedule.next_poll = time.time() + MIN_INTERVAL
+                logger.error(f"❌ Error consultando el curso {schedule.course}: {schedule.last_error}")
+        logger.info("🔴 Daemon detenido")
+
+    def get_status(self) -> Dict[str, Any]:
+        """Estado del daemon y de cada curso (endpoint /status)"""
+        now = time.time()
+        with self._lock:
+            courses = []
+            for schedule in sorted(self.schedules.values(), key=lambda s: s.next_poll):
+                entry = asdict(schedule)
+                entry['next_poll_in'] = round(max(0.0, schedule.next_poll - now), 1)
+                entry['polling'] = schedule.course == self.current
+                courses.append(entry)
+            totals = dict(self.totals, busy_seconds=round(self.totals['busy_seconds'], 2))
+
+        usage = self.ctx.ai_analyzer.engine.get_usage()
+        return {
+            'uptime_seconds': round(now - self.started, 1),
+            'current_course': self.current,
+            'totals': totals,
+            'courses': courses,
+            'cache_entries': self.ctx.cache.get_stats()['total_entries'],
+            'usage': usage.to_dict(),
+            'usage_summary': format_usage(usage),
+            'job_queue': self.ctx.job_queue.stats() if self.ctx.job_queue else None,
+            'downloads': self.ctx.moodle_client.downloads.get_stats(),
+            'ollama_hosts': self.ctx.ai_analyzer.get_host_status()
+        }
+
+    def get_metrics(self) -> str:
+        """Métricas en formato de texto de Prometheus (endpoint /metrics)"""
+        status = self.get_status()
+        lines = [f"moodle_daemon_uptime_seconds {status['uptime_seconds']}"]
+        for key, value in status['totals'].items():
+            lines.append(f"moodle_daemon_{key}_total {value}")
+        for course in status['courses']:
+            label = f'course="{course["course"]}"'
+            lines.append(f"moodle_daemon_course_polls_total{{{label}}} {course['polls']}")
+            lines.append(f"moodle_daemon_course_errors_total{{{label}}} {course['errors']}")
+            lines.append(f"moodle_daemon_course_interval_seconds{{{label}}} {course['interval']}")
+            lines.append(f"moodle_daemon_course_last_duration_seconds{{{label}}} {course['last_duration']}")
+            lines.append(f"moodle_daemon_course_last_changes{{{label}}} {course['last_changes']}")
+        lines.append(f"moodle_daemon_cache_entries {status['cache_entries']}")
+        for key in ('calls', 'prompt_tokens', 'output_tokens', 'eval_seconds', 'model_loads'):
+            lines.append(f"moodle_daemon_llm_{key}_total {status['usage'].get(key, 0)}")
+        for key in ('files', 'bytes', 'resumed', 'retries', 'errors'):
+            lines.append(f"moodle_daemon_download_{key}_total {status['downloads'][key]}")
+        lines.append(f"moodle_daemon_downloads_active {status['downloads']['active']}")
+        for host in status['ollama_hosts']:
+            lines.append(f"moodle_daemon_ollama_healthy{{host=\"{host['host']}\"}} {int(bool(host['healthy']))}")
+        return "\n".join(lines) + "\n"
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    server_version = "MoodleDaemon/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        daemon = self.server.daemon
+        if self.path.startswith('/status'):
+            self._send(200, json.dumps(daemon.get_status(), ensure_ascii=False, default=str),
+                       'application/json')
+        elif self.path.startswith('/metrics'):
+            self._send(200, daemon.get_metrics(), 'text/plain; version=0.0.4')
+        elif self.path.startswith('/healthz'):
+            self._send(200, 'ok\n', 'text/plain')
+        else:
+            self._send(404, json.dumps({'error': 'not found'}), 'application/json')
+
+
+def start_status_server(daemon: MoodleDaemon, host: str, port: int) -> ThreadingHTTPServer:
+    """Servidor HTTP de estado en un hilo aparte"""
+    httpd = ThreadingHTTPServer((host, port), _StatusHandler)
+    httpd.daemon_threads = True
+    httpd.daemon = daemon
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    logger.info(f"📡 Estado en http://{host}:{httpd.server_address[1]}/status")
+    return httpd
+
+
+def main():
+    settings = load_settings()
+    settings['course_ttl'] = COURSE_TTL
+    # Pasaldi bakoitza osorik da: ez dago berrekiteko ezer
+    settings['checkpoint'] = False
+
+    port = STATUS_PORT
+    if '--port' in sys.argv:
+        index = sys.argv.index('--port')
+        if index + 1 < len(sys.argv):
+            port = int(sys.argv[index + 1])
+
+    ctx = build_context(settings)
+    # Modeloa kargatuta mantendu pasaldien artean (OLLAMA_KEEP_ALIVE-k lehentasuna du)
+    ctx.ai_analyzer.engine.keep_alive = ctx.ai_analyzer.engine.keep_alive or KEEP_ALIVE
+    daemon = MoodleDaemon(ctx, settings['courses'])
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    httpd = start_status_server(daemon, STATUS_HOST, port) if port else None
+    try:
+        daemon.run()
+    finally:
+        if httpd:
+            httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
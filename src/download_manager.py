@@ -0,0 +1,297 @@
+"""
+Gestor de descargas de archivos de Moodle.
+
+- Pool de hilos acotado (`DOWNLOAD_WORKERS`) y límite de conexiones por
+  servidor (`DOWNLOAD_PER_HOST`)
+- Escritura en bloques grandes (`DOWNLOAD_CHUNK_SIZE`) con un buffer de fichero amplio
+- Reanudación con HTTP Range: se descarga a `<destino>.part` y, si se corta,
+  el siguiente intento pide solo lo que falta. Con `If-Range` (ETag o
+  Last-Modified guardado junto al `.part`), si el archivo ha cambiado en el
+  servidor se descarga entero otra vez
+- Límite de ancho de banda opcional (`DOWNLOAD_MAX_MBPS`), si se quiere solo en
+  ciertas horas (`DOWNLOAD_CAP_HOURS`, p. ej. "8-20")
+- SHA-256 del contenido calculado durante la descarga (para blob_store)
+- Contadores de archivos, bytes, reanudaciones, reintentos y errores
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import requests
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "4"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+DOWNLOAD_BUFFER_SIZE = int(os.getenv("DOWNLOAD_BUFFER_SIZE", str(4 * 1024 * 1024)))
+DOWNLOAD_MAX_MBPS = float(os.getenv("DOWNLOAD_MAX_MBPS", "0"))
+DOWNLOAD_CAP_HOURS = os.getenv("DOWNLOAD_CAP_HOURS", "")
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+
+# Kontagailuak (get_stats): batu eta kendu daitezke ikastaroka kontatzeko
+COUNTERS = ('files', 'bytes', 'resumed', 'retries', 'errors', 'seconds', 'throttled_seconds',
+            'skipped', 'deduplicated', 'bytes_saved', 'excluded')
+
+
+class DownloadError(ConnectionError):
+    """Respuesta HTTP que no se arregla reintentando (403, 404...)"""
+
+
+def _validator(response: requests.Response) -> Optional[str]:
+    """ETag fuerte o Last-Modified de la respuesta, para reanudar con If-Range"""
+    etag = response.headers.get('ETag')
+    # If-Range ez du ETag ahularik onartzen (W/"...")
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def parse_hours(spec: str) -> Optional[Tuple[int, int]]:
+    """'8-20' → (8, 20); vacío → None (límite todo el día)"""
+    if not spec:
+        return None
+    start, end = spec.split('-', 1)
+    return int(start), int(end)
+
+
+class BandwidthLimiter:
+    """Cubo de tokens compartido por todos los hilos de descarga"""
+
+    def __init__(self, bytes_per_second: float, hours: Optional[Tuple[int, int]] = None):
+        self.rate = bytes_per_second
+        self.hours = hours
+        self._allowance = bytes_per_second
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def active(self) -> bool:
+        if self.rate <= 0:
+            return False
+        if not self.hours:
+            return True
+        start, end = self.hours
+        hour = datetime.now().hour
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def consume(self, size: int) -> float:
+        """Espera hasta poder transferir `size` bytes; devuelve los segundos esperados"""
+        if not self.active():
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= size
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class DownloadManager:
+    """Descargas concurrentes y reanudables sobre una sesión HTTP compartida"""
+
+    def __init__(self, session: requests.Session, workers: int = None, per_host: int = None,
+                 max_mbps: float = None, cap_hours: str = None, retries: int = None):
+        """
+        Args:
+            session: Sesión HTTP (la de MoodleClient, con su pool de conexiones)
+            workers: Descargas simultáneas en total
+            per_host: Descargas simultáneas por servidor
+            max_mbps: Límite de ancho de banda en MB/s (0 = sin límite)
+            cap_hours: Horas en las que se aplica el límite ("8-20"; vacío = siempre)
+            retries: Reintentos por archivo (cada uno reanuda desde lo descargado)
+        """
+        self.session = session
+        self.workers = workers or DOWNLOAD_WORKERS
+        self.per_host = per_host or DOWNLOAD_PER_HOST
+        self.retries = DOWNLOAD_RETRIES if retries is None else retries
+        max_mbps = DOWNLOAD_MAX_MBPS if max_mbps is None else max_mbps
+        self.limiter = BandwidthLimiter(max_mbps * 1024 * 1024,
+                                        parse_hours(DOWNLOAD_CAP_HOURS if cap_hours is None else cap_hours))
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+        self._host_slots: Dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, float] = {name: 0 for name in COUNTERS}
+        self._active = 0
+
+    def count(self, **values):
+        """Suma a los contadores (también los usa blob_store: omitidas y deduplicadas)"""
+        with self._lock:
+            for name, value in values.items():
+                self._stats[name] += value
+
+    def _slot(self, url: str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _fetch(self, url: str, part_path: str) -> Tuple[bool, str]:
+        """
+        Un intento de descarga a `part_path`, continuando lo que ya haya
+
+        Returns:
+            (True si se ha reanudado una descarga parcial, SHA-256 del archivo completo)
+        """
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': f"bytes={offset}-"} if offset else {}
+        validator_path = f"{part_path}.validator"
+        if offset and os.path.exists(validator_path):
+            # Zerbitzariko fitxategia aldatu bada, 200 osoa itzultzen du eta hasieratik idazten da
+            with open(validator_path, encoding='utf-8') as f:
+                headers['If-Range'] = f.read()
+
+        with self.session.get(url, stream=True, headers=headers,
+                              timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)) as response:
+            if response.status_code == 416:
+                # Tarteak fitxategiaren amaiera gainditzen du: osorik zegoen
+                return bool(offset), hash_file(part_path)
+            if response.status_code not in (200, 206):
+                error = ConnectionError if response.status_code >= 500 else DownloadError
+                raise error(f"Failed to download file from Moodle. Status code: {response.status_code}")
+
+            resumed = response.status_code == 206
+            if not resumed:
+                validator = _validator(response)
+                if validator:
+                    with open(validator_path, 'w', encoding='utf-8') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+            # Berrekitean, jada dagoen zatia ere hash-ean sartu
+            digest = hash_file(part_path, hashlib.sha256()) if resumed else hashlib.sha256()
+            mode = 'ab' if resumed else 'wb'
+            with open(part_path, mode, buffering=DOWNLOAD_BUFFER_SIZE) as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if chunk:
+                        throttled = self.limiter.consume(len(chunk))
+                        f.write(chunk)
+                        digest.update(chunk)
+                        self.count(bytes=len(chunk), throttled_seconds=throttled)
+        return resumed, digest.hexdigest()
+
+    def download(self, url: str, destination: str) -> str:
+        """
+        Descarga `url` en `destination` (en el hilo que llama)
+
+        Returns:
+            Ruta del archivo descargado
+
+        Raises:
+            ConnectionError / requests.RequestException si fallan todos los intentos
+        """
+        return self.download_hashed(url, destination)[0]
+
+    def download_hashed(self, url: str, destination: str) -> Tuple[str, str]:
+        """
+        Como download(), calculando el SHA-256 mientras se descarga
+
+        Returns:
+            (ruta, sha256 en hexadecimal)
+        """
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        part_path = f"{destination}.part"
+        started = time.time()
+
+        with self._slot(url):
+            with self._lock:
+                self._active += 1
+            try:
+                for attempt in range(self.retries + 1):
+                    try:
+                        resumed, sha256 = self._fetch(url, part_path)
+                        if resumed:
+                            self.count(resumed=1)
+                        break
+                    except DownloadError:
+                        self.count(errors=1)
+                        raise
+                    except (requests.RequestException, ConnectionError) as e:
+                        if attempt >= self.retries:
+                            self.count(errors=1)
+                            raise
+                        self.count(retries=1)
+                        logger.warning(f"  ↻ Descarga interrumpida ({e}), reintentando {os.path.basename(destination)}")
+                        time.sleep(min(2 ** attempt, 10))
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        os.replace(part_path, destination)
+        if os.path.exists(f"{part_path}.validator"):
+            os.remove(f"{part_path}.validator")
+        self.count(files=1, seconds=time.time() - started)
+        return destination, sha256
+
+    def download_many(self, items: List[Tuple[str, str]]) -> List[Union[str, Exception]]:
+        """
+        Descarga varios archivos en paralelo (pool compartido)
+
+        Returns:
+            Por cada (url, destino), en el mismo orden, la ruta o la excepción
+        """
+        return self.run_many(self.download, items)
+
+    def run_many(self, fn: Callable[..., Any], items: List[Tuple]) -> List[Any]:
+        """
+        Ejecuta fn(*item) para cada elemento en el pool de descargas
+
+        Returns:
+            Por cada elemento, en el mismo orden, el resultado o la excepción
+        """
+        futures = [self._executor.submit(fn, *item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores acumulados y descargas en curso"""
+        with self._lock:
+            stats = {name: round(value, 3) for name, value in self._stats.items()}
+            stats['active'] = self._active
+        stats['mb_per_second'] = round(stats['bytes'] / stats['seconds'] / 1024 / 1024, 2) if stats['seconds'] else None
+        stats['limit_active'] = self.limiter.active()
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def hash_file(path: str, digest=None):
+    """SHA-256 de un archivo (hexadecimal), o `digest` actualizado con su contenido si se pasa"""
+    result = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            result.update(block)
+    return result if digest is not None else result.hexdigest()
+
+
+def stats_delta(after: Dict[str, Any], before: Dict[str, Any]) -> Dict[str, float]:
+    """Contadores entre dos get_stats() (lo descargado durante un curso)"""
+    return {name: round(after.get(name, 0) - before.get(name, 0), 3) for name in COUNTERS}
+
+
+def merge_stats(stats_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Suma los contadores de varios cursos o procesos"""
+    total: Dict[str, Any] = {name: 0 for name in COUNTERS}
+    for stats in stats_list:
+        for name in COUNTERS:
+            total[name] += (stats or {}).get(name, 0)
+    total['mb_per_second'] = round(total['bytes'] / total['seconds'] / 1024 / 1024, 2) if total['seconds'] else None
+    return total
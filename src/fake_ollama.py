@@ -0,0 +1,308 @@
+"""
+Servidor Ollama falso para pruebas de rendimiento sin GPU.
+
+Implementa `/api/chat`, `/api/tags` y `/api/ps` con el mismo formato que
+Ollama (NDJSON en streaming, contadores de tokens y duraciones en la respuesta
+final). Genera un JSON que cumple el schema pedido en `format` y simula:
+
+- velocidad de generación (tokens/s) y tiempo hasta el primer token
+- errores HTTP 500 con una probabilidad dada
+- respuestas JSON mal formadas (truncadas o con texto basura) con una probabilidad dada
+
+Uso:
+    python src/fake_ollama.py --port 11500 --token-rate 80 --ttft 0.3 --error-rate 0.05 --malformed-rate 0.1
+"""
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class FakeOllamaConfig:
+    """Comportamiento simulado del servidor"""
+    token_rate: float = 200.0       # tokens por segundo
+    ttft: float = 0.05              # segundos hasta el primer token
+    error_rate: float = 0.0         # probabilidad de responder HTTP 500
+    malformed_rate: float = 0.0     # probabilidad de devolver JSON inválido
+    chars_per_token: int = 4
+    load_duration: float = 0.0      # tiempo de carga del modelo simulado (s)
+    seed: Optional[int] = None
+
+
+def sample_from_schema(schema: Dict[str, Any], rng: random.Random) -> Any:
+    """Genera un valor que cumple un JSON Schema sencillo (el subconjunto usado en ai_analyzer)"""
+    if 'enum' in schema:
+        return rng.choice(schema['enum'])
+
+    kind = schema.get('type')
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != 'null'), 'null')
+
+    if kind == 'object':
+        return {key: sample_from_schema(sub, rng) for key, sub in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items', {'type': 'string'}), rng)
+                for _ in range(rng.randint(1, 3))]
+    if kind in ('number', 'integer'):
+        low = schema.get('minimum', 0)
+        high = schema.get('maximum', 10)
+        return rng.randint(low, high) if kind == 'integer' else round(rng.uniform(low, high), 1)
+    if kind == 'boolean':
+        return rng.random() < 0.5
+    if kind == 'null':
+        return None
+    words = ['la', 'entrega', 'cumple', 'con', 'los', 'requisitos', 'aunque', 'falta',
+             'documentar', 'algunas', 'funciones', 'y', 'mejorar', 'la', 'estructura']
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(6, 30)))
+
+
+def _malform(text: str, rng: random.Random) -> str:
+    """Estropea una respuesta JSON de una de las formas que producen los modelos reales"""
+    mode = rng.choice(['truncated', 'garbage', 'unquoted'])
+    if mode == 'truncated':
+        return text[:max(1, len(text) // 2)]
+    if mode == 'garbage':
+        return "Claro, aquí tienes la evaluación:\n" + text[:-1] + ",,}"
+    return text.replace('"', '', 2)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeOllama/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    # ------------------------------------------------------------------
+    def _send_json(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fake = self.server.fake
+        if self.path.startswith('/api/tags'):
+            self._send_json(200, {'models': [{'name': m, 'model': m} for m in fake.models]})
+        elif self.path.startswith('/api/ps'):
+            self._send_json(200, {'models': [{'name': m, 'model': m} for m in fake.loaded]})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self.path.startswith('/api/chat'):
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        plan = fake.plan(request)
+
+        if plan['error']:
+            time.sleep(fake.config.ttft)
+            self._send_json(500, {'error': 'simulated server error'})
+            return
+
+        try:
+            if request.get('stream', True):
+                self._stream(request, plan)
+            else:
+                self._complete(request, plan)
+        except (BrokenPipeError, ConnectionResetError):
+            # Bezeroak konexioa itxi du (JSON itxita edo epea): sorkuntza gelditu
+            fake.record('cancelled')
+
+    def _final_fields(self, request: Dict[str, Any], plan: Dict[str, Any], eval_count: int,
+                      eval_seconds: float) -> Dict[str, Any]:
+        config = self.server.fake.config
+        return {
+            'done': True,
+            'done_reason': 'stop',
+            'total_duration': int((plan['load'] + config.ttft + eval_seconds) * 1e9),
+            'load_duration': int(plan['load'] * 1e9),
+            'prompt_eval_count': plan['prompt_tokens'],
+            'prompt_eval_duration': int(config.ttft * 1e9),
+            'eval_count': eval_count,
+            'eval_duration': int(eval_seconds * 1e9)
+        }
+
+    def _stream(self, request: Dict[str, Any], plan: Dict[str, Any]):
+        config = self.server.fake.config
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+
+        time.sleep(plan['load'] + config.ttft)
+        text = plan['text']
+        step = config.chars_per_token
+        delay = 1.0 / config.token_rate if config.token_rate > 0 else 0
+        started = time.monotonic()
+        tokens = 0
+
+        for i in range(0, len(text), step):
+            chunk = {
+                'model': request.get('model'),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'message': {'role': 'assistant', 'content': text[i:i + step]},
+                'done': False
+            }
+            self.wfile.write(json.dumps(chunk).encode('utf-8') + b'\n')
+            self.wfile.flush()
+            tokens += 1
+            if delay:
+                time.sleep(delay)
+
+        final = {
+            'model': request.get('model'),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'message': {'role': 'assistant', 'content': ''}
+        }
+        final.update(self._final_fields(request, plan, tokens, time.monotonic() - started))
+        self.wfile.write(json.dumps(final).encode('utf-8') + b'\n')
+        self.wfile.flush()
+        self.server.fake.record('completed')
+
+    def _complete(self, request: Dict[str, Any], plan: Dict[str, Any]):
+        config = self.server.fake.config
+        tokens = max(1, len(plan['text']) // config.chars_per_token)
+        eval_seconds = tokens / config.token_rate if config.token_rate > 0 else 0
+        time.sleep(plan['load'] + config.ttft + eval_seconds)
+
+        response = {
+            'model': request.get('model'),
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'message': {'role': 'assistant', 'content': plan['text']}
+        }
+        response.update(self._final_fields(request, plan, tokens, eval_seconds))
+        self._send_json(200, response)
+        self.server.fake.record('completed')
+
+
+class FakeOllamaServer:
+    """
+    Servidor Ollama falso en un hilo de fondo.
+
+    Uso:
+        with FakeOllamaServer(FakeOllamaConfig(token_rate=50)) as server:
+            analyzer = AIAnalyzer(host=server.url)
+    """
+
+    def __init__(self, config: Optional[FakeOllamaConfig] = None, host: str = '127.0.0.1', port: int = 0,
+                 models=('qwen3:30b-a3b', 'qwen3:4b')):
+        self.config = config or FakeOllamaConfig()
+        self.models = list(models)
+        self.loaded = set()
+        self.counters = {'requests': 0, 'errors': 0, 'malformed': 0, 'completed': 0, 'cancelled': 0}
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def plan(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Decide (de forma reproducible con `seed`) cómo responder a una petición"""
+        with self._lock:
+            self.counters['requests'] += 1
+            error = self._rng.random() < self.config.error_rate
+            if error:
+                self.counters['errors'] += 1
+                return {'error': True}
+
+            schema = request.get('format')
+            if isinstance(schema, dict):
+                data = sample_from_schema(schema, self._rng)
+            else:
+                data = {'response': sample_from_schema({'type': 'string'}, self._rng)}
+            text = json.dumps(data, ensure_ascii=False)
+
+            if self._rng.random() < self.config.malformed_rate:
+                self.counters['malformed'] += 1
+                text = _malform(text, self._rng)
+
+            model = request.get('model')
+            load = 0.0
+            if model not in self.loaded:
+                self.loaded.add(model)
+                load = self.config.load_duration
+
+        prompt_chars = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        return {
+            'error': False,
+            'text': text,
+            'load': load,
+            'prompt_tokens': max(1, prompt_chars // self.config.chars_per_token)
+        }
+
+    def record(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def start(self) -> 'FakeOllamaServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    """Lanza el servidor en primer plano (para usarlo con OLLAMA_HOST/OLLAMA_HOSTS)"""
+    config = FakeOllamaConfig()
+    port = 11500
+    options = {
+        '--token-rate': ('token_rate', float),
+        '--ttft': ('ttft', float),
+        '--error-rate': ('error_rate', float),
+        '--malformed-rate': ('malformed_rate', float),
+        '--load-duration': ('load_duration', float),
+        '--seed': ('seed', int)
+    }
+
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg == '--port' and i + 1 < len(sys.argv):
+            port = int(sys.argv[i + 1])
+            i += 2
+        elif arg in options and i + 1 < len(sys.argv):
+            field, cast = options[arg]
+            setattr(config, field, cast(sys.argv[i + 1]))
+            i += 2
+        else:
+            i += 1
+
+    server = FakeOllamaServer(config, port=port)
+    print(f"🧪 Fake Ollama escuchando en {server.url} ({config})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+        print(f"📊 {server.counters}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Métricas exactas de participación en un foro.
+
+Contar mensajes, palabras, respuestas o fuentes no necesita un modelo. Por cada
+foro se construye una vez el árbol de cada hilo (mensaje → padre) y el grafo de
+respuestas entre autores, y en una sola pasada por los mensajes se calculan las
+métricas de cada participante:
+
+- posts_count, threads_started, total_words
+- replies_given (a mensajes de otros), replies_received, peers (compañeros con
+  los que ha intercambiado respuestas)
+- median/mean_response_seconds: tiempo entre el mensaje al que responde y su respuesta
+- urls (enlaces citados), citations (referencias tipo "(Autor, 2020)"), attachments
+- first/last_post_time, last_modified
+
+Las métricas se pasan al prompt de evaluación, que solo pide al modelo los
+aspectos cualitativos. `fingerprint` saca de ellas la huella de la participación
+en el caché.
+"""
+import re
+import statistics
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+URL_PATTERN = re.compile(r"https?://[^\s\"'<>)\]]+")
+# Erreferentzia akademikoak: "(García, 2020)", "(Smith et al., 2019a)"
+CITATION_PATTERN = re.compile(r"\([A-ZÁÉÍÓÚÑ][^()\n]{0,60}?,\s*(?:19|20)\d{2}[a-z]?\)")
+
+
+def _new_metrics() -> Dict[str, Any]:
+    return {
+        'posts_count': 0,
+        'threads_started': 0,
+        'total_words': 0,
+        'replies_given': 0,
+        'replies_received': 0,
+        'peers': 0,
+        'median_response_seconds': None,
+        'mean_response_seconds': None,
+        'urls': [],
+        'citations': 0,
+        'attachments': 0,
+        'first_post_time': 0,
+        'last_post_time': 0,
+        'last_modified': 0
+    }
+
+
+def build_forum_metrics(discussions: Iterable[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Métricas de cada autor de un foro
+
+    Args:
+        discussions: Discusiones con sus mensajes (get_forum_with_student_posts()['discussions'])
+
+    Returns:
+        {user_id: métricas}
+    """
+    discussions = list(discussions)
+    # Hari-zuhaitza: mezu bakoitzaren egilea eta sorrera-data, gurasoa bilatzeko
+    by_id = {post['id']: post for disc in discussions for post in disc.get('posts', [])
+             if post.get('id') is not None}
+
+    metrics: Dict[int, Dict[str, Any]] = defaultdict(_new_metrics)
+    latencies: Dict[int, List[int]] = defaultdict(list)
+    urls: Dict[int, set] = defaultdict(set)
+    # Erantzun-grafoa: egile bakoitzak zeinekin elkarrizketatu duen
+    peers: Dict[int, set] = defaultdict(set)
+
+    for post in by_id.values():
+        author = (post.get('author') or {}).get('id')
+        if not author:
+            continue
+        entry = metrics[author]
+        created = post.get('timecreated') or 0
+        message = post.get('message') or ''
+
+        entry['posts_count'] += 1
+        entry['total_words'] += len(message.split())
+        entry['attachments'] += len(post.get('attachments') or [])
+        entry['citations'] += len(CITATION_PATTERN.findall(message))
+        urls[author].update(URL_PATTERN.findall(post.get('message_html') or message))
+        entry['first_post_time'] = min(entry['first_post_time'] or created, created)
+        entry['last_post_time'] = max(entry['last_post_time'], created)
+        entry['last_modified'] = max(entry['last_modified'], post.get('timemodified') or created)
+
+        parent = by_id.get(post.get('parentid') or 0)
+        if not (post.get('parentid') or 0):
+            entry['threads_started'] += 1
+            continue
+        parent_author = (parent or {}).get('author', {}).get('id')
+        if parent is None or not parent_author or parent_author == author:
+            # Norberaren mezuari erantzutea (edo guraso ezezaguna) ez da elkarrekintza
+            continue
+        entry['replies_given'] += 1
+        metrics[parent_author]['replies_received'] += 1
+        peers[author].add(parent_author)
+        peers[parent_author].add(author)
+        latencies[author].append(max(0, created - (parent.get('timecreated') or 0)))
+
+    for author, entry in metrics.items():
+        entry['peers'] = len(peers[author])
+        entry['urls'] = sorted(urls[author])
+        if latencies[author]:
+            entry['median_response_seconds'] = int(statistics.median(latencies[author]))
+            entry['mean_response_seconds'] = int(statistics.mean(latencies[author]))
+    return dict(metrics)
+
+
+def student_metrics(posts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Métricas de una lista de mensajes de un solo estudiante, sin el resto del foro"""
+    if not posts:
+        return _new_metrics()
+    author = (posts[0].get('author') or {}).get('id') or 0
+    posts = [dict(post, author={'id': author}) for post in posts]
+    entry = build_forum_metrics([{'posts': posts}]).get(author, _new_metrics())
+    # Foroaren gainerakoa gabe: bere mezuetako bati ez dagokion erantzuna besteei egindakoa da
+    own = {post.get('id') for post in posts}
+    entry['replies_given'] = sum(1 for post in posts if (post.get('parentid') or 0) and post['parentid'] not in own)
+    return entry
+
+
+def fingerprint(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Huella de la participación para SubmissionCache.has_changed
+
+    Son las mismas claves que antes de las métricas (mensajes, último mensaje y
+    palabras), así que las evaluaciones ya guardadas siguen valiendo. Si se ha
+    editado algún mensaje después del último, se añade `last_modified`.
+    """
+    data = {key: metrics[key] for key in ('posts_count', 'last_post_time', 'total_words')}
+    if metrics['last_modified'] > metrics['last_post_time']:
+        data['last_modified'] = metrics['last_modified']
+    return data
+
+
+def _duration(seconds: Optional[int]) -> str:
+    if seconds is None:
+        return '-'
+    if seconds < 3600:
+        return f"{seconds // 60} min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} días"
+
+
+def format_metrics(metrics: Dict[str, Any]) -> str:
+    """Resumen de una línea de las métricas para los prompts y los registros"""
+    return (f"Mensajes: {metrics['posts_count']} (hilos iniciados: {metrics['threads_started']}) | "
+            f"Palabras: {metrics['total_words']} | "
+            f"Respuestas a otros: {metrics['replies_given']} | Respuestas recibidas: {metrics['replies_received']} | "
+            f"Compañeros con los que interactúa: {metrics['peers']} | "
+            f"Tiempo de respuesta (mediana): {_duration(metrics['median_response_seconds'])} | "
+            f"Enlaces: {len(metrics['urls'])} | Citas: {metrics['citations']} | Adjuntos: {metrics['attachments']}")
@@ -0,0 +1,61 @@
+"""
+Copia local de los mensajes de los foros, para sincronizarlos por incrementos.
+
+Cada foro se guarda en `FORUM_STORE_DIR/<forum_id>.json` con, por discusión, su
+marca de agua (`timemodified`, `modified`, `numreplies`) y sus mensajes. En cada
+ejecución se listan las discusiones (solo metadatos) y se vuelven a pedir los
+mensajes únicamente de las discusiones nuevas o cuya marca ha cambiado. Las
+discusiones borradas en Moodle se quitan de la copia.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+FORUM_STORE_DIR = os.getenv("FORUM_STORE_DIR", "forum_store")
+
+
+def watermark(discussion: Dict[str, Any]) -> List[int]:
+    """Marca de agua de una discusión: cambia con cada mensaje nuevo, editado o borrado"""
+    return [discussion.get('timemodified', 0) or 0, discussion.get('modified', 0) or 0,
+            discussion.get('numreplies', 0) or 0]
+
+
+class ForumStore:
+    """Mensajes por discusión de cada foro, con su marca de agua"""
+
+    def __init__(self, root: str = None):
+        self.root = root or FORUM_STORE_DIR
+
+    def path(self, forum_id: int) -> str:
+        return os.path.join(self.root, f"{forum_id}.json")
+
+    def load(self, forum_id: int) -> Dict[str, Dict[str, Any]]:
+        """Discusiones guardadas del foro {str(discussion_id): {'watermark', 'name', 'posts'}}"""
+        try:
+            with open(self.path(forum_id), 'r', encoding='utf-8') as f:
+                return json.load(f).get('discussions', {})
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Copia del foro {forum_id} ilegible ({e}), se vuelve a descargar")
+            return {}
+
+    @staticmethod
+    def changed(stored: Dict[str, Dict[str, Any]], discussions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Discusiones del listado que no están en la copia o cuya marca de agua ha cambiado"""
+        return [disc for disc in discussions
+                if stored.get(str(disc['id']), {}).get('watermark') != watermark(disc)]
+
+    def save(self, forum_id: int, discussions: Dict[str, Dict[str, Any]]):
+        """Guarda la copia del foro (escritura atómica)"""
+        os.makedirs(self.root, exist_ok=True)
+        path = self.path(forum_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'forum_id': forum_id, 'discussions': discussions}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -0,0 +1,602 @@
+"""
+Motor de generación estructurada para las consultas a Ollama.
+
+Todas las rutas de AIAnalyzer (entregas, respuestas de foro y evaluación de
+foros-tarea) pasan por aquí: mismo manejo de errores, plazos por petición,
+reintentos acotados, límites de generación y métricas de tiempo por llamada.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, List, Optional
+
+from json_stream import IncrementalJSONParser, parse_first_object
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# JSON-a itxi ondoren irakurriko diren chunk gehienak, Ollama-ren azken chunk-a
+# (token kontagailuak eta iraupenak) jasotzeko
+DRAIN_CHUNKS = 16
+# Karga-denbora honetatik gora eredua berriro kargatu dela kontsideratzen da (segundoak)
+MODEL_LOAD_THRESHOLD = 0.5
+
+
+class GenerationTimeout(TimeoutError):
+    """La petición ha superado su plazo máximo"""
+
+
+@dataclass
+class GenerationSpec:
+    """
+    Describe un tipo de salida estructurada
+
+    Attributes:
+        name: Identificador corto (se usa en métricas y en la clave de caché)
+        schema: JSON Schema que se pasa a Ollama como `format`
+        validator: Normaliza el dict parseado (rangos, campos por defecto)
+        fallback: Construye la respuesta por defecto a partir de un mensaje de error
+        required_keys: Claves que identifican un objeto válido al extraerlo de texto libre
+    """
+    name: str
+    schema: Dict[str, Any]
+    validator: Callable[[Dict[str, Any]], Dict[str, Any]]
+    fallback: Callable[[str], Dict[str, Any]]
+    required_keys: List[str] = field(default_factory=list)
+
+
+@dataclass
+class TokenUsage:
+    """
+    Tokens y tiempos de GPU declarados por Ollama (sumables)
+
+    Attributes:
+        calls: Llamadas al modelo (incluye reintentos)
+        prompt_tokens: Tokens de entrada (`prompt_eval_count`)
+        output_tokens: Tokens generados (`eval_count`)
+        prompt_eval_seconds: Tiempo procesando el prompt
+        eval_seconds: Tiempo generando
+        load_seconds: Tiempo cargando el modelo
+        model_loads: Llamadas en las que el modelo se ha (re)cargado
+        estimated: Llamadas sin contadores de Ollama (stream cortado); solo se cuentan chunks
+    """
+    calls: int = 0
+    prompt_tokens: float = 0
+    output_tokens: float = 0
+    prompt_eval_seconds: float = 0.0
+    eval_seconds: float = 0.0
+    load_seconds: float = 0.0
+    model_loads: int = 0
+    estimated: int = 0
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'TokenUsage':
+        """Reconstruye el uso a partir de `to_dict()` (ignora los campos derivados)"""
+        usage = cls()
+        if data:
+            for f in fields(cls):
+                if data.get(f.name) is not None:
+                    setattr(usage, f.name, data[f.name])
+        return usage
+
+    def add(self, other) -> 'TokenUsage':
+        """Suma otro TokenUsage (o su dict) a este"""
+        if other is None:
+            return self
+        if isinstance(other, dict):
+            other = TokenUsage.from_dict(other)
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+        return self
+
+    def scaled(self, factor: float) -> 'TokenUsage':
+        """Parte proporcional (p. ej. la cuota de un estudiante en un prompt empaquetado)"""
+        return TokenUsage(**{f.name: getattr(self, f.name) * factor for f in fields(self)})
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {f.name: round(getattr(self, f.name), 3) for f in fields(self)}
+        data['output_tokens_per_second'] = (round(self.output_tokens / self.eval_seconds, 1)
+                                            if self.eval_seconds else None)
+        data['prompt_tokens_per_second'] = (round(self.prompt_tokens / self.prompt_eval_seconds, 1)
+                                            if self.prompt_eval_seconds else None)
+        return data
+
+
+def usage_from_response(response, fallback_output_tokens: int = 0) -> TokenUsage:
+    """
+    Extrae contadores y duraciones (ns) de una respuesta o del último chunk de Ollama
+
+    Args:
+        response: ChatResponse / dict de Ollama, o None si el stream se cortó antes del final
+        fallback_output_tokens: Chunks recibidos, usados como estimación si no hay contadores
+    """
+    def value(key):
+        if response is None:
+            return None
+        try:
+            return response[key]
+        except (KeyError, TypeError):
+            return getattr(response, key, None)
+
+    eval_count = value('eval_count')
+    if eval_count is None:
+        return TokenUsage(calls=1, output_tokens=fallback_output_tokens, estimated=1)
+
+    load_seconds = (value('load_duration') or 0) / 1e9
+    return TokenUsage(
+        calls=1,
+        prompt_tokens=value('prompt_eval_count') or 0,
+        output_tokens=eval_count,
+        prompt_eval_seconds=(value('prompt_eval_duration') or 0) / 1e9,
+        eval_seconds=(value('eval_duration') or 0) / 1e9,
+        load_seconds=load_seconds,
+        model_loads=1 if load_seconds >= MODEL_LOAD_THRESHOLD else 0
+    )
+
+
+@dataclass
+class GenerationResult:
+    """Resultado de una generación con sus métricas"""
+    data: Dict[str, Any]
+    ok: bool
+    attempts: int
+    error: Optional[str] = None
+    cached: bool = False
+    metrics: Dict[str, Any] = field(default_factory=dict)
+
+
+class GenerationEngine:
+    """
+    Ejecuta peticiones de generación estructurada contra un cliente Ollama.
+
+    - Plazo por petición (`timeout`): se aplica al cliente HTTP y, en streaming,
+      también entre chunks para cortar respuestas lentas.
+    - Reintentos acotados (`max_retries`) ante errores de red, plazos o JSON inválido.
+    - Opciones de generación `num_predict` / `num_ctx` en todas las llamadas.
+    - Semáforo de concurrencia compartido por todas las rutas.
+    - Caché LRU en memoria de resultados correctos (mismo modelo + schema + prompt).
+    """
+
+    def __init__(self,
+                 client,
+                 model: str,
+                 stream: bool = True,
+                 think: bool = False,
+                 max_output_tokens: int = 2048,
+                 num_ctx: Optional[int] = None,
+                 timeout: float = 300.0,
+                 max_retries: int = 2,
+                 max_concurrency: int = 2,
+                 cache_size: int = 128,
+                 keep_alive: Optional[str] = None):
+        """
+        Args:
+            client: ollama.Client ya configurado
+            model: Modelo por defecto
+            stream: Si usar streaming
+            think: Modo "thinking" del modelo
+            max_output_tokens: Límite de tokens de salida (num_predict y corte en streaming)
+            num_ctx: Tamaño de contexto (None = valor del servidor)
+            timeout: Segundos máximos por intento
+            max_retries: Reintentos adicionales tras el primer intento
+            max_concurrency: Peticiones simultáneas permitidas
+            cache_size: Entradas de la caché de resultados (0 para desactivarla)
+            keep_alive: Tiempo que Ollama mantiene el modelo cargado tras cada llamada
+                        (p. ej. "30m"; None = valor del servidor)
+        """
+        self.client = client
+        self.model = model
+        self.stream = stream
+        self.think = think
+        self.max_output_tokens = max_output_tokens
+        self.num_ctx = num_ctx
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache_size = cache_size
+        self.keep_alive = keep_alive
+
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._usage: Dict[str, TokenUsage] = {}
+        self._scopes = threading.local()
+
+    # ------------------------------------------------------------------
+    # API publikoa
+    # ------------------------------------------------------------------
+
+    def generate(self,
+                 spec: GenerationSpec,
+                 prompt: str,
+                 on_chunk: Optional[Callable[[str, bool], None]] = None,
+                 model: Optional[str] = None,
+                 max_output_tokens: Optional[int] = None,
+                 timeout: Optional[float] = None) -> GenerationResult:
+        """
+        Genera una respuesta estructurada según `spec`
+
+        Nunca lanza excepciones: si todos los intentos fallan devuelve
+        `spec.fallback(error)` con `ok=False` y la clave `fallback: True`.
+
+        Args:
+            spec: Tipo de salida (schema + validador)
+            prompt: Prompt completo
+            on_chunk: Callback (texto, es_thinking) en modo streaming
+            model: Modelo a usar en lugar del modelo por defecto
+            max_output_tokens: Límite de salida para esta llamada (p. ej. prompts empaquetados)
+            timeout: Plazo para esta llamada en segundos
+
+        Returns:
+            GenerationResult
+        """
+        model = model or self.model
+        limits = {
+            'max_output_tokens': max_output_tokens or self.max_output_tokens,
+            'timeout': timeout or self.timeout
+        }
+        cache_key = self._cache_key(model, spec, prompt)
+
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            logger.debug(f"  [{spec.name}] Resultado recuperado de caché")
+            self._record(spec.name, ok=True, attempts=0, duration=0.0, cached=True)
+            return GenerationResult(data=dict(cached), ok=True, attempts=0, cached=True,
+                                    metrics={'model': model, 'spec': spec.name, 'cached': True,
+                                             'usage': TokenUsage()})
+
+        started = time.monotonic()
+        last_error = None
+        raw_text = ''
+        attempts = 0
+        attempt_metrics: List[Dict[str, Any]] = []
+
+        for attempt in range(self.max_retries + 1):
+            attempts = attempt + 1
+            try:
+                with self._semaphore:
+                    raw_text, metrics = self._call(spec, prompt, model, on_chunk, limits)
+                attempt_metrics.append(metrics)
+
+                parsed = self._parse(raw_text, spec)
+                if parsed is None:
+                    last_error = "Respuesta no es JSON válido"
+                    logger.warning(f"  [{spec.name}] {last_error} (intento {attempts})")
+                    if metrics.get('stopped') == 'token_limit':
+                        # Muga berarekin berriro moztuko litzateke: hurrengo saiakerak bikoitza (eta epea ere)
+                        limits = {'max_output_tokens': limits['max_output_tokens'] * 2,
+                                  'timeout': limits['timeout'] * 2}
+                        last_error = f"Respuesta cortada por el límite de tokens ({metrics.get('chunks')})"
+                        logger.warning(f"  [{spec.name}] Reintento con límite de "
+                                       f"{limits['max_output_tokens']} tokens")
+                    continue
+
+                data = spec.validator(parsed)
+                duration = time.monotonic() - started
+                self._cache_put(cache_key, data)
+                summary = self._summarize(spec, model, attempts, duration, attempt_metrics)
+                self._record(spec.name, ok=True, attempts=attempts, duration=duration, usage=summary['usage'])
+                return GenerationResult(data=data, ok=True, attempts=attempts, metrics=summary)
+
+            except Exception as e:
+                last_error = str(e) or e.__class__.__name__
+                logger.warning(f"  [{spec.name}] Error en generación (intento {attempts}): {last_error}")
+
+            if attempt < self.max_retries:
+                time.sleep(min(2 ** attempt, 10))
+
+        duration = time.monotonic() - started
+        logger.error(f"  [{spec.name}] Generación fallida tras {attempts} intento(s): {last_error}")
+        summary = self._summarize(spec, model, attempts, duration, attempt_metrics)
+        self._record(spec.name, ok=False, attempts=attempts, duration=duration, usage=summary['usage'])
+        # Erantzun lehenetsia markatuta: deitzaileek (langileak) berriro saiatzeko erabiltzen dute
+        data = spec.fallback(raw_text or last_error or "")
+        data['fallback'] = True
+        return GenerationResult(data=data, ok=False, attempts=attempts, error=last_error, metrics=summary)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Métricas agregadas por tipo de generación"""
+        with self._lock:
+            stats = {}
+            for name, s in self._stats.items():
+                stats[name] = dict(s)
+                timed = s['calls'] - s['cache_hits']
+                stats[name]['avg_seconds'] = round(s['total_seconds'] / timed, 3) if timed else 0.0
+                stats[name]['usage'] = self._usage.get(name, TokenUsage()).to_dict()
+            return stats
+
+    def get_usage(self) -> TokenUsage:
+        """Uso total de tokens y tiempos de GPU de todas las llamadas del motor"""
+        total = TokenUsage()
+        with self._lock:
+            for usage in self._usage.values():
+                total.add(usage)
+        return total
+
+    @contextmanager
+    def usage_scope(self):
+        """
+        Acumula el uso de todas las generaciones hechas en este hilo dentro del bloque
+
+        Uso:
+            with engine.usage_scope() as usage:
+                engine.generate(...)
+            result['usage'] = usage.to_dict()
+        """
+        stack = getattr(self._scopes, 'stack', None)
+        if stack is None:
+            stack = self._scopes.stack = []
+        usage = TokenUsage()
+        stack.append(usage)
+        try:
+            yield usage
+        finally:
+            stack.remove(usage)
+
+    # ------------------------------------------------------------------
+    # Deiak
+    # ------------------------------------------------------------------
+
+    def _options(self, max_output_tokens: int) -> Dict[str, Any]:
+        """Opciones de generación comunes a todas las llamadas"""
+        options = {'num_predict': max_output_tokens}
+        if self.num_ctx:
+            options['num_ctx'] = self.num_ctx
+        return options
+
+    def _call(self, spec: GenerationSpec, prompt: str, model: str,
+              on_chunk: Optional[Callable[[str, bool], None]], limits: Dict[str, Any]):
+        """Un intento de generación; devuelve (texto, métricas)"""
+        started = time.monotonic()
+        kwargs = dict(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            format=spec.schema,
+            think=self.think,
+            options=self._options(limits['max_output_tokens'])
+        )
+        if self.keep_alive:
+            kwargs['keep_alive'] = self.keep_alive
+
+        if not self.stream:
+            response = self.client.chat(**kwargs)
+            content = response['message']['content']
+            return content, {
+                'seconds': round(time.monotonic() - started, 3),
+                'output_chars': len(content),
+                # num_predict-ek moztua
+                'stopped': 'token_limit' if response.get('done_reason') == 'length' else 'done',
+                'usage': usage_from_response(response)
+            }
+
+        stream = self.client.chat(stream=True, **kwargs)
+        parser, metrics = self._consume_stream(stream, on_chunk, started + limits['timeout'],
+                                               limits['max_output_tokens'])
+        metrics['seconds'] = round(time.monotonic() - started, 3)
+        return parser.raw_text, metrics
+
+    def _consume_stream(self, stream, on_chunk: Optional[Callable[[str, bool], None]],
+                        deadline: float, max_output_tokens: int):
+        """
+        Consume un stream de Ollama alimentando el parser JSON incremental
+
+        El stream se cancela en cuanto se cierra el objeto JSON de nivel superior,
+        cuando se supera `max_output_tokens` o cuando vence el plazo.
+
+        Returns:
+            (IncrementalJSONParser, métricas)
+        """
+        parser = IncrementalJSONParser()
+        in_thinking = False
+        thinking_chars = 0
+        tokens = 0
+        first_token_at = None
+        stopped = 'done'
+        final_chunk = None
+        drained = 0
+        started = time.monotonic()
+
+        try:
+            for chunk in stream:
+                if getattr(chunk, 'done', False):
+                    # Azken chunk-a: token kontagailuak eta iraupenak
+                    final_chunk = chunk
+                expired = time.monotonic() > deadline
+                if stopped == 'json_closed':
+                    # JSON itxita: azken chunk-aren zain, baina mugarekin (kopurua eta epea);
+                    # epea pasatuta ere erantzuna osoa da, ez da errorea
+                    drained += 1
+                    if final_chunk is not None or drained > DRAIN_CHUNKS or expired:
+                        break
+                    continue
+                if expired:
+                    raise GenerationTimeout(f"Plazo superado tras {tokens} tokens")
+
+                # Procesar thinking (si el modelo lo soporta)
+                if hasattr(chunk.message, 'thinking') and chunk.message.thinking:
+                    if not in_thinking:
+                        in_thinking = True
+                        logger.debug("  [Thinking mode activado]")
+
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    thinking_chars += len(chunk.message.thinking)
+                    tokens += 1
+
+                    if on_chunk:
+                        on_chunk(chunk.message.thinking, True)
+
+                # Procesar contenido normal
+                elif hasattr(chunk.message, 'content') and chunk.message.content:
+                    if in_thinking:
+                        in_thinking = False
+                        logger.debug("  [Thinking mode finalizado]")
+
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    tokens += 1
+                    done = parser.feed(chunk.message.content)
+
+                    if on_chunk:
+                        on_chunk(chunk.message.content, False)
+
+                    if done:
+                        stopped = 'json_closed'
+                        logger.debug(f"  Objeto JSON cerrado tras {tokens} tokens, esperando contadores finales")
+
+                if final_chunk is not None:
+                    break
+                if tokens >= max_output_tokens:
+                    stopped = 'token_limit'
+                    logger.warning(f"  Límite de {max_output_tokens} tokens alcanzado, cancelando generación")
+                    break
+        except GenerationTimeout as e:
+            # Pool-ak zerbitzaria markatu dezan (hurrengo saiakera beste batera doa)
+            mark_failed = getattr(stream, 'mark_failed', None)
+            if mark_failed:
+                mark_failed(e)
+            raise
+        finally:
+            # Itxi stream-a: konexioa mozten da eta zerbitzariak sorkuntza gelditzen du
+            close = getattr(stream, 'close', None)
+            if close:
+                close()
+
+        # Log del thinking si existió
+        if thinking_chars:
+            logger.debug(f"  Thinking del modelo ({thinking_chars} chars)")
+
+        metrics = {
+            'chunks': tokens,
+            'output_chars': parser.total_chars,
+            'thinking_chars': thinking_chars,
+            'ttft_seconds': round(first_token_at - started, 3) if first_token_at else None,
+            'stopped': stopped,
+            'usage': usage_from_response(final_chunk, fallback_output_tokens=tokens)
+        }
+        return parser, metrics
+
+    def _parse(self, text: str, spec: GenerationSpec) -> Optional[Dict[str, Any]]:
+        """Parsea la respuesta; si hay texto alrededor extrae el primer objeto válido"""
+        if not text:
+            return None
+
+        parser = IncrementalJSONParser()
+        parser.feed(text)
+        if parser.complete:
+            try:
+                parsed = parser.result()
+                if isinstance(parsed, dict):
+                    return parsed
+            except json.JSONDecodeError:
+                pass
+
+        logger.debug(f"  [{spec.name}] Respuesta no es JSON directo, intentando extraer")
+        return parse_first_object(text, required_keys=spec.required_keys or None)
+
+    # ------------------------------------------------------------------
+    # Cachea eta metrikak
+    # ------------------------------------------------------------------
+
+    def _cache_key(self, model: str, spec: GenerationSpec, prompt: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, spec.name, str(self.think), prompt):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.cache_size:
+            return None
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, key: str, data: Dict[str, Any]):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._cache[key] = dict(data)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _record(self, name: str, ok: bool, attempts: int, duration: float, cached: bool = False,
+                usage: Optional[TokenUsage] = None):
+        if usage is not None:
+            for scope in getattr(self._scopes, 'stack', None) or []:
+                scope.add(usage)
+        with self._lock:
+            if usage is not None:
+                self._usage.setdefault(name, TokenUsage()).add(usage)
+            s = self._stats.setdefault(name, {
+                'calls': 0, 'failures': 0, 'retries': 0, 'cache_hits': 0, 'total_seconds': 0.0
+            })
+            s['calls'] += 1
+            if cached:
+                s['cache_hits'] += 1
+                return
+            if not ok:
+                s['failures'] += 1
+            s['retries'] += max(0, attempts - 1)
+            s['total_seconds'] += duration
+
+    def _summarize(self, spec: GenerationSpec, model: str, attempts: int, duration: float,
+                   attempt_metrics: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Métricas de la llamada completa (todos los intentos)"""
+        last = attempt_metrics[-1] if attempt_metrics else {}
+        usage = TokenUsage()
+        for metrics in attempt_metrics:
+            usage.add(metrics.get('usage'))
+        summary = {
+            'spec': spec.name,
+            'model': model,
+            'attempts': attempts,
+            'total_seconds': round(duration, 3)
+        }
+        summary.update(last)
+        # Intentu guztien erabilera (berriro saiakerek ere GPU denbora kontsumitzen dute)
+        summary['usage'] = usage
+        logger.debug(f"  [{spec.name}] {summary}")
+        return summary
+
+
+# Motor baten get_stats() zenbagailu batugarriak
+STATS_COUNTERS = ('calls', 'failures', 'retries', 'cache_hits', 'total_seconds')
+
+
+def stats_delta(after: Dict[str, Dict[str, Any]], before: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Métricas de generación entre dos get_stats() (lo generado durante un curso)"""
+    delta = {}
+    for name, s in after.items():
+        old = before.get(name, {})
+        entry = {key: s.get(key, 0) - old.get(key, 0) for key in STATS_COUNTERS}
+        if not entry['calls']:
+            continue
+        entry['usage'] = TokenUsage.from_dict(s.get('usage')).add(
+            TokenUsage.from_dict(old.get('usage')).scaled(-1)).to_dict()
+        delta[name] = entry
+    return merge_stats([delta])
+
+
+def merge_stats(stats_list: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Suma las métricas de generación de varios cursos o procesos y recalcula las medias"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for stats in stats_list:
+        for name, s in (stats or {}).items():
+            total = merged.setdefault(name, dict({key: 0 for key in STATS_COUNTERS}, usage=TokenUsage()))
+            for key in STATS_COUNTERS:
+                total[key] += s.get(key, 0)
+            total['usage'].add(s.get('usage'))
+    for total in merged.values():
+        timed = total['calls'] - total['cache_hits']
+        total['total_seconds'] = round(total['total_seconds'], 3)
+        total['avg_seconds'] = round(total['total_seconds'] / timed, 3) if timed else 0.0
+        total['usage'] = total['usage'].to_dict()
+    return merged
@@ -0,0 +1,283 @@
+"""
+Cola de trabajos persistente (SQLite) para el análisis con IA.
+
+La fase de descarga encola un trabajo por entrega con todo lo necesario para
+analizarla (rutas de archivos, criterios, datos para el caché) y uno o varios
+workers (`python src/worker.py`) los consumen. Cada trabajo se reserva con un
+lease: si el worker muere, el lease caduca y otro worker lo retoma. Tras
+`max_attempts` fallos el trabajo pasa a estado `dead` (dead-letter).
+
+Estados: pending → leased → done | pending (reintento) | dead
+"""
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+JOB_QUEUE_DB = os.getenv("JOB_QUEUE_DB", "job_queue.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, available_at);
+"""
+
+
+class JobQueue:
+    """
+    Cola de trabajos con leases, reintentos y dead-letter sobre un fichero SQLite.
+
+    Cada operación abre su propia conexión, así que una instancia se puede
+    compartir entre hilos y varios procesos pueden usar el mismo fichero.
+    """
+
+    def __init__(self, db_path: str = None, lease_seconds: float = 1800.0, retry_delay: float = 30.0):
+        """
+        Args:
+            db_path: Fichero SQLite (por defecto desde env JOB_QUEUE_DB o job_queue.db)
+            lease_seconds: Duración de un lease antes de que otro worker pueda retomar el trabajo
+            retry_delay: Espera base antes de reintentar un trabajo fallido (se duplica en cada intento)
+        """
+        self.db_path = db_path or JOB_QUEUE_DB
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Transacción con bloqueo de escritura desde el inicio (BEGIN IMMEDIATE)"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        if job.get('result'):
+            job['result'] = json.loads(job['result'])
+        return job
+
+    # ------------------------------------------------------------------
+    # Ekoizlea
+    # ------------------------------------------------------------------
+
+    def enqueue(self, job_key: str, kind: str, payload: Dict[str, Any], max_attempts: int = 3) -> bool:
+        """
+        Encola un trabajo; si ya existe con la misma clave se actualiza
+
+        Un trabajo terminado o muerto vuelve a `pending` solo si el payload ha
+        cambiado (por ejemplo, el estudiante ha modificado la entrega). Un
+        trabajo reservado no se toca: el worker lo terminará con los datos que tiene.
+
+        Args:
+            job_key: Clave única (se usa la misma que en el caché de entregas)
+            kind: Tipo de trabajo ('submission', 'forum_task', ...)
+            payload: Datos del trabajo (serializables a JSON)
+            max_attempts: Intentos antes de pasar a dead-letter
+
+        Returns:
+            True si el trabajo queda pendiente de procesar
+        """
+        now = time.time()
+        data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status, payload FROM jobs WHERE job_key = ?", (job_key,)).fetchone()
+            if row is None:
+                conn.execute(
+                    "INSERT INTO jobs (job_key, kind, payload, max_attempts, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (job_key, kind, data, max_attempts, now, now))
+                return True
+            if row['status'] == 'leased':
+                return False
+            if row['status'] == 'pending' or row['payload'] != data:
+                conn.execute(
+                    "UPDATE jobs SET kind = ?, payload = ?, status = 'pending', attempts = 0, "
+                    "max_attempts = ?, available_at = 0, last_error = NULL, result = NULL, "
+                    "lease_owner = NULL, lease_expires = NULL, updated_at = ? WHERE job_key = ?",
+                    (kind, data, max_attempts, now, job_key))
+                return True
+            return False
+
+    # ------------------------------------------------------------------
+    # Langilea
+    # ------------------------------------------------------------------
+
+    def lease(self, worker_id: str, kinds: Optional[List[str]] = None,
+              lease_seconds: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """
+        Reserva el siguiente trabajo disponible
+
+        Son candidatos los trabajos pendientes cuyo reintento ya ha vencido y los
+        reservados cuyo lease ha caducado (worker caído).
+
+        Returns:
+            Dict del trabajo (con 'payload' ya decodificado) o None si no hay ninguno
+        """
+        now = time.time()
+        lease_seconds = lease_seconds or self.lease_seconds
+        query = ("SELECT * FROM jobs WHERE ((status = 'pending' AND available_at <= ?) "
+                 "OR (status = 'leased' AND lease_expires < ?))")
+        params: List[Any] = [now, now]
+        if kinds:
+            query += f" AND kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        query += " ORDER BY available_at, id LIMIT 1"
+
+        with self._transaction() as conn:
+            row = conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+            if row['status'] == 'leased':
+                logger.warning(f"  ⏰ Lease caducado de {row['lease_owner']} en {row['job_key']}, retomando")
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + lease_seconds, now, row['id']))
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+        return self._row_to_job(row)
+
+    def heartbeat(self, job_id: int, worker_id: str, lease_seconds: Optional[float] = None) -> bool:
+        """Prolonga el lease de un trabajo en curso; False si ya no pertenece a este worker"""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (now + (lease_seconds or self.lease_seconds), now, job_id, worker_id))
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        """Marca un trabajo como terminado"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, lease_owner = NULL, lease_expires = NULL, "
+                "last_error = NULL, updated_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 time.time(), job_id, worker_id))
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str) -> str:
+        """
+        Registra un fallo: reintento con espera exponencial o dead-letter
+
+        Returns:
+            Nuevo estado ('pending' o 'dead'), o '' si el lease ya no era de este worker
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (job_id, worker_id)).fetchone()
+            if row is None:
+                return ''
+            status = 'dead' if row['attempts'] >= row['max_attempts'] else 'pending'
+            delay = self.retry_delay * (2 ** (row['attempts'] - 1))
+            conn.execute(
+                "UPDATE jobs SET status = ?, last_error = ?, available_at = ?, lease_owner = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE id = ?",
+                (status, error, now + delay, now, job_id))
+        return status
+
+    # ------------------------------------------------------------------
+    # Kudeaketa
+    # ------------------------------------------------------------------
+
+    def stats(self) -> Dict[str, int]:
+        """Número de trabajos por estado"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'dead': 0}
+        counts.update({row['status']: row['n'] for row in rows})
+        return counts
+
+    def jobs(self, kinds: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Todos los trabajos (opcionalmente de ciertos tipos), en orden de creación"""
+        query = "SELECT * FROM jobs"
+        params: List[Any] = []
+        if kinds:
+            query += f" WHERE kind IN ({','.join('?' * len(kinds))})"
+            params.extend(kinds)
+        with self._connect() as conn:
+            rows = conn.execute(query + " ORDER BY id", params).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def release_leases(self, worker_id: Optional[str] = None) -> int:
+        """
+        Devuelve a `pending` los trabajos reservados sin esperar a que otro worker los retome
+
+        Args:
+            worker_id: Solo los leases de este worker (aunque no hayan caducado);
+                       sin él, todos los leases caducados
+
+        Returns:
+            Número de trabajos liberados
+        """
+        now = time.time()
+        query = ("UPDATE jobs SET status = 'pending', available_at = 0, lease_owner = NULL, "
+                 "lease_expires = NULL, updated_at = ? WHERE status = 'leased' AND ")
+        with self._transaction() as conn:
+            if worker_id:
+                cursor = conn.execute(query + "lease_owner = ?", (now, worker_id))
+            else:
+                cursor = conn.execute(query + "lease_expires < ?", (now, now))
+            return cursor.rowcount
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        """Trabajos que han agotado sus intentos"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE status = 'dead' ORDER BY updated_at").fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def requeue_dead(self) -> int:
+        """Devuelve los trabajos muertos a la cola con los intentos a cero"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, available_at = 0, updated_at = ? "
+                "WHERE status = 'dead'", (time.time(),))
+            return cursor.rowcount
+
+    def purge_done(self, older_than_seconds: float = 0) -> int:
+        """Elimina los trabajos terminados (opcionalmente solo los más antiguos)"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at <= ?",
+                                  (time.time() - older_than_seconds,))
+            return cursor.rowcount
@@ -0,0 +1,159 @@
+"""
+Parser JSON incremental para las respuestas en streaming del modelo.
+
+Consume los chunks a medida que llegan y detecta el momento exacto en que se
+cierra el objeto JSON de nivel superior, de forma que el stream se puede
+cancelar sin esperar a que el modelo termine de emitir espacios o texto basura.
+"""
+import json
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class IncrementalJSONParser:
+    """
+    Sigue la estructura de un objeto JSON carácter a carácter.
+
+    Ignora cualquier texto anterior a la primera llave de apertura (por ejemplo
+    un bloque ```json) y marca la respuesta como completa cuando la profundidad
+    vuelve a cero fuera de una cadena.
+
+    Uso:
+        parser = IncrementalJSONParser()
+        for chunk in stream:
+            if parser.feed(chunk):
+                break
+        data = parser.result()
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._raw: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self.complete = False
+        self.total_chars = 0
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Procesa un nuevo fragmento de texto.
+
+        Args:
+            chunk: Texto recibido del modelo
+
+        Returns:
+            True cuando el objeto de nivel superior ya se ha cerrado
+        """
+        if self.complete or not chunk:
+            return self.complete
+
+        self.total_chars += len(chunk)
+        self._raw.append(chunk)
+        start = 0
+
+        if not self._started:
+            start = chunk.find('{')
+            if start < 0:
+                return False
+            self._started = True
+
+        for i in range(start, len(chunk)):
+            char = chunk[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == '{' or char == '[':
+                self._depth += 1
+            elif char == '}' or char == ']':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._parts.append(chunk[start:i + 1])
+                    self.complete = True
+                    return True
+
+        self._parts.append(chunk[start:])
+        return False
+
+    @property
+    def started(self) -> bool:
+        """True si ya se ha visto la llave de apertura"""
+        return self._started
+
+    @property
+    def text(self) -> str:
+        """Texto acumulado desde la llave de apertura"""
+        return ''.join(self._parts)
+
+    @property
+    def raw_text(self) -> str:
+        """Todo el texto recibido, incluido lo anterior a la primera llave"""
+        return ''.join(self._raw)
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Devuelve el objeto parseado.
+
+        Raises:
+            json.JSONDecodeError: Si el objeto no está completo o no es válido
+        """
+        return json.loads(self.text)
+
+
+def iter_json_objects(text: str) -> Iterator[str]:
+    """
+    Recorre un texto y devuelve cada objeto JSON de nivel superior balanceado.
+
+    A diferencia de una expresión regular, soporta cualquier nivel de
+    anidamiento y llaves dentro de cadenas.
+
+    Args:
+        text: Texto que puede contener uno o más objetos JSON mezclados con otro texto
+
+    Yields:
+        El texto de cada objeto candidato (sin validar)
+    """
+    pos = text.find('{')
+    while pos >= 0:
+        parser = IncrementalJSONParser()
+        parser.feed(text[pos:])
+        if not parser.complete:
+            # Llave sin cerrar: probar desde la siguiente apertura
+            pos = text.find('{', pos + 1)
+            continue
+        candidate = parser.text
+        yield candidate
+        pos = text.find('{', pos + len(candidate))
+
+
+def parse_first_object(text: str, required_keys: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Devuelve el primer objeto JSON válido del texto que contenga alguna de las claves indicadas.
+
+    Args:
+        text: Texto a analizar
+        required_keys: Si se indica, el objeto debe contener al menos una de estas claves
+
+    Returns:
+        Dict parseado o None si no se encuentra ninguno
+    """
+    for candidate in iter_json_objects(text):
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+        if not isinstance(parsed, dict):
+            continue
+        if required_keys and not any(key in parsed for key in required_keys):
+            continue
+        return parsed
+    return None
@@ -3,16 +3,37 @@ from rubric_parser import RubricParser
 from ai_analyzer import AIAnalyzer
 from report_generator import ReportGenerator
 from submission_cache import SubmissionCache
+from generation import TokenUsage
+import generation
+import ollama_pool
+from job_queue import JobQueue
+from analysis_jobs import submission_job, forum_task_job
+from forum_analytics import build_forum_metrics, fingerprint, format_metrics, student_metrics
+from pipeline import Stage, StagedPipeline, merge_stats
+import download_manager
+from sharding import (open_shard_queue, plan_units, run_shard_worker, default_run_id, collect_run_results,
+                      COURSE_PARTS, SHARD_DB)
+from run_planner import RunPlanner, load_history, print_plan
+from checkpoint import CourseCheckpoint, clear_checkpoints
+from roster import UserDirectory
 from logger_config import get_main_logger
 from dotenv import load_dotenv
+from datetime import datetime
 import os
+import sys
+import json
+import time
 import logging
-from dataclasses import dataclass
-from typing import List, Dict, Any
+from dataclasses import dataclass, field, asdict
+from typing import List, Dict, Any, Optional
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 logger = get_main_logger()
 
+# --queue: estado de la ejecución para generar los informes cuando se vacíe la cola (--queue-report)
+QUEUE_STATE_FILE = os.getenv("QUEUE_STATE_FILE", "queue_run_state.json")
+
 @dataclass
 class SubmissionInfo:
     course_id: int
@@ -30,419 +51,641 @@ class CourseInfo:
     shortname: str
 
 
-def main():
-    # load environment variables
-    load_dotenv()
-    MOODLE_URL = os.getenv("MOODLE_URL")
-    TOKEN_MOODLE = os.getenv("TOKEN_MOODLE")
-    COURSE_LIST = os.getenv("COURSE_LIST").split(",")
-
-    # Initialize Moodle client, cache system, AI analyzer and report generator
-    moodle_client = MoodleClient(MOODLE_URL,TOKEN_MOODLE)
-    moodle_client.connect()
-    cache = SubmissionCache("submission_cache.json")
-    ai_analyzer = AIAnalyzer(model="qwen3:30b-a3b",think=False)
-    report_generator = ReportGenerator(output_dir="reports")
-    
-    # Mostrar estadísticas del caché al inicio
-    stats = cache.get_stats()
-    logger.info("="*60)
-    logger.info("ESTADÍSTICAS DEL CACHÉ")
-    logger.info("="*60)
-    logger.info(f"Total de entregas en caché: {stats['total_entries']}")
-    if stats['by_status']:
-        logger.info(f"Por estado: {stats['by_status']}")
-    logger.info("="*60 + "\n")
-    
-    submissions_info = []
-    new_submissions = 0
-    unchanged_submissions = 0
-    
+@dataclass
+class RunState:
+    """Resultados y contadores acumulados de toda la ejecución"""
+    submissions_info: List[Dict[str, Any]] = field(default_factory=list)
     # Almacenar entregas por estudiante para análisis
-    student_submissions_map = defaultdict(list)
-
-    for course in COURSE_LIST:
-        course_data = moodle_client.get_courses(course)
-        course_info = CourseInfo(
-            course_data['courses'][0]['id'],
-            course_data['courses'][0]['fullname'],
-            course_data['courses'][0]['shortname']
+    student_submissions_map: Dict[int, List[Dict[str, Any]]] = field(default_factory=lambda: defaultdict(list))
+    users: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    new_submissions: int = 0
+    unchanged_submissions: int = 0
+    queued_jobs: int = 0
+    # Token eta denbora kontabilitatea (ikastaroka eta zereginka)
+    usage_by_course: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    usage_by_assignment: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def merge(self, other: 'RunState'):
+        """Añade los resultados de otro curso (o de otro proceso) a este estado"""
+        self.submissions_info.extend(other.submissions_info)
+        for student_id, entries in other.student_submissions_map.items():
+            self.student_submissions_map[student_id].extend(entries)
+        for user_id, user in other.users.items():
+            self.users.setdefault(user_id, user)
+        self.new_submissions += other.new_submissions
+        self.unchanged_submissions += other.unchanged_submissions
+        self.queued_jobs += other.queued_jobs
+        for totals, others in ((self.usage_by_course, other.usage_by_course),
+                               (self.usage_by_assignment, other.usage_by_assignment)):
+            for key, entry in others.items():
+                if key in totals:
+                    totals[key]['usage'].add(entry['usage'])
+                else:
+                    totals[key] = entry
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Estado serializable a JSON (puntos de control)"""
+        return {
+            'submissions_info': self.submissions_info,
+            'student_submissions_map': {str(k): v for k, v in self.student_submissions_map.items()},
+            'users': {str(k): v for k, v in self.users.items()},
+            'new_submissions': self.new_submissions,
+            'unchanged_submissions': self.unchanged_submissions,
+            'queued_jobs': self.queued_jobs,
+            'usage_by_course': {k: dict(v, usage=v['usage'].to_dict()) for k, v in self.usage_by_course.items()},
+            'usage_by_assignment': {k: dict(v, usage=v['usage'].to_dict())
+                                    for k, v in self.usage_by_assignment.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'RunState':
+        """Reconstruye el estado guardado con `to_dict()`"""
+        state = cls(
+            submissions_info=list(data.get('submissions_info', [])),
+            users={int(k): v for k, v in data.get('users', {}).items()},
+            new_submissions=data.get('new_submissions', 0),
+            unchanged_submissions=data.get('unchanged_submissions', 0),
+            queued_jobs=data.get('queued_jobs', 0),
+            usage_by_course={k: dict(v, usage=TokenUsage.from_dict(v['usage']))
+                             for k, v in data.get('usage_by_course', {}).items()},
+            usage_by_assignment={k: dict(v, usage=TokenUsage.from_dict(v['usage']))
+                                 for k, v in data.get('usage_by_assignment', {}).items()}
         )
-        logger.info(f"Processing Course: {course_info.fullname} (ID: {course_info.course_id})")
-        # Get enrolled users and assignments for the course
-        enrolled_users = moodle_client.get_users(course_info.course_id)
-        assignments = moodle_client.get_assignmets(course_info.course_id)
-
-        # Process each assignment and its submissions for each user download files
-        # asegurarse de que existan asignaciones
-        if "courses" not in assignments or not assignments["courses"] or "assignments" not in assignments["courses"][0]:
-            logger.info(f"No se encontraron asignaciones en el curso {course_info.fullname} (ID: {course_info.course_id})")
+        for student_id, entries in data.get('student_submissions_map', {}).items():
+            state.student_submissions_map[int(student_id)].extend(entries)
+        return state
+
+    def total_usage(self) -> TokenUsage:
+        """Uso de tokens de todos los cursos del estado"""
+        usage = TokenUsage()
+        for entry in self.usage_by_course.values():
+            usage.add(entry['usage'])
+        return usage
+
+
+@dataclass
+class RunContext:
+    """Servicios compartidos por todas las fases de la ejecución"""
+    moodle_client: MoodleClient
+    cache: SubmissionCache
+    ai_analyzer: AIAnalyzer
+    job_queue: Optional[JobQueue]
+    state: RunState
+    settings: Dict[str, Any] = field(default_factory=dict)
+    pipeline: Optional[StagedPipeline] = None
+    # Ikastaroen indizea (ikastaroa, erabiltzaileak, jarduerak); `course_ttl` > 0 denean berrerabiltzen da
+    courses: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # Uneko ikastaroaren kontrol-puntua (--resume); None modu daemon eta shard-ean
+    checkpoint: Optional[CourseCheckpoint] = None
+    # Matrikulatuak rolka, ikastaroen artean partekatuak (TTL-arekin)
+    directory: Optional[UserDirectory] = None
+
+
+@dataclass
+class CourseResult:
+    """Resultado de procesar un curso; se devuelve al proceso principal en modo --processes"""
+    course: str
+    course_info: Optional[CourseInfo] = None
+    state: RunState = field(default_factory=RunState)
+    pipeline: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    downloads: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    # Kontrol-puntutik berreskuratutako tokenak (ez daude prozesu honetako motorraren kontuetan)
+    resumed_usage: Optional[TokenUsage] = None
+    # Prozesu umearen sorkuntza-metrikak eta Ollama zerbitzariak ikastaro honetan (--processes)
+    generation: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    hosts: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def track_usage(usage_totals: Dict[str, Dict[str, Any]], key: str, info: Dict[str, Any], ai_analysis):
+    """Suma el uso de tokens de un análisis al total de `key` (curso o tarea)"""
+    usage = (ai_analysis or {}).get('usage')
+    if not usage:
+        return
+    entry = usage_totals.setdefault(key, dict(info, usage=TokenUsage()))
+    entry['usage'].add(usage)
+
+
+def checkpoint_item(ctx: RunContext, key: str, save: bool = True):
+    """Marca un elemento como procesado en el punto de control (y lo guarda si toca)"""
+    if ctx.checkpoint:
+        ctx.checkpoint.mark_done(key)
+        if save:
+            ctx.checkpoint.save(ctx.state.to_dict)
+
+
+def format_usage(usage: TokenUsage) -> str:
+    """Línea legible con tokens, velocidad y carga del modelo"""
+    data = usage.to_dict()
+    speed = f"{data['output_tokens_per_second']} tok/s" if data['output_tokens_per_second'] else "- tok/s"
+    line = (f"{data['calls']} llamadas | entrada {int(usage.prompt_tokens)} tok | "
+            f"salida {int(usage.output_tokens)} tok | {speed} | "
+            f"GPU {usage.prompt_eval_seconds + usage.eval_seconds:.1f}s | carga {usage.load_seconds:.1f}s")
+    if usage.model_loads:
+        line += f" | ⚠️ {usage.model_loads} carga(s) del modelo"
+    if usage.estimated:
+        line += f" | {usage.estimated} sin contadores"
+    return line
+
+
+# =============================================================================
+# TAREAS Y VPL: pipeline consulta → descarga → análisis → guardado
+# =============================================================================
+
+def get_assign_activities(ctx: RunContext, course_info: CourseInfo) -> List[Dict[str, Any]]:
+    """Tareas (mod_assign) del curso con sus criterios completos (descripción + rubrika)"""
+    moodle_client = ctx.moodle_client
+    assignments = moodle_client.get_assignmets(course_info.course_id)
+
+    # asegurarse de que existan asignaciones
+    if "courses" not in assignments or not assignments["courses"] or "assignments" not in assignments["courses"][0]:
+        logger.info(f"No se encontraron asignaciones en el curso {course_info.fullname} (ID: {course_info.course_id})")
+        return []
+
+    logger.info(f"\nEncontradas {len(assignments.get('courses', [{}])[0].get('assignments', []))} tareas de asignación en el curso")
+    activities = []
+
+    for assignment in assignments["courses"][0]["assignments"]:
+        logger.info(f"\n{'-'*60}")
+        logger.info(f"ASIGNACIÓN: {assignment['name']} (ID: {assignment['id']})")
+        logger.info(f"{'-'*60}")
+
+        # Lortu zereginaren informazio osoa (deskribapena + rubrika)
+        assignment_full_info = moodle_client.get_full_assignment_info(
+            course_info.course_id,
+            assignment['id']
+        )
+
+        if assignment_full_info.get('grading', {}).get('has_rubric'):
+            logger.info(f"  📋 Rubrika aurkitua: {assignment_full_info['grading'].get('method', 'unknown')}")
+
+        activities.append({
+            'type': 'assign',
+            'id': assignment['id'],
+            'name': assignment['name'],
+            'cmid': None,
+            'duedate': assignment.get('duedate', 0),
+            # Lortu ebaluazio-irizpideak AI-rako
+            'criteria': assignment_full_info.get('full_criteria_text', assignment.get('intro', '')),
+            'submission_fields': {
+                'assignment_intro': assignment_full_info.get('intro', ''),
+                'max_grade': assignment_full_info.get('grade', 10),
+                'has_rubric': assignment_full_info.get('grading', {}).get('has_rubric', False)
+            }
+        })
+
+    return activities
+
+
+def get_vpl_activities(ctx: RunContext, course_info: CourseInfo) -> List[Dict[str, Any]]:
+    """Actividades VPL del curso con sus criterios completos (descripción + rubrika)"""
+    moodle_client = ctx.moodle_client
+    vpl_assignments = moodle_client.get_vpl_assignments(course_info.course_id)
+    logger.info(f"\nEncontradas {len(vpl_assignments)} tareas VPL en el curso")
+    activities = []
+
+    for vpl in vpl_assignments:
+        logger.info(f"\n{'-'*60}")
+        logger.info(f"VPL: {vpl['name']} (ID: {vpl['vplid']}, CMID: {vpl['cmid']})")
+        logger.info(f"{'-'*60}")
+
+        # VPL-ren informazio osoa lortu (deskribapena)
+        vpl_info = moodle_client.get_vpl_info(vpl['cmid'])
+        vpl_intro = vpl_info.get('intro', '') or vpl.get('description_clean', '')
+
+        if vpl_intro:
+            logger.info(f"  📝 Deskribapena aurkitua ({len(vpl_intro)} karaktere)")
+
+        # VPL-ren rubrika lortu (cmid erabiliz)
+        vpl_grading = moodle_client.get_grading_definition(vpl['cmid'])
+        vpl_rubric = ""
+
+        if vpl_grading.get('has_rubric'):
+            logger.info(f"  📋 Rubrika aurkitua: {vpl_grading.get('method', 'unknown')}")
+            vpl_rubric = vpl_grading.get('rubric_text', '') or vpl_grading.get('guide_text', '')
+
+        # Irakaslearen fitxategiak (hash-ak): ikasle guztien deskargetatik eta prompt-etatik kanpo
+        teacher_files = vpl_info.get('teacher_files')
+        if teacher_files:
+            logger.info(f"  🧪 {len(teacher_files)} archivo(s) del profesor (se excluyen del análisis)")
+
+        # Sortu irizpide osoak: deskribapena + rubrika
+        full_vpl_criteria_parts = []
+        if vpl_intro:
+            full_vpl_criteria_parts.append(f"DESCRIPCIÓN DE LA TAREA:\n{'='*40}\n{vpl_intro}")
+        if vpl_rubric:
+            full_vpl_criteria_parts.append(vpl_rubric)
+
+        activities.append({
+            'type': 'vpl',
+            'id': vpl['vplid'],
+            'name': vpl['name'],
+            'cmid': vpl['cmid'],
+            'duedate': vpl_info.get('duedate', 0),
+            'criteria': "\n\n".join(full_vpl_criteria_parts),
+            'teacher_files': teacher_files,
+            'submission_fields': {
+                'timemodified': 0,  # VPL no siempre tiene este campo
+                'has_rubric': vpl_grading.get('has_rubric', False)
+            }
+        })
+
+    return activities
+
+
+def item_key(item: Dict[str, Any]) -> str:
+    """Clave de una entrega (actividad × estudiante) en el punto de control"""
+    return f"{item['activity']['type']}:{item['activity']['id']}:{item['user']['id']}"
+
+
+class SubmissionPipeline:
+    """
+    Etapas del pipeline de entregas (tareas y VPL) de un curso
+
+    fetch (Moodle) → download (archivos) → analyze (IA) → persist (caché e informes)
+
+    Solo la etapa persist modifica RunState y el caché, y tiene un único hilo.
+    """
+
+    def __init__(self, ctx: RunContext, course_info: CourseInfo):
+        self.ctx = ctx
+        self.course_info = course_info
+
+    def fetch(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Obtiene la entrega del estudiante y comprueba si ha cambiado"""
+        activity, user = item['activity'], item['user']
+        course_id = self.course_info.course_id
+
+        if activity['type'] == 'assign':
+            submission = self.ctx.moodle_client.get_student_submissions(course_id, activity['id'], user['id'])
         else:
-            logger.info(f"\nEncontradas {len(assignments.get('courses', [{}])[0].get('assignments', []))} tareas de asignación en el curso")
-            
-            for assignment in assignments["courses"][0]["assignments"]:
-                logger.info(f"\n{'-'*60}")
-                logger.info(f"ASIGNACIÓN: {assignment['name']} (ID: {assignment['id']})")
-                logger.info(f"{'-'*60}")
-                
-                # Lortu zereginaren informazio osoa (deskribapena + rubrika)
-                assignment_full_info = moodle_client.get_full_assignment_info(
-                    course_info.course_id, 
-                    assignment['id']
-                )
-                
-                if assignment_full_info.get('grading', {}).get('has_rubric'):
-                    logger.info(f"  📋 Rubrika aurkitua: {assignment_full_info['grading'].get('method', 'unknown')}")
-                
-                # Lortu ebaluazio-irizpideak AI-rako
-                full_criteria = assignment_full_info.get('full_criteria_text', assignment.get('intro', ''))
-                
-                for user in enrolled_users:
-                    filenames = []
-                    submission = moodle_client.get_student_submissions(course_info.course_id, assignment["id"], user["id"])
-
-                    if submission == "Entrega no encontrada":
-                        # No actualizar caché si no hay entrega
-                        continue
-                    
-                    # Verificar si la entrega ha cambiado
-                    has_changed = cache.has_changed(
-                        course_id=course_info.course_id,
-                        assignment_id=assignment["id"],
-                        student_id=user["id"],
-                        submission_data=submission,
-                        assignment_type="assign"
-                    )
-                    
-                    if has_changed:
-                        logger.info(f"  ✓ {user['username']} (ID: {user['id']}) - NUEVA o MODIFICADA")
-                        new_submissions += 1
-                        
-                        # Descargar archivos si existen
-                        for plugin in submission.get("plugins", []):
-                            if "fileareas" in plugin:
-                                for filearea in plugin["fileareas"]:
-                                    for doc in filearea.get("files", []):
-                                        filename = doc["filename"]
-                                        file_url = doc['fileurl']
-                                        try:
-                                            downloaded_path = moodle_client.download_file(file_url, filename)
-                                            filenames.append(downloaded_path)
-                                            logger.info(f"      - {downloaded_path}")
-                                        except Exception as e:
-                                            logger.error(f"      Error descargando {filename}: {e}")
-
-                        # Analizar con IA si hay archivos descargados
-                        ai_analysis = None
-                        if filenames:
-                            logger.info(f"      Analizando con IA...")
-                            submission_data = {
-                                'filenames': filenames,
-                                'student_username': user['username'],
-                                'assignment_name': assignment['name'],
-                                'timemodified': submission.get('timemodified', 0),
-                                'assignment_intro': assignment_full_info.get('intro', ''),
-                                'max_grade': assignment_full_info.get('grade', 10),
-                                'has_rubric': assignment_full_info.get('grading', {}).get('has_rubric', False)
-                            }
-                            # Pasatu irizpide osoak (deskribapena + rubrika)
-                            ai_analysis = ai_analyzer.analyze_submission(submission_data, full_criteria)
-                            
-                            if ai_analysis.get('status') == 'success':
-                                logger.info(f"      📊 Calificación sugerida: {ai_analysis.get('suggested_grade', 'N/A')}/10")
-                                logger.info(f"      💬 URLs encontradas: {ai_analysis.get('urls_found', 0)}")
-
-                        # Guardar la entrega con análisis
-                        submission_entry = {
-                            'course_id': course_info.course_id,
-                            'course_name': course_info.fullname,
-                            'assignment_id': assignment["id"],
-                            'assignment_name': assignment["name"],
-                            'assignment_type': 'assign',
-                            'student_id': user["id"],
-                            'student_username': user["username"],
-                            'filenames': filenames,
-                            'timemodified': submission.get('timemodified', 0),
-                            'status': submission.get('status', 'submitted'),
-                            'ai_analysis': ai_analysis
-                        }
-                        
-                        submissions_info.append(submission_entry)
-                        student_submissions_map[user["id"]].append(submission_entry)
-                        
-                        # Actualizar el caché
-                        cache.update(
-                            course_id=course_info.course_id,
-                            assignment_id=assignment["id"],
-                            student_id=user["id"],
-                            submission_data=submission,
-                            assignment_type="assign",
-                            student_username=user["username"],
-                            assignment_name=assignment["name"],
-                            status="processed",
-                            additional_info={
-                                "files_downloaded": len(filenames),
-                                "ai_analyzed": ai_analysis is not None,
-                                "suggested_grade": ai_analysis.get('suggested_grade') if ai_analysis else None,
-                                "ai_analysis": ai_analysis  # AI analisi osoa gorde
-                            }
-                        )
-                    else:
-                        logger.debug(f"  ○ {user['username']} (ID: {user['id']}) - SIN CAMBIOS (omitida)")
-                        unchanged_submissions += 1
-        
-        vpl_assignments = moodle_client.get_vpl_assignments(course_info.course_id)
-        logger.info(f"\nEncontradas {len(vpl_assignments)} tareas VPL en el curso")
-        
-        for vpl in vpl_assignments:
-            logger.info(f"\n{'-'*60}")
-            logger.info(f"VPL: {vpl['name']} (ID: {vpl['vplid']}, CMID: {vpl['cmid']})")
-            logger.info(f"{'-'*60}")
-            
-            # VPL-ren informazio osoa lortu (deskribapena)
-            vpl_info = moodle_client.get_vpl_info(vpl['cmid'])
-            vpl_intro = vpl_info.get('intro', '') or vpl.get('description_clean', '')
-            
-            if vpl_intro:
-                logger.info(f"  📝 Deskribapena aurkitua ({len(vpl_intro)} karaktere)")
-            
-            # VPL-ren rubrika lortu (cmid erabiliz)
-            vpl_grading = moodle_client.get_grading_definition(vpl['cmid'])
-            vpl_rubric = ""
-            
-            if vpl_grading.get('has_rubric'):
-                logger.info(f"  📋 Rubrika aurkitua: {vpl_grading.get('method', 'unknown')}")
-                vpl_rubric = vpl_grading.get('rubric_text', '') or vpl_grading.get('guide_text', '')
-            
-            # Sortu irizpide osoak: deskribapena + rubrika
-            full_vpl_criteria_parts = []
-            if vpl_intro:
-                full_vpl_criteria_parts.append(f"DESCRIPCIÓN DE LA TAREA:\n{'='*40}\n{vpl_intro}")
-            if vpl_rubric:
-                full_vpl_criteria_parts.append(vpl_rubric)
-            
-            full_vpl_criteria = "\n\n".join(full_vpl_criteria_parts)
-            
-            for user in enrolled_users:
-                # Obtener la entrega del estudiante
-                submission = moodle_client.get_vpl_submissions(
-                    vpl['vplid'], 
-                    course_info.course_id, 
-                    user["id"], 
-                    cmid=vpl['cmid']
-                )
-                
-                # Verificar si es una entrega válida
-                if submission == "Entrega no encontrada":
-                    # No actualizar caché si no hay entrega
+            submission = self.ctx.moodle_client.get_vpl_submissions(
+                activity['id'],
+                course_id,
+                user["id"],
+                cmid=activity['cmid'],
+                teacher_files=activity.get('teacher_files')
+            )
+
+        if submission == "Entrega no encontrada":
+            # No actualizar caché si no hay entrega
+            checkpoint_item(self.ctx, item_key(item), save=False)
+            return None
+
+        item['submission'] = submission
+        item['changed'] = self.ctx.cache.has_changed(
+            course_id=course_id,
+            assignment_id=activity['id'],
+            student_id=user["id"],
+            submission_data=submission,
+            assignment_type=activity['type']
+        )
+        return item
+
+    def download(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """Descarga los archivos de las entregas nuevas o modificadas"""
+        if not item['changed']:
+            return item
+
+        activity, user, submission = item['activity'], item['user'], item['submission']
+        filenames = []
+
+        if activity['type'] == 'assign':
+            docs = [doc for plugin in submission.get("plugins", []) if "fileareas" in plugin
+                    for filearea in plugin["fileareas"] for doc in filearea.get("files", [])]
+            # Ikasle bakoitzaren karpeta: izen bereko fitxategiek ez dute elkar zapaltzen
+            results = self.ctx.moodle_client.download_files(
+                [(doc['fileurl'], f"{self.course_info.course_id}/{activity['id']}/{user['id']}/{doc['filename']}", doc)
+                 for doc in docs])
+            for doc, result in zip(docs, results):
+                if isinstance(result, Exception):
+                    logger.error(f"      Error descargando {doc['filename']}: {result}")
+                else:
+                    filenames.append(result)
+        elif isinstance(submission, list):
+            # VPL: get_vpl_submissions ya ha guardado los archivos
+            filenames = submission
+        else:
+            logger.debug(f"    Datos: {str(submission)[:100]}...")
+
+        item['filenames'] = filenames
+        item['submission_data'] = dict(activity['submission_fields'],
+                                       student_id=user['id'],
+                                       filenames=filenames,
+                                       student_username=user['username'],
+                                       assignment_name=activity['name'])
+        if activity['type'] == 'assign':
+            item['submission_data']['timemodified'] = submission.get('timemodified', 0)
+        return item
+
+    def analyze(self, batch) -> List[Dict[str, Any]]:
+        """
+        Analiza con IA las entregas con archivos (agrupadas por tarea si OLLAMA_PACK_SIZE > 1)
+
+        Devuelve siempre todo el lote: si falla el análisis de una tarea, sus entregas
+        siguen con `ai_analysis` None.
+        """
+        batch = batch if isinstance(batch, list) else [batch]
+        groups = defaultdict(list)
+        for item in batch:
+            item['ai_analysis'] = None
+            # Modo cola: el worker analiza las entregas con archivos
+            if item['changed'] and item['filenames'] and not self.ctx.job_queue:
+                groups[(item['activity']['type'], item['activity']['id'])].append(item)
+
+        for items in groups.values():
+            activity = items[0]['activity']
+            logger.info(f"  🤖 {activity['name']}: analizando {len(items)} entrega(s) con IA...")
+            try:
+                # Pasatu irizpide osoak (deskribapena + rubrika)
+                analyses = self.ctx.ai_analyzer.analyze_submissions_packed(
+                    [item['submission_data'] for item in items], activity['criteria'])
+            except Exception as e:
+                # Talde honek analisirik gabe jarraitzen du; sortako beste elementuak (aldatu gabeak
+                # barne) persist etapara iristen dira eta zenbatu eta kontrol-puntuan gordetzen dira
+                logger.error(f"  ❌ {activity['name']}: error analizando {len(items)} entrega(s): {e}")
+                analyses = {}
+            for item in items:
+                item['ai_analysis'] = analyses.get(item['user']['id'])
+
+        return batch
+
+    def persist(self, item: Dict[str, Any]) -> None:
+        """Actualiza contadores, informes y caché (un solo hilo) y el punto de control"""
+        self._persist(item)
+        checkpoint_item(self.ctx, item_key(item))
+
+    def _persist(self, item: Dict[str, Any]) -> None:
+        state = self.ctx.state
+        activity, user, submission = item['activity'], item['user'], item['submission']
+        course_info = self.course_info
+
+        if not item['changed']:
+            logger.debug(f"  ○ {activity['name']} | {user['username']} (ID: {user['id']}) - SIN CAMBIOS (omitida)")
+            state.unchanged_submissions += 1
+            return None
+
+        filenames = item['filenames']
+        logger.info(f"  ✓ {activity['name']} | {user['username']} (ID: {user['id']}) - NUEVA o MODIFICADA")
+        for file_path in filenames:
+            logger.info(f"      - {file_path}")
+        state.new_submissions += 1
+
+        queued = bool(self.ctx.job_queue and filenames)
+        ai_analysis = item['ai_analysis']
+        if not queued:
+            track_usage(state.usage_by_course, str(course_info.course_id),
+                        {'name': course_info.fullname}, ai_analysis)
+            track_usage(state.usage_by_assignment, f"{activity['type']}_{course_info.course_id}_{activity['id']}",
+                        {'course_id': course_info.course_id, 'type': activity['type'], 'name': activity['name']},
+                        ai_analysis)
+
+        if ai_analysis and ai_analysis.get('status') == 'success':
+            logger.info(f"      📊 Calificación sugerida: {ai_analysis.get('suggested_grade', 'N/A')}/10 "
+                        f"| 💬 URLs encontradas: {ai_analysis.get('urls_found', 0)}")
+
+        # Guardar la entrega con análisis
+        submission_entry = {
+            'course_id': course_info.course_id,
+            'course_name': course_info.fullname,
+            'assignment_id': activity['id'],
+            'assignment_name': activity['name'],
+            'assignment_type': activity['type'],
+            'student_id': user["id"],
+            'student_username': user["username"],
+            'filenames': filenames,
+            'timemodified': item['submission_data'].get('timemodified', 0),
+            'status': submission.get('status', 'submitted') if isinstance(submission, dict) else 'submitted',
+            'ai_analysis': ai_analysis
+        }
+        if queued:
+            # Informeetan sartzen da; analisia cachetik betetzen da (fill_queued_analyses)
+            submission_entry.update(status='queued', queued_at=datetime.now().isoformat())
+
+        if activity['type'] == 'assign':
+            state.submissions_info.append(submission_entry)
+        state.student_submissions_map[user["id"]].append(submission_entry)
+
+        if queued:
+            self.ctx.job_queue.enqueue(*submission_job(course_info.course_id, course_info.fullname,
+                                                       activity['type'], activity['id'], activity['name'],
+                                                       item, activity['criteria']))
+            logger.info(f"      📥 Encolada para análisis")
+            state.queued_jobs += 1
+            return None
+
+        # Actualizar el caché
+        self.ctx.cache.update(
+            course_id=course_info.course_id,
+            assignment_id=activity['id'],
+            student_id=user["id"],
+            submission_data=submission,
+            assignment_type=activity['type'],
+            student_username=user["username"],
+            assignment_name=activity['name'],
+            status="processed",
+            additional_info={
+                "files_downloaded": len(filenames),
+                "ai_analyzed": ai_analysis is not None,
+                "suggested_grade": ai_analysis.get('suggested_grade') if ai_analysis else None,
+                "ai_analysis": ai_analysis  # AI analisi osoa gorde
+            }
+        )
+        return None
+
+
+def build_pipeline(ctx: RunContext, workers: Dict[str, int], queue_size: int) -> StagedPipeline:
+    """
+    Pipeline de entregas; cada elemento lleva el SubmissionPipeline de su curso en 'handler'
+    """
+    def stage(name):
+        def run(item):
+            if isinstance(item, list):
+                return item[0]['handler'].analyze(item) if item else []
+            return getattr(item['handler'], name)(item)
+        return run
+
+    return StagedPipeline([
+        Stage('fetch', stage('fetch'), workers=workers['fetch']),
+        Stage('download', stage('download'), workers=workers['download']),
+        Stage('analyze', stage('analyze'), workers=workers['analyze'],
+              batch_size=ctx.ai_analyzer.pack_size),
+        Stage('persist', stage('persist'), workers=1),
+    ], queue_size=queue_size)
+
+
+def process_submissions(ctx: RunContext, course_info: CourseInfo, enrolled_users: List[Dict[str, Any]],
+                        activities: List[Dict[str, Any]]):
+    """Tareas y VPL del curso a través del pipeline por etapas"""
+    if not activities:
+        return
+
+    handler = SubmissionPipeline(ctx, course_info)
+    items = ({'handler': handler, 'activity': activity, 'user': user}
+             for activity in activities for user in enrolled_users)
+    if ctx.checkpoint:
+        # --resume: aurreko exekuzioan amaitutakoak ez dira berriro eskatzen
+        items = (item for item in items if not ctx.checkpoint.is_done(item_key(item)))
+
+    logger.info(f"\n⚙️  {len(activities)} actividad(es) × {len(enrolled_users)} usuario(s) en el pipeline")
+    ctx.pipeline.run(items)
+
+
+# =============================================================================
+# QUIZZES
+# =============================================================================
+
+def process_quizzes(ctx: RunContext, course_info: CourseInfo, enrolled_users: List[Dict[str, Any]]):
+    """Obtener y procesar quizzes del curso"""
+    moodle_client, cache, state = ctx.moodle_client, ctx.cache, ctx.state
+    try:
+        quizzes = moodle_client.get_quizzes(course_info.course_id)
+        logger.info(f"\nEncontrados {len(quizzes)} quizzes en el curso")
+    except Exception as e:
+        logger.error(f"Error al obtener quizzes del curso {course_info.course_id}: {e}")
+        quizzes = []
+
+    for quiz in quizzes:
+        logger.info(f"\n{'-'*60}")
+        logger.info(f"QUIZ: {quiz.get('name', 'Sin nombre')} (ID: {quiz.get('quizid', 'N/A')}, CMID: {quiz.get('cmid', 'N/A')})")
+        logger.info(f"{'-'*60}")
+
+        # Validar que el quiz tiene los campos necesarios
+        if 'quizid' not in quiz:
+            logger.warning(f"Quiz sin ID válido, omitiendo")
+            continue
+
+        for user in enrolled_users:
+            key = f"quiz:{quiz['quizid']}:{user['id']}"
+            if ctx.checkpoint and ctx.checkpoint.is_done(key):
+                continue
+            try:
+                # Obtener la calificación del estudiante en el quiz
+                grade_info = moodle_client.get_quiz_grade(quiz['quizid'], user["id"], course_info.course_id)
+
+                # Si no tiene intentos o calificación, omitir
+                if isinstance(grade_info, str):
+                    # No mostrar usuarios sin intentos para mantener el output limpio
+                    checkpoint_item(ctx, key)
                     continue
-                
-                # Verificar si la entrega ha cambiado
+
+                # Validar que grade_info tiene los campos necesarios
+                required_fields = ['grade', 'max_grade', 'percentage']
+                if not all(field in grade_info for field in required_fields):
+                    logger.warning(f"  ⚠ {user['username']} (ID: {user['id']}) - Datos incompletos del quiz")
+                    checkpoint_item(ctx, key)
+                    continue
+
+                # Verificar si la calificación ha cambiado
                 has_changed = cache.has_changed(
                     course_id=course_info.course_id,
-                    assignment_id=vpl['vplid'],
+                    assignment_id=quiz['quizid'],
                     student_id=user["id"],
-                    submission_data=submission,
-                    assignment_type="vpl"
+                    submission_data=grade_info,
+                    assignment_type="quiz"
                 )
-                
+
                 if has_changed:
                     logger.info(f"  ✓ {user['username']} (ID: {user['id']}) - NUEVA o MODIFICADA")
-                    new_submissions += 1
-                    
-                    # Procesar archivos VPL
-                    filenames = []
-                    if isinstance(submission, list):
-                        filenames = submission
-                        logger.info(f"    Archivos descargados: {len(filenames)}")
-                        for file_path in filenames:
-                            logger.info(f"      - {file_path}")
-                    else:
-                        logger.debug(f"    Datos: {str(submission)[:100]}...")
-                    
-                    # Analizar con IA si hay archivos
-                    ai_analysis = None
-                    if filenames:
-                        logger.info(f"      Analizando con IA...")
-                        submission_data = {
-                            'filenames': filenames,
-                            'student_username': user['username'],
-                            'assignment_name': vpl['name'],
-                            'timemodified': 0,  # VPL no siempre tiene este campo
-                            'has_rubric': vpl_grading.get('has_rubric', False)
-                        }
-                        # Pasatu irizpide osoak (deskribapena + rubrika)
-                        ai_analysis = ai_analyzer.analyze_submission(submission_data, full_vpl_criteria)
-                        
-                        if ai_analysis.get('status') == 'success':
-                            logger.info(f"      📊 Calificación sugerida: {ai_analysis.get('suggested_grade', 'N/A')}/10")
-                            logger.info(f"      💬 URLs encontradas: {ai_analysis.get('urls_found', 0)}")
-                    
-                    # Guardar entrega con análisis
+                    state.new_submissions += 1
+
+                    # Mostrar información de la calificación con manejo seguro de valores None
+                    grade = grade_info.get('grade', 0)
+                    max_grade = grade_info.get('max_grade', 0)
+                    percentage = grade_info.get('percentage', 0)
+                    has_grade = grade_info.get('has_grade', False)
+
+                    logger.info(f"    Calificación: {grade:.2f}/{max_grade:.2f} ({percentage:.1f}%)")
+                    if has_grade:
+                        logger.info(f"    Estado: Calificado")
+
+                    # Guardar quiz para el estudiante
                     submission_entry = {
                         'course_id': course_info.course_id,
                         'course_name': course_info.fullname,
-                        'assignment_id': vpl['vplid'],
-                        'assignment_name': vpl["name"],
-                        'assignment_type': 'vpl',
+                        'assignment_id': quiz['quizid'],
+                        'assignment_name': quiz.get("name", "Quiz sin nombre"),
+                        'assignment_type': 'quiz',
                         'student_id': user["id"],
                         'student_username': user["username"],
-                        'filenames': filenames,
+                        'filenames': [],
                         'timemodified': 0,
-                        'status': 'submitted',
-                        'ai_analysis': ai_analysis
+                        'status': 'graded',
+                        'grade': grade,
+                        'max_grade': max_grade,
+                        'percentage': percentage
                     }
-                    
-                    student_submissions_map[user["id"]].append(submission_entry)
-                    
+
+                    state.student_submissions_map[user["id"]].append(submission_entry)
+
                     # Actualizar el caché
                     cache.update(
                         course_id=course_info.course_id,
-                        assignment_id=vpl['vplid'],
+                        assignment_id=quiz['quizid'],
                         student_id=user["id"],
-                        submission_data=submission,
-                        assignment_type="vpl",
+                        submission_data=grade_info,
+                        assignment_type="quiz",
                         student_username=user["username"],
-                        assignment_name=vpl["name"],
+                        assignment_name=quiz.get("name", "Quiz sin nombre"),
                         status="processed",
                         additional_info={
-                            "files_downloaded": len(filenames),
-                            "ai_analyzed": ai_analysis is not None,
-                            "suggested_grade": ai_analysis.get('suggested_grade') if ai_analysis else None,
-                            "ai_analysis": ai_analysis  # AI analisi osoa gorde
+                            "grade": grade,
+                            "max_grade": max_grade,
+                            "percentage": percentage,
+                            "has_grade": has_grade
                         }
                     )
                 else:
-                    logger.debug(f"  ○ {user['username']} (ID: {user['id']}) - SIN CAMBIOS (omitida)")
-                    unchanged_submissions += 1
-        
-        # Obtener y procesar quizzes del curso
-        try:
-            quizzes = moodle_client.get_quizzes(course_info.course_id)
-            logger.info(f"\nEncontrados {len(quizzes)} quizzes en el curso")
-        except Exception as e:
-            logger.error(f"Error al obtener quizzes del curso {course_info.course_id}: {e}")
-            quizzes = []
-        
-        for quiz in quizzes:
-            logger.info(f"\n{'-'*60}")
-            logger.info(f"QUIZ: {quiz.get('name', 'Sin nombre')} (ID: {quiz.get('quizid', 'N/A')}, CMID: {quiz.get('cmid', 'N/A')})")
-            logger.info(f"{'-'*60}")
-            
-            # Validar que el quiz tiene los campos necesarios
-            if 'quizid' not in quiz:
-                logger.warning(f"Quiz sin ID válido, omitiendo")
-                continue
-            
-            for user in enrolled_users:
-                try:
-                    # Obtener la calificación del estudiante en el quiz
-                    grade_info = moodle_client.get_quiz_grade(quiz['quizid'], user["id"], course_info.course_id)
-                    
-                    # Si no tiene intentos o calificación, omitir
-                    if isinstance(grade_info, str):
-                        # No mostrar usuarios sin intentos para mantener el output limpio
-                        continue
-                    
-                    # Validar que grade_info tiene los campos necesarios
-                    required_fields = ['grade', 'max_grade', 'percentage']
-                    if not all(field in grade_info for field in required_fields):
-                        logger.warning(f"  ⚠ {user['username']} (ID: {user['id']}) - Datos incompletos del quiz")
-                        continue
-                    
-                    # Verificar si la calificación ha cambiado
-                    has_changed = cache.has_changed(
-                        course_id=course_info.course_id,
-                        assignment_id=quiz['quizid'],
-                        student_id=user["id"],
-                        submission_data=grade_info,
-                        assignment_type="quiz"
-                    )
-                    
-                    if has_changed:
-                        logger.info(f"  ✓ {user['username']} (ID: {user['id']}) - NUEVA o MODIFICADA")
-                        new_submissions += 1
-                        
-                        # Mostrar información de la calificación con manejo seguro de valores None
-                        grade = grade_info.get('grade', 0)
-                        max_grade = grade_info.get('max_grade', 0)
-                        percentage = grade_info.get('percentage', 0)
-                        has_grade = grade_info.get('has_grade', False)
-                        
-                        logger.info(f"    Calificación: {grade:.2f}/{max_grade:.2f} ({percentage:.1f}%)")
-                        if has_grade:
-                            logger.info(f"    Estado: Calificado")
-                        
-                        # Guardar quiz para el estudiante
-                        submission_entry = {
-                            'course_id': course_info.course_id,
-                            'course_name': course_info.fullname,
-                            'assignment_id': quiz['quizid'],
-                            'assignment_name': quiz.get("name", "Quiz sin nombre"),
-                            'assignment_type': 'quiz',
-                            'student_id': user["id"],
-                            'student_username': user["username"],
-                            'filenames': [],
-                            'timemodified': 0,
-                            'status': 'graded',
-                            'grade': grade,
-                            'max_grade': max_grade,
-                            'percentage': percentage
-                        }
-                        
-                        student_submissions_map[user["id"]].append(submission_entry)
-                        
-                        # Actualizar el caché
-                        cache.update(
-                            course_id=course_info.course_id,
-                            assignment_id=quiz['quizid'],
-                            student_id=user["id"],
-                            submission_data=grade_info,
-                            assignment_type="quiz",
-                            student_username=user["username"],
-                            assignment_name=quiz.get("name", "Quiz sin nombre"),
-                            status="processed",
-                            additional_info={
-                                "grade": grade,
-                                "max_grade": max_grade,
-                                "percentage": percentage,
-                                "has_grade": has_grade
-                            }
-                        )
-                    else:
-                        grade = grade_info.get('grade', 0)
-                        max_grade = grade_info.get('max_grade', 0)
-                        logger.debug(f"  ○ {user['username']} (ID: {user['id']}) - SIN CAMBIOS ({grade:.1f}/{max_grade:.1f})")
-                        unchanged_submissions += 1
-                        
-                except Exception as e:
-                    logger.error(f"  ✗ Error procesando quiz para {user['username']} (ID: {user['id']}): {e}")
-                    continue
-        
-        # =====================================================================
-        # FORO-TAREAS: Obtener y procesar foros que son tareas evaluables
-        # =====================================================================
-        try:
-            task_forums = moodle_client.get_task_forums(course_info.course_id)
-            logger.info(f"\nEncontrados {len(task_forums)} foros-tarea en el curso")
-        except Exception as e:
-            logger.error(f"Error al obtener foros-tarea del curso {course_info.course_id}: {e}")
-            task_forums = []
-        
-        for forum in task_forums:
-            logger.info(f"\n{'-'*60}")
-            logger.info(f"FORO-TAREA: {forum.get('name', 'Sin nombre')} (ID: {forum.get('id', 'N/A')})")
-            logger.info(f"  Tipo: {forum.get('type', 'general')} | Discusiones: {forum.get('numdiscussions', 0)}")
-            logger.info(f"{'-'*60}")
-            
-            # Validar que el foro tiene ID
-            if 'id' not in forum:
-                logger.warning(f"Foro sin ID válido, omitiendo")
+                    grade = grade_info.get('grade', 0)
+                    max_grade = grade_info.get('max_grade', 0)
+                    logger.debug(f"  ○ {user['username']} (ID: {user['id']}) - SIN CAMBIOS ({grade:.1f}/{max_grade:.1f})")
+                    state.unchanged_submissions += 1
+
+                checkpoint_item(ctx, key)
+
+            except Exception as e:
+                logger.error(f"  ✗ Error procesando quiz para {user['username']} (ID: {user['id']}): {e}")
                 continue
-            
-            # Obtener descripción/instrucciones del foro para criterios
-            forum_intro = forum.get('intro', '')
-            forum_criteria = f"""INSTRUCCIONES DEL FORO-TAREA:
+
+
+# =============================================================================
+# FORO-TAREAS: Obtener y procesar foros que son tareas evaluables
+# =============================================================================
+
+def process_task_forums(ctx: RunContext, course_info: CourseInfo, teacher_ids=()):
+    """
+    Evalúa con IA la participación de cada estudiante en los foros-tarea del curso
+
+    Args:
+        teacher_ids: Profesores del curso; sus mensajes no se evalúan
+    """
+    moodle_client, cache, state = ctx.moodle_client, ctx.cache, ctx.state
+    try:
+        task_forums = moodle_client.get_task_forums(course_info.course_id)
+        logger.info(f"\nEncontrados {len(task_forums)} foros-tarea en el curso")
+    except Exception as e:
+        logger.error(f"Error al obtener foros-tarea del curso {course_info.course_id}: {e}")
+        task_forums = []
+
+    for forum in task_forums:
+        logger.info(f"\n{'-'*60}")
+        logger.info(f"FORO-TAREA: {forum.get('name', 'Sin nombre')} (ID: {forum.get('id', 'N/A')})")
+        logger.info(f"  Tipo: {forum.get('type', 'general')} | Discusiones: {forum.get('numdiscussions', 0)}")
+        logger.info(f"{'-'*60}")
+
+        # Validar que el foro tiene ID
+        if 'id' not in forum:
+            logger.warning(f"Foro sin ID válido, omitiendo")
+            continue
+
+        forum_key = f"forum_task:{forum['id']}"
+        if ctx.checkpoint and ctx.checkpoint.is_done(forum_key):
+            logger.info(f"  ⏭️  Ya procesado antes de la interrupción")
+            continue
+
+        # Obtener descripción/instrucciones del foro para criterios
+        forum_intro = forum.get('intro', '')
+        forum_criteria = f"""INSTRUCCIONES DEL FORO-TAREA:
 {'='*40}
 {forum_intro if forum_intro else 'No hay instrucciones específicas.'}
 
@@ -453,174 +696,472 @@ CRITERIOS DE EVALUACIÓN GENERALES:
 - Claridad en la expresión
 - Interacción con otros compañeros
 """
-            
-            # Obtener todas las discusiones y posts del foro
-            try:
-                forum_data = moodle_client.get_forum_with_student_posts(forum['id'])
-                forum_data['name'] = forum.get('name', 'Foro sin nombre')
-                forum_data['intro'] = forum_intro
-                forum_data['type'] = forum.get('type', 'general')
-            except Exception as e:
-                logger.error(f"  Error obteniendo datos del foro: {e}")
-                continue
-            
-            # Si no hay participaciones, continuar
-            if not forum_data.get('students'):
-                logger.info(f"  Sin participaciones de estudiantes")
+
+        # Obtener todas las discusiones y posts del foro
+        try:
+            forum_data = moodle_client.get_forum_with_student_posts(forum['id'], forum.get('numdiscussions', 0))
+            forum_data['name'] = forum.get('name', 'Foro sin nombre')
+            forum_data['intro'] = forum_intro
+            forum_data['type'] = forum.get('type', 'general')
+        except Exception as e:
+            logger.error(f"  Error obteniendo datos del foro: {e}")
+            continue
+
+        # Si no hay participaciones, continuar
+        if not forum_data.get('students'):
+            logger.info(f"  Sin participaciones de estudiantes")
+            checkpoint_item(ctx, forum_key)
+            continue
+
+        logger.info(f"  📊 {len(forum_data['students'])} estudiantes con participación")
+        logger.info(f"  📝 {forum_data.get('total_posts', 0)} posts totales")
+        sync = forum_data.get('sync', {})
+        logger.info(f"  🔄 Discusiones descargadas: {sync.get('fetched', 0)} | "
+                    f"sin cambios (copia local): {sync.get('reused', 0)}")
+
+        # Métricas exactas de todos los participantes, una vez por foro (huella del caché y prompt)
+        forum_metrics = build_forum_metrics(forum_data['discussions'])
+
+        # Participaciones nuevas o modificadas, pendientes de evaluación
+        pending = []
+
+        # Procesar cada estudiante que ha participado
+        for user_id, student_data in forum_data['students'].items():
+            if int(user_id) in teacher_ids:
                 continue
-            
-            logger.info(f"  📊 {len(forum_data['students'])} estudiantes con participación")
-            logger.info(f"  📝 {forum_data.get('total_posts', 0)} posts totales")
-            
-            # Procesar cada estudiante que ha participado
-            for user_id, student_data in forum_data['students'].items():
-                student_info = student_data['info']
-                student_posts = student_data['posts']
-                
-                # Buscar el usuario en enrolled_users para más info
-                enrolled_user = next(
-                    (u for u in enrolled_users if u['id'] == int(user_id)),
-                    {'id': int(user_id), 'username': student_info.get('fullname', f'student_{user_id}')}
-                )
-                
-                # Crear datos de submission para verificar caché
-                submission_data_for_cache = {
-                    'posts_count': len(student_posts),
-                    'last_post_time': max((p.get('timecreated', 0) for p in student_posts), default=0),
-                    'total_words': sum(len(p.get('message', '').split()) for p in student_posts)
-                }
-                
-                # Verificar si ha cambiado
-                has_changed = cache.has_changed(
-                    course_id=course_info.course_id,
-                    assignment_id=forum['id'],
-                    student_id=int(user_id),
-                    submission_data=submission_data_for_cache,
-                    assignment_type="forum_task"
-                )
-                
-                if has_changed:
-                    logger.info(f"  ✓ {enrolled_user['username']} (ID: {user_id}) - NUEVA o MODIFICADA")
-                    logger.info(f"      Posts: {len(student_posts)} | Palabras: {submission_data_for_cache['total_words']}")
-                    new_submissions += 1
-                    
-                    # Analizar con IA
-                    logger.info(f"      Analizando participación con IA...")
-                    ai_analysis = ai_analyzer.evaluate_forum_as_task(
-                        student_posts=student_posts,
-                        forum_info=forum_data,
-                        task_criteria=forum_criteria,
-                        student_info={
-                            'id': int(user_id),
-                            'fullname': student_info.get('fullname', enrolled_user['username'])
-                        }
-                    )
-                    
-                    if ai_analysis.get('status') == 'success':
-                        grade = ai_analysis.get('grade')
-                        logger.info(f"      📊 Calificación sugerida: {grade}/10")
-                        
-                        # Mostrar calidad de participación
-                        quality = ai_analysis.get('participation_quality', {})
-                        if quality:
-                            logger.info(f"      📈 Calidad: Relevancia={quality.get('relevance', '-')}/5, "
-                                       f"Profundidad={quality.get('depth', '-')}/5, "
-                                       f"Originalidad={quality.get('originality', '-')}/5")
-                        
-                        # Mostrar si cumple requisitos
-                        if ai_analysis.get('meets_requirements'):
-                            logger.info(f"      ✅ Cumple requisitos mínimos")
-                        else:
-                            logger.info(f"      ⚠️ No cumple todos los requisitos")
-                    else:
-                        logger.warning(f"      ⚠️ Error en análisis IA: {ai_analysis.get('error', 'Unknown')}")
-                    
-                    # Guardar entrega
-                    submission_entry = {
-                        'course_id': course_info.course_id,
-                        'course_name': course_info.fullname,
-                        'assignment_id': forum['id'],
-                        'assignment_name': forum.get('name', 'Foro-tarea'),
-                        'assignment_type': 'forum_task',
-                        'student_id': int(user_id),
-                        'student_username': enrolled_user['username'],
-                        'filenames': [],  # Foros no tienen archivos
-                        'timemodified': submission_data_for_cache['last_post_time'],
-                        'status': 'submitted',
-                        'posts_count': len(student_posts),
-                        'total_words': submission_data_for_cache['total_words'],
-                        'ai_analysis': ai_analysis
+            student_info = student_data['info']
+            student_posts = student_data['posts']
+
+            # Buscar el usuario entre los matriculados para más info
+            enrolled_user = state.users.get(
+                int(user_id),
+                {'id': int(user_id), 'username': student_info.get('fullname', f'student_{user_id}')}
+            )
+
+            metrics = forum_metrics.get(int(user_id)) or student_metrics(student_posts)
+            # Huella compatible con las entradas ya guardadas (mensajes, último mensaje, palabras)
+            submission_data_for_cache = fingerprint(metrics)
+
+            # Verificar si ha cambiado
+            has_changed = cache.has_changed(
+                course_id=course_info.course_id,
+                assignment_id=forum['id'],
+                student_id=int(user_id),
+                submission_data=submission_data_for_cache,
+                assignment_type="forum_task"
+            )
+
+            if has_changed:
+                logger.info(f"  ✓ {enrolled_user['username']} (ID: {user_id}) - NUEVA o MODIFICADA")
+                logger.info(f"      {format_metrics(metrics)}")
+                state.new_submissions += 1
+
+                pending.append({
+                    'user': enrolled_user,
+                    'posts': student_posts,
+                    'cache_data': submission_data_for_cache,
+                    'metrics': metrics,
+                    'student_info': {
+                        'id': int(user_id),
+                        'fullname': student_info.get('fullname', enrolled_user['username'])
                     }
-                    
-                    student_submissions_map[int(user_id)].append(submission_entry)
-                    
-                    # Actualizar caché
-                    cache.update(
-                        course_id=course_info.course_id,
-                        assignment_id=forum['id'],
-                        student_id=int(user_id),
-                        submission_data=submission_data_for_cache,
-                        assignment_type="forum_task",
-                        student_username=enrolled_user['username'],
-                        assignment_name=forum.get('name', 'Foro-tarea'),
-                        status="processed",
-                        additional_info={
-                            "posts_count": len(student_posts),
-                            "total_words": submission_data_for_cache['total_words'],
-                            "ai_analyzed": ai_analysis.get('status') == 'success',
-                            "suggested_grade": ai_analysis.get('grade'),
-                            "meets_requirements": ai_analysis.get('meets_requirements', False),
-                            "participation_quality": ai_analysis.get('participation_quality', {}),
-                            "ai_analysis": ai_analysis
-                        }
-                    )
+                })
+            else:
+                logger.debug(f"  ○ {enrolled_user['username']} (ID: {user_id}) - SIN CAMBIOS")
+                state.unchanged_submissions += 1
+
+        # Modo cola: el worker evalúa y guarda en el caché todas las participaciones
+        if ctx.job_queue:
+            for item in pending:
+                # Informeetan sartzen da; analisia cachetik betetzen da (fill_queued_analyses)
+                state.student_submissions_map[item['student_info']['id']].append(
+                    forum_task_entry(course_info, forum, item, None, status='queued'))
+                ctx.job_queue.enqueue(*forum_task_job(course_info.course_id, course_info.fullname,
+                                                      dict(forum_data, id=forum['id']), item, forum_criteria))
+            if pending:
+                logger.info(f"  📥 {len(pending)} participación(es) encoladas para evaluación")
+            state.queued_jobs += len(pending)
+            pending = []
+
+        # Analizar con IA (agrupando participaciones cortas si OLLAMA_PACK_SIZE > 1)
+        if pending:
+            logger.info(f"  Analizando {len(pending)} participación(es) con IA...")
+        evaluations = ctx.ai_analyzer.evaluate_forum_tasks_packed(
+            [{'posts': item['posts'], 'student_info': item['student_info'], 'metrics': item['metrics']}
+             for item in pending],
+            forum_info=forum_data,
+            task_criteria=forum_criteria
+        ) if pending else {}
+
+        for item in pending:
+            enrolled_user = item['user']
+            user_id = item['student_info']['id']
+            student_posts = item['posts']
+            submission_data_for_cache = item['cache_data']
+            ai_analysis = evaluations.get(user_id) or {'status': 'error', 'error': 'Sin evaluación'}
+            track_usage(state.usage_by_course, str(course_info.course_id),
+                        {'name': course_info.fullname}, ai_analysis)
+            track_usage(state.usage_by_assignment, f"forum_task_{course_info.course_id}_{forum['id']}",
+                        {'course_id': course_info.course_id, 'type': 'forum_task',
+                         'name': forum.get('name', 'Foro-tarea')},
+                        ai_analysis)
+
+            if ai_analysis.get('status') == 'success':
+                grade = ai_analysis.get('grade')
+                logger.info(f"  {enrolled_user['username']}: 📊 Calificación sugerida: {grade}/10")
+
+                # Mostrar calidad de participación
+                quality = ai_analysis.get('participation_quality', {})
+                if quality:
+                    logger.info(f"      📈 Calidad: Relevancia={quality.get('relevance', '-')}/5, "
+                               f"Profundidad={quality.get('depth', '-')}/5, "
+                               f"Originalidad={quality.get('originality', '-')}/5")
+
+                # Mostrar si cumple requisitos
+                if ai_analysis.get('meets_requirements'):
+                    logger.info(f"      ✅ Cumple requisitos mínimos")
                 else:
-                    logger.debug(f"  ○ {enrolled_user['username']} (ID: {user_id}) - SIN CAMBIOS")
-                    unchanged_submissions += 1
-    
-    # Resumen final
-    logger.info(f"\n{'='*60}")
-    logger.info("RESUMEN DE EJECUCIÓN")
-    logger.info("="*60)
-    logger.info(f"Entregas nuevas o modificadas: {new_submissions}")
-    logger.info(f"Entregas sin cambios (omitidas): {unchanged_submissions}")
-    logger.info(f"Total procesadas: {new_submissions + unchanged_submissions}")
-    logger.info("="*60 + "\n")
-    
-    # =========================================================================
-    # GENERACIÓN DE INFORMES Y ANÁLISIS DE RIESGO
-    # =========================================================================
+                    logger.info(f"      ⚠️ No cumple todos los requisitos")
+            else:
+                logger.warning(f"      ⚠️ Error en análisis IA: {ai_analysis.get('error', 'Unknown')}")
+
+            # Guardar entrega
+            state.student_submissions_map[user_id].append(forum_task_entry(course_info, forum, item, ai_analysis))
+
+            # Actualizar caché
+            cache.update(
+                course_id=course_info.course_id,
+                assignment_id=forum['id'],
+                student_id=user_id,
+                submission_data=submission_data_for_cache,
+                assignment_type="forum_task",
+                student_username=enrolled_user['username'],
+                assignment_name=forum.get('name', 'Foro-tarea'),
+                status="processed",
+                additional_info={
+                    "posts_count": len(student_posts),
+                    "total_words": submission_data_for_cache['total_words'],
+                    "ai_analyzed": ai_analysis.get('status') == 'success',
+                    "suggested_grade": ai_analysis.get('grade'),
+                    "meets_requirements": ai_analysis.get('meets_requirements', False),
+                    "participation_quality": ai_analysis.get('participation_quality', {}),
+                    "ai_analysis": ai_analysis
+                }
+            )
+
+        # Foroa osorik ebaluatuta (analisiak foroka egiten dira)
+        checkpoint_item(ctx, forum_key)
+
+
+def forum_task_entry(course_info: CourseInfo, forum: Dict[str, Any], item: Dict[str, Any],
+                     ai_analysis: Optional[Dict[str, Any]], status: str = 'submitted') -> Dict[str, Any]:
+    """Entrada de una participación en un foro-tarea para los informes del estudiante"""
+    cache_data = item['cache_data']
+    entry = {
+        'course_id': course_info.course_id,
+        'course_name': course_info.fullname,
+        'assignment_id': forum['id'],
+        'assignment_name': forum.get('name', 'Foro-tarea'),
+        'assignment_type': 'forum_task',
+        'student_id': item['student_info']['id'],
+        'student_username': item['user']['username'],
+        'filenames': [],  # Foros no tienen archivos
+        'timemodified': cache_data['last_post_time'],
+        'status': status,
+        'posts_count': len(item['posts']),
+        'total_words': cache_data['total_words'],
+        'ai_analysis': ai_analysis
+    }
+    if status == 'queued':
+        entry['queued_at'] = datetime.now().isoformat()
+    return entry
+
+
+def get_course_index(ctx: RunContext, course) -> Dict[str, Any]:
+    """
+    Datos del curso, estudiantes, profesores y actividades (estas se cargan al procesar las entregas)
+
+    Con `course_ttl` > 0 en la configuración (modo daemon) se reutilizan
+    mientras no caduquen; si no, se piden a Moodle en cada pasada.
+    """
+    entry = ctx.courses.get(str(course))
+    if entry and (entry.get('checkpointed') or
+                  time.time() - entry['fetched_at'] < ctx.settings.get('course_ttl', 0)):
+        return entry
+
+    course_data = ctx.moodle_client.get_courses(course)
+    course_info = CourseInfo(
+        course_data['courses'][0]['id'],
+        course_data['courses'][0]['fullname'],
+        course_data['courses'][0]['shortname']
+    )
+    if ctx.directory is None:
+        ctx.directory = UserDirectory(ctx.moodle_client)
+    roster = ctx.directory.roster(course_info.course_id)
+    entry = {
+        'course_info': course_info,
+        # Ikasle aktiboak bakarrik: irakasleei eta matrikula etenei ez zaie ezer eskatzen
+        'users': roster.students,
+        'teachers': sorted(roster.teacher_ids),
+        'activities': None,
+        'fetched_at': time.time()
+    }
+    ctx.courses[str(course)] = entry
+    return entry
+
+
+def process_course(ctx: RunContext, course, parts: Optional[List[str]] = None) -> CourseInfo:
+    """
+    Procesa las actividades de un curso
+
+    Args:
+        course: ID del curso
+        parts: Tipos de actividad a procesar (COURSE_PARTS); por defecto todos
+    """
+    parts = parts or COURSE_PARTS
+    index = get_course_index(ctx, course)
+    course_info, enrolled_users = index['course_info'], index['users']
+    logger.info(f"Processing Course: {course_info.fullname} (ID: {course_info.course_id})")
+    for user in enrolled_users:
+        ctx.state.users.setdefault(user['id'], user)
+
+    checkpoint = ctx.checkpoint
+    if 'submissions' in parts and index['activities'] is None:
+        index['activities'] = get_assign_activities(ctx, course_info) + get_vpl_activities(ctx, course_info)
+    if checkpoint:
+        checkpoint.data['index'] = index_to_dict(index)
+        checkpoint.save(ctx.state.to_dict, force=True)
+
+    for part in parts:
+        if checkpoint and checkpoint.part_done(part):
+            logger.info(f"⏭️  {part}: terminado antes de la interrupción")
+            continue
+        if part == 'submissions':
+            process_submissions(ctx, course_info, enrolled_users, index['activities'])
+        elif part == 'quizzes':
+            process_quizzes(ctx, course_info, enrolled_users)
+        elif part == 'task_forums':
+            process_task_forums(ctx, course_info, set(index.get('teachers', [])))
+        if checkpoint:
+            checkpoint.finish_part(part, ctx.state.to_dict)
+    return course_info
+
+
+def index_to_dict(index: Dict[str, Any]) -> Dict[str, Any]:
+    """Índice del curso serializable (punto de control)"""
+    return dict(index, course_info=asdict(index['course_info']))
+
+
+def index_from_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Índice del curso guardado; se reutiliza sin volver a pedirlo a Moodle"""
+    return dict(data, course_info=CourseInfo(**data['course_info']), checkpointed=True)
+
+
+def load_settings() -> Dict[str, Any]:
+    """Configuración de la ejecución desde el entorno (.env) y la línea de comandos"""
+    load_dotenv()
+    processes = int(os.getenv("MAIN_PROCESSES", "1"))
+    worker_id = None
+    i = 1
+    while i < len(sys.argv):
+        if sys.argv[i] in ['--processes', '-p'] and i + 1 < len(sys.argv):
+            processes = int(sys.argv[i + 1])
+            i += 2
+        elif sys.argv[i] == '--worker-id' and i + 1 < len(sys.argv):
+            worker_id = sys.argv[i + 1]
+            i += 2
+        else:
+            i += 1
+
+    return {
+        'moodle_url': os.getenv("MOODLE_URL"),
+        'moodle_token': os.getenv("TOKEN_MOODLE"),
+        'courses': os.getenv("COURSE_LIST").split(","),
+        # --queue: encolar el análisis con IA para `src/worker.py` en lugar de hacerlo aquí
+        'queue': '--queue' in sys.argv,
+        # --queue-report: informes de la última ejecución con --queue, cuando se ha vaciado la cola
+        'queue_report': '--queue-report' in sys.argv,
+        'processes': max(1, processes),
+        # --shard: nodo de una ejecución repartida (ver sharding.py)
+        'shard': '--shard' in sys.argv,
+        'shard_split': '--shard-split' in sys.argv,
+        # --shard-report: informes de la ejecución repartida, cuando han terminado todas las unidades
+        'shard_report': '--shard-report' in sys.argv,
+        'worker_id': worker_id,
+        # --plan: solo estimar el trabajo y el tiempo de la ejecución (run_planner.py)
+        'plan': '--plan' in sys.argv,
+        # Puntos de control por curso; --resume sigue desde el último (checkpoint.py)
+        'checkpoint': os.getenv("CHECKPOINT_ENABLED", "1") == "1" and '--shard' not in sys.argv,
+        'resume': '--resume' in sys.argv,
+        # Hodiaren etapa bakoitzeko hari kopurua eta ilaren tamaina (memoria mugatua)
+        'pipeline_workers': {
+            'fetch': int(os.getenv("PIPELINE_FETCH_WORKERS", "4")),
+            'download': int(os.getenv("PIPELINE_DOWNLOAD_WORKERS", "4")),
+            'analyze': int(os.getenv("PIPELINE_ANALYZE_WORKERS", "2"))
+        },
+        'pipeline_queue_size': int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+    }
+
+
+def build_analyzer(check_hosts: bool = True) -> AIAnalyzer:
+    """Analizador de IA de la ejecución; sin comprobar Ollama si solo se generan informes"""
+    return AIAnalyzer(model="qwen3:30b-a3b", think=False, check_hosts=check_hosts)
+
+
+def build_context(settings: Dict[str, Any]) -> RunContext:
+    """Cliente de Moodle, caché, analizador y cola para un proceso"""
+    # Initialize Moodle client, cache system and AI analyzer
+    moodle_client = MoodleClient(settings['moodle_url'], settings['moodle_token'])
+    moodle_client.connect()
+    return RunContext(
+        moodle_client=moodle_client,
+        cache=SubmissionCache("submission_cache.json"),
+        ai_analyzer=build_analyzer(),
+        job_queue=JobQueue() if settings['queue'] else None,
+        state=RunState(),
+        settings=settings,
+        directory=UserDirectory(moodle_client)
+    )
+
+
+def run_course(ctx: RunContext, course, parts: Optional[List[str]] = None) -> CourseResult:
+    """
+    Procesa un curso con un estado propio
+
+    Un error en el curso no detiene la ejecución: se devuelve en `error` junto
+    con lo que se haya procesado hasta ese momento (ya guardado en el caché).
+    """
+    result = CourseResult(course=course)
+    ctx.checkpoint = None
+    if ctx.settings.get('checkpoint'):
+        checkpoint = CourseCheckpoint.load(course) if ctx.settings.get('resume') else None
+        if checkpoint:
+            result = resume_course(ctx, checkpoint)
+            if checkpoint.finished:
+                return result
+        ctx.checkpoint = checkpoint or CourseCheckpoint(course)
+
+    ctx.state = result.state
+    ctx.pipeline = build_pipeline(ctx, ctx.settings['pipeline_workers'], ctx.settings['pipeline_queue_size'])
+    downloads_before = ctx.moodle_client.downloads.get_stats()
+    try:
+        result.course_info = process_course(ctx, course, parts)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        logger.error(f"❌ Error procesando el curso {course}: {result.error}")
+    result.pipeline = ctx.pipeline.get_stats()
+    ctx.moodle_client.blobs.flush()
+    result.downloads = download_manager.stats_delta(ctx.moodle_client.downloads.get_stats(), downloads_before)
+    # Akatsa badago, kontrol-puntua zabalik geratzen da hurrengo --resume-rako
+    if ctx.checkpoint and not result.error:
+        ctx.checkpoint.finish(ctx.state.to_dict, result.pipeline)
+    return result
+
+
+def resume_course(ctx: RunContext, checkpoint: CourseCheckpoint) -> CourseResult:
+    """
+    Resultado parcial (o completo) de un curso a partir de su punto de control
+
+    Restaura el RunState y el índice del curso en `ctx.courses`, así que
+    process_course no vuelve a pedir los usuarios ni las actividades.
+    """
+    data = checkpoint.data
+    result = CourseResult(course=checkpoint.course)
+    if data.get('state'):
+        result.state = RunState.from_dict(data['state'])
+        result.resumed_usage = result.state.total_usage()
+    if data.get('index'):
+        index = index_from_dict(data['index'])
+        ctx.courses[str(checkpoint.course)] = index
+        result.course_info = index['course_info']
+    if checkpoint.finished:
+        result.pipeline = data.get('pipeline') or {}
+        logger.info(f"⏭️  Curso {checkpoint.course}: terminado en la ejecución interrumpida, restaurado")
+    else:
+        logger.info(f"↩️  Curso {checkpoint.course}: se reanuda | partes terminadas: {data['parts_done'] or '-'} | "
+                    f"{len(checkpoint.done)} elemento(s) ya procesados")
+    return result
+
+
+# Prozesu bakoitzak bere testuingurua du (Moodle bezeroa, cachea, analizatzailea)
+_process_ctx: Optional[RunContext] = None
+
+
+def _init_course_process(settings: Dict[str, Any]):
+    global _process_ctx
+    _process_ctx = build_context(settings)
+
+
+def _run_course_in_process(course) -> CourseResult:
+    analyzer = _process_ctx.ai_analyzer
+    generation_before, hosts_before = analyzer.get_generation_stats(), analyzer.get_host_status()
+    result = run_course(_process_ctx, course)
+    # Prozesu nagusiak ez du analizatzailerik sortzen: metrikak emaitzarekin bidali
+    result.generation = generation.stats_delta(analyzer.get_generation_stats(), generation_before)
+    result.hosts = ollama_pool.status_delta(analyzer.get_host_status(), hosts_before)
+    return result
+
+
+def run_courses_in_processes(settings: Dict[str, Any]) -> List[CourseResult]:
+    """
+    Procesa cada curso en un proceso hijo con su propio MoodleClient y AIAnalyzer
+
+    Los hijos escriben en el mismo submission_cache.json (se bloquea y se
+    fusiona al guardar) y devuelven su RunState para fusionarlo aquí. Si un
+    proceso muere, solo se pierde su curso.
+    """
+    courses = settings['courses']
+    results = []
+    logger.info(f"🧩 {len(courses)} curso(s) en {settings['processes']} proceso(s)")
+
+    with ProcessPoolExecutor(max_workers=settings['processes'], initializer=_init_course_process,
+                             initargs=(settings,)) as executor:
+        futures = {executor.submit(_run_course_in_process, course): course for course in courses}
+        for future in as_completed(futures):
+            course = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = CourseResult(course=course, error=f"{type(e).__name__}: {e}")
+                logger.error(f"❌ El proceso del curso {course} ha fallado: {result.error}")
+            results.append(result)
+
+    # Jatorrizko ordena mantendu (txostenak eta laburpena)
+    order = {course: index for index, course in enumerate(courses)}
+    return sorted(results, key=lambda r: order[r.course])
+
+
+def generate_reports(ai_analyzer: AIAnalyzer, report_generator: ReportGenerator, state: RunState,
+                     course_info: Optional[CourseInfo]):
+    """Informes de riesgo por estudiante e informe del curso a partir del estado de toda la ejecución"""
     logger.info("\n" + "="*60)
     logger.info("GENERANDO INFORMES DE ANÁLISIS")
     logger.info("="*60 + "\n")
-    
+
     # Generar informes por estudiante
     all_student_reports = []
-    
-    for student_id, submissions in student_submissions_map.items():
+
+    for student_id, submissions in state.student_submissions_map.items():
         if not submissions:
             continue
-        
+
         # Obtener info del estudiante
-        student_info = next(
-            (user for user in enrolled_users if user['id'] == student_id),
-            {'id': student_id, 'username': f'student_{student_id}'}
-        )
-        
+        student_info = state.users.get(student_id, {'id': student_id, 'username': f'student_{student_id}'})
+
         logger.info(f"Generando informe para: {student_info['username']}")
-        
+
         # Generar informe del estudiante
         student_report = ai_analyzer.generate_student_report(submissions, student_info)
         all_student_reports.append(student_report)
-        
+
         # Mostrar resumen en consola
         risk_icon = {'high': '🔴', 'medium': '🟡', 'low': '🟢'}
         logger.info(f"  {risk_icon[student_report['risk_level']]} Nivel de riesgo: {student_report['risk_level'].upper()}")
-        
+
         if student_report.get('risk_reasons'):
             for reason in student_report['risk_reasons'][:2]:  # Mostrar solo 2 razones
                 logger.info(f"    - {reason}")
-        
+
         # Generar archivo de informe detallado (solo para estudiantes en riesgo)
         if student_report['risk_level'] in ['high', 'medium']:
             try:
@@ -631,14 +1172,14 @@ CRITERIOS DE EVALUACIÓN GENERALES:
                 logger.info(f"  📄 Informe guardado: {report_path}")
             except Exception as e:
                 logger.error(f"  Error generando informe: {e}")
-    
+
     # Generar informe general del curso
     logger.info("\n" + "-"*60)
     logger.info("Generando informe general del curso...")
     logger.info("-"*60)
-    
+
     course_report = ai_analyzer.generate_course_report(all_student_reports)
-    
+
     # Mostrar resumen del curso
     summary = course_report['course_summary']
     logger.info(f"\n📊 RESUMEN DEL CURSO:")
@@ -646,26 +1187,282 @@ CRITERIOS DE EVALUACIÓN GENERALES:
     logger.info(f"  🔴 Alto riesgo: {summary['high_risk_count']}")
     logger.info(f"  🟡 Riesgo medio: {summary['medium_risk_count']}")
     logger.info(f"  🟢 Bajo riesgo: {summary['low_risk_count']}")
-    
+
     # Mostrar recomendaciones
     if course_report.get('recommendations'):
         logger.info(f"\n💡 RECOMENDACIONES:")
         for rec in course_report['recommendations']:
             logger.info(f"  - {rec}")
-    
+
     # Guardar informe del curso
     try:
         course_report_path = report_generator.generate_course_report(
             course_report,
-            course_info.fullname
+            course_info.fullname if course_info else "Sin cursos"
         )
         logger.info(f"\n📄 Informe del curso guardado: {course_report_path}")
     except Exception as e:
         logger.error(f"Error guardando informe del curso: {e}")
-    
+
+
+def fill_queued_analyses(state: RunState, cache: SubmissionCache) -> int:
+    """
+    Completa las entradas encoladas (`status` 'queued') con el análisis que los workers han guardado en el caché
+
+    Returns:
+        Número de entradas que siguen sin análisis
+    """
+    # Workerrek bitartean fitxategian gordetakoa irakurri
+    cache.reload()
+    missing = 0
+    for submissions in state.student_submissions_map.values():
+        for entry in submissions:
+            if entry.get('status') != 'queued':
+                continue
+            cached = cache.get_entry(entry['course_id'], entry['assignment_id'], entry['student_id'],
+                                     entry['assignment_type'])
+            # Aurreko bertsioaren analisia ez da balio: workerrak ilaran sartu ondoren idatzitakoa soilik
+            if not cached or cached.get('last_updated', '') < entry['queued_at'] or cached.get('ai_analysis') is None:
+                missing += 1
+                continue
+            entry['ai_analysis'] = cached['ai_analysis']
+            entry['status'] = 'submitted'
+    return missing
+
+
+def save_queue_state(state: RunState, course_info: Optional[CourseInfo]):
+    """Guarda el estado de una ejecución con --queue para `main.py --queue-report`"""
+    with open(QUEUE_STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'state': state.to_dict(), 'course_info': asdict(course_info) if course_info else None},
+                  f, ensure_ascii=False)
+
+
+def generate_queue_reports(report_generator: ReportGenerator) -> bool:
+    """
+    Informes de la última ejecución con --queue, con los análisis que han guardado los workers
+
+    Returns:
+        False si la cola aún tiene trabajos pendientes o en curso, o si no hay estado guardado
+    """
+    if not os.path.exists(QUEUE_STATE_FILE):
+        logger.error(f"❌ Sin estado de una ejecución con --queue en {QUEUE_STATE_FILE}")
+        return False
+    counts = JobQueue().stats()
+    if counts['pending'] or counts['leased']:
+        logger.error(f"❌ La cola aún tiene trabajos ({counts['pending']} pendientes, {counts['leased']} en curso), "
+                     f"no se generan informes")
+        return False
+
+    with open(QUEUE_STATE_FILE, encoding='utf-8') as f:
+        saved = json.load(f)
+    state = RunState.from_dict(saved['state'])
+    course_info = CourseInfo(**saved['course_info']) if saved.get('course_info') else None
+    missing = fill_queued_analyses(state, SubmissionCache("submission_cache.json"))
+    if missing:
+        # Dead-letter: ez dira cachera iritsi; analisirik gabe sartzen dira
+        logger.warning(f"⚠️ {missing} entrega(s) encoladas sin análisis en el caché "
+                       f"(trabajos fallidos: {counts['dead']}); se incluyen sin análisis")
+    generate_reports(build_analyzer(check_hosts=False), report_generator, state, course_info)
+    return True
+
+
+def generate_shard_reports(report_generator: ReportGenerator) -> bool:
+    """
+    Informes de una ejecución repartida (`SHARD_RUN_ID`), con los estados de todas sus unidades
+
+    Returns:
+        False si alguna unidad no ha terminado (no se generan informes parciales)
+    """
+    run_id = default_run_id()
+    collected = collect_run_results(open_shard_queue(), run_id)
+    if collected['unfinished']:
+        logger.error(f"❌ Ejecución {run_id}: {len(collected['unfinished'])} unidad(es) sin terminar, "
+                     f"no se generan informes: {', '.join(collected['unfinished'])}")
+        return False
+    if not collected['results']:
+        logger.error(f"❌ Ejecución {run_id}: sin unidades en {SHARD_DB}")
+        return False
+
+    state = RunState()
+    course_info = None
+    for result in collected['results']:
+        state.merge(RunState.from_dict(result['state']))
+        if result.get('course_info'):
+            course_info = CourseInfo(**result['course_info'])
+    # --shard --queue: nodoen workerrek cachean utzitako analisiak
+    fill_queued_analyses(state, SubmissionCache("submission_cache.json"))
+    logger.info(f"🧩 Ejecución {run_id}: {len(collected['results'])} unidad(es) fusionadas")
+    generate_reports(build_analyzer(check_hosts=False), report_generator, state, course_info)
+    return True
+
+
+def main():
+    # load environment variables
+    settings = load_settings()
+    COURSE_LIST = settings['courses']
+
+    if settings['plan']:
+        # Lehorrean: cachea eta metadatu merkeak bakarrik, ez deskargarik ez analisirik
+        moodle_client = MoodleClient(settings['moodle_url'], settings['moodle_token'])
+        history = load_history("reports")
+        planner = RunPlanner(moodle_client, SubmissionCache("submission_cache.json"), history)
+        print_plan(planner.plan(COURSE_LIST), history, settings)
+        return
+
+    if settings['shard_report']:
+        if not generate_shard_reports(ReportGenerator(output_dir="reports")):
+            sys.exit(1)
+        return
+
+    if settings['queue_report']:
+        if not generate_queue_reports(ReportGenerator(output_dir="reports")):
+            sys.exit(1)
+        return
+
+    cache = SubmissionCache("submission_cache.json")
+    report_generator = ReportGenerator(output_dir="reports")
+
+    # Mostrar estadísticas del caché al inicio
+    stats = cache.get_stats()
+    logger.info("="*60)
+    logger.info("ESTADÍSTICAS DEL CACHÉ")
+    logger.info("="*60)
+    logger.info(f"Total de entregas en caché: {stats['total_entries']}")
+    if stats['by_status']:
+        logger.info(f"Por estado: {stats['by_status']}")
+    logger.info("="*60 + "\n")
+
+    run_started = datetime.now()
+    if settings['checkpoint'] and not settings['resume']:
+        # Exekuzio berria: aurrekoaren kontrol-puntuak ez dira balio
+        clear_checkpoints()
+
+    # --shard: unitateak taula partekatutik; --processes N: ikastaro bakoitza prozesu batean;
+    # bestela, bata bestearen atzetik
+    in_processes = not settings['shard'] and settings['processes'] > 1
+    if settings['shard']:
+        ctx = build_context(settings)
+        shard_queue = open_shard_queue()
+        plan_units(shard_queue, COURSE_LIST, default_run_id(), split=settings['shard_split'])
+        results = run_shard_worker(shard_queue, lambda course, parts: run_course(ctx, course, parts),
+                                   worker_id=settings['worker_id'])
+    elif in_processes:
+        results = run_courses_in_processes(settings)
+    else:
+        ctx = build_context(settings)
+        results = [run_course(ctx, course) for course in COURSE_LIST]
+
+    if in_processes:
+        # Los hijos ya han analizado: el resumen y los informes no necesitan Moodle ni comprobar Ollama
+        ai_analyzer = build_analyzer(check_hosts=False)
+        job_queue = JobQueue() if settings['queue'] else None
+        generation_stats = generation.merge_stats([r.generation for r in results])
+        host_status = ollama_pool.merge_status([r.hosts for r in results])
+    else:
+        ai_analyzer, job_queue = ctx.ai_analyzer, ctx.job_queue
+        generation_stats, host_status = ai_analyzer.get_generation_stats(), ai_analyzer.get_host_status()
+
+    state = RunState()
+    course_info = None
+    for result in results:
+        state.merge(result.state)
+        if result.course_info:
+            course_info = result.course_info
+    failed_courses = {r.course: r.error for r in results if r.error}
+
+    # Resumen final
+    logger.info(f"\n{'='*60}")
+    logger.info("RESUMEN DE EJECUCIÓN")
+    logger.info("="*60)
+    logger.info(f"Entregas nuevas o modificadas: {state.new_submissions}")
+    logger.info(f"Entregas sin cambios (omitidas): {state.unchanged_submissions}")
+    logger.info(f"Total procesadas: {state.new_submissions + state.unchanged_submissions}")
+    if job_queue:
+        logger.info(f"Encoladas para análisis: {state.queued_jobs} | Cola: {job_queue.stats()}")
+    for course, error in failed_courses.items():
+        logger.error(f"❌ Curso {course} con errores: {error}")
+
+    # Hodiaren etapak: erabilera altuena duena da botila-lepoa
+    pipeline_stats = merge_stats([r.pipeline for r in results])
+    logger.info(f"Pipeline de entregas:")
+    for name, s in pipeline_stats.items():
+        logger.info(f"  {name:<9} {s['workers']} hilo(s) | {s['in']} entradas | {s['errors']} errores | "
+                    f"ocupado {s['busy_seconds']}s | utilización {s['utilization']:.0%}")
+    download_stats = download_manager.merge_stats([r.downloads for r in results])
+    logger.info(f"Descargas: {download_stats['files']} archivo(s) | {download_stats['bytes'] / 1024 / 1024:.1f} MB | "
+                f"{download_stats['resumed']} reanudadas | {download_stats['retries']} reintentos | "
+                f"{download_stats['errors']} errores | limitadas {download_stats['throttled_seconds']:.0f}s")
+    logger.info(f"  Sin descargar (ya en el almacén): {download_stats['skipped']} | "
+                f"{download_stats['bytes_saved'] / 1024 / 1024:.1f} MB ahorrados | "
+                f"contenido repetido: {download_stats['deduplicated']} | "
+                f"archivos del profesor (VPL): {download_stats['excluded']}")
+
+    # Tokenak eta GPU denbora (exekuzio osoa, ikastaroka eta zereginka)
+    run_usage = ai_analyzer.engine.get_usage()
+    if in_processes:
+        # Prozesu umeen erabilera ikastaroen kontabilitatean dago
+        run_usage.add(state.total_usage())
+    else:
+        for result in results:
+            run_usage.add(result.resumed_usage)
+    logger.info(f"IA (total): {format_usage(run_usage)}")
+    for course_id, entry in state.usage_by_course.items():
+        logger.info(f"  Curso {entry['name']} ({course_id}): {format_usage(entry['usage'])}")
+    for key, entry in state.usage_by_assignment.items():
+        logger.info(f"    {entry['type']} {entry['name']}: {format_usage(entry['usage'])}")
+    logger.info("="*60 + "\n")
+
+    run_summary = {
+        'started_at': run_started.isoformat(),
+        'finished_at': datetime.now().isoformat(),
+        'duration_seconds': round((datetime.now() - run_started).total_seconds(), 1),
+        'courses': COURSE_LIST,
+        'processes': settings['processes'],
+        'resumed': settings['resume'],
+        'failed_courses': failed_courses,
+        'submissions': {
+            'new_or_modified': state.new_submissions,
+            'unchanged': state.unchanged_submissions
+        },
+        'pipeline': pipeline_stats,
+        'downloads': download_stats,
+        'usage': run_usage.to_dict(),
+        'usage_by_course': {k: dict(v, usage=v['usage'].to_dict()) for k, v in state.usage_by_course.items()},
+        'usage_by_assignment': {k: dict(v, usage=v['usage'].to_dict()) for k, v in state.usage_by_assignment.items()},
+        'generation': generation_stats,
+        'ollama_hosts': host_status
+    }
+    try:
+        run_summary_path = report_generator.generate_run_summary(run_summary)
+        logger.info(f"📄 Resumen de ejecución guardado: {run_summary_path}")
+    except Exception as e:
+        logger.error(f"Error guardando resumen de ejecución: {e}")
+
+    if settings['shard']:
+        # Nodo de una ejecución repartida: sus unidades son solo una parte de los cursos
+        # (con --shard-split, parte de las actividades de cada estudiante). Los informes
+        # parciales marcarían como riesgo lo que han procesado otros nodos.
+        logger.info("🛰️  Informes de riesgo y del curso: se generan una vez, cuando terminen todas las "
+                    "unidades, con `python src/main.py --shard-report`")
+    elif job_queue:
+        # Ilarako analisiak workerren esku: orain arte amaitutakoak cachetik
+        save_queue_state(state, course_info)
+        missing = fill_queued_analyses(state, SubmissionCache("submission_cache.json"))
+        if missing:
+            logger.info(f"📥 {missing} análisis aún en la cola: los informes se generan cuando se vacíe, "
+                        f"con `python src/main.py --queue-report`")
+        else:
+            generate_reports(ai_analyzer, report_generator, state, course_info)
+    else:
+        generate_reports(ai_analyzer, report_generator, state, course_info)
+
+    # Informeak sortuta: kontrol-puntuak ez dira behar
+    if settings['checkpoint'] and not failed_courses:
+        clear_checkpoints()
+
     logger.info("\n" + "="*60)
     logger.info("PROCESO COMPLETADO")
     logger.info("="*60 + "\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,17 +1,43 @@
 import requests
-import base64
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from download_manager import DownloadManager
+from blob_store import BlobStore, decode_base64
+from forum_store import ForumStore, watermark
+from roster import UserDirectory
 from logger_config import get_logger
 
 logger = get_logger(__name__)
 
+# Konexio irekien multzoa (pipeline-ko hariek eta daemon-ak berrerabiltzen dituzte)
+POOL_SIZE = int(os.getenv("MOODLE_POOL_SIZE", "16"))
+# Moodle-ri aldi berean egindako deiak (foroen orriak eta mezuak) eta foroen orriaren tamaina
+API_CONCURRENCY = int(os.getenv("MOODLE_API_CONCURRENCY", "8"))
+FORUM_PAGE_SIZE = int(os.getenv("FORUM_PAGE_SIZE", "50"))
+# VPL: irakaslearen fitxategiak (probak, konpilazio-scriptak); ez dira ikaslearen entregaren parte
+VPL_TEACHER_FILE_TYPES = ('compilationfiles', 'executionfiles')
+
 class MoodleClient:
     def __init__(self, base_url, token):
         self.base_url = base_url
         self.token = token
+        # Sesión HTTP compartida: keep-alive y conexiones reutilizadas entre peticiones
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Deskargak: hari multzo mugatua, zerbitzariko muga eta Range bidezko berrekitea
+        self.downloads = DownloadManager(self.session)
+        # Fitxategiak edukiaren hash-aren arabera, behin bakarrik gordeta
+        self.blobs = BlobStore(self.downloads)
+        # Foroen deiak: orriak eta eztabaiden mezuak aldi berean, mugarekin
+        self.api_pool = ThreadPoolExecutor(max_workers=API_CONCURRENCY, thread_name_prefix="moodle-api")
+        # Foroen mezuen kopia lokala: aldatutako eztabaidak bakarrik eskatzen dira
+        self.forums = ForumStore()
 
     def connect(self):
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params={
             "wstoken": self.token,
@@ -25,7 +51,7 @@ class MoodleClient:
 
 
     def get_task_description(self, course_id, task_id):
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -37,9 +63,14 @@ class MoodleClient:
         )
         return response.json()
 
-    def get_student_submissions(self, course_id, task_id, student_id):
-        
-        response = requests.get(
+    def get_assignment_submissions(self, task_id):
+        """
+        Todas las entregas de una tarea en una sola llamada
+
+        Returns:
+            Dict {userid: entrega}, o un texto "Error: ..." si Moodle devuelve una excepción
+        """
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -54,16 +85,20 @@ class MoodleClient:
         if "exception" in data:
             return f"Error: {data['message']}"
 
-        # Buscar la entrega del estudiante
-        for submission in data.get("assignments", [])[0].get("submissions", []):
-            if submission["userid"] == student_id:
-                return submission
+        assignments = data.get("assignments") or [{}]
+        return {submission["userid"]: submission for submission in assignments[0].get("submissions", [])}
+
+    def get_student_submissions(self, course_id, task_id, student_id):
+        submissions = self.get_assignment_submissions(task_id)
+        if isinstance(submissions, str):
+            return submissions
 
-        return "Entrega no encontrada"
+        # Buscar la entrega del estudiante
+        return submissions.get(student_id, "Entrega no encontrada")
     
     def get_vpl_assignments(self, course_id):
         
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -100,7 +135,7 @@ class MoodleClient:
             Dict VPL informazioarekin (deskribapena, etab.)
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -122,7 +157,8 @@ class MoodleClient:
                     "grade": data.get("grade", 0),
                     "duedate": data.get("duedate", 0),
                     "requirednet": data.get("requirednet", ""),
-                    "restrictededitor": data.get("restrictededitor", 0)
+                    "restrictededitor": data.get("restrictededitor", 0),
+                    "teacher_files": self._vpl_teacher_hashes(data)
                 }
             
             return {"intro": "", "error": data.get("message", "No info")}
@@ -133,14 +169,27 @@ class MoodleClient:
 
 
 
-    def get_vpl_submissions(self, vplid, course_id, student_id, cmid=None):
+    @staticmethod
+    def _vpl_teacher_hashes(data: dict) -> list:
+        """SHA-256 de los archivos del profesor de un VPL (compilationfiles, executionfiles)"""
+        hashes = set()
+        for file_type in VPL_TEACHER_FILE_TYPES:
+            for file_entry in data.get(file_type) or []:
+                content = isinstance(file_entry, dict) and (file_entry.get("data") or file_entry.get("content"))
+                if content:
+                    hashes.add(decode_base64(content)[1])
+        return sorted(hashes)
+
+    def get_vpl_submissions(self, vplid, course_id, student_id, cmid=None, teacher_files=None):
         # Intenta obtener las entregas VPL usando la API de Moodle.
         # El VPL plugin usa principalmente mod_vpl_open para obtener la información de la entrega
         # IMPORTANTE: mod_vpl_open requiere el CMID (course module id), NO el vplid (instance id)
         
+        # `teacher_files`: hashes de get_vpl_info()['teacher_files'] (si es None, los de esta respuesta);
+        # los archivos con esos hashes no se guardan
         # Si no se proporciona cmid, usar vplid (para retrocompatibilidad, pero probablemente fallará)
         module_id = cmid if cmid is not None else vplid
-        response = requests.get(
+        response = self.session.get(
             self.base_url + "/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -154,8 +203,9 @@ class MoodleClient:
         if response.status_code != 200:
             raise ConnectionError(f"Failed to connect to Moodle API (status {response.status_code})")
 
-        data = response.json()
-
+        # Bytetatik zuzenean: JSON testua ez da bi aldiz gordetzen (bytes + str)
+        data = json.loads(response.content)
+        del response
 
         # Verifica si hay errores en la respuesta
         if isinstance(data, dict) and "exception" in data:
@@ -166,7 +216,7 @@ class MoodleClient:
             return "Entrega no encontrada"
 
         # Procesar archivos adjuntos de la entrega
-        saved_files = []
+        entries = []
 
         # mod_vpl_open devuelve típicamente un dict con 'files' que contiene los archivos del estudiante
         # Formato típico: {'files': [{'name': 'file.py', 'data': 'contenido_base64', ...}], ...}
@@ -176,19 +226,31 @@ class MoodleClient:
             
             if files_data:
                 if isinstance(files_data, list):
-                    for file_item in files_data:
-                        self._process_vpl_file_entry(file_item, saved_files, vplid, student_id)
+                    entries.extend(files_data)
                 elif isinstance(files_data, dict):
                     # Puede ser un dict con nombres de archivo como claves
-                    for filename, content in files_data.items():
-                        file_obj = {"name": filename, "data": content}
-                        self._process_vpl_file_entry(file_obj, saved_files, vplid, student_id)
+                    entries.extend({"name": filename, "data": content} for filename, content in files_data.items())
             
-            # También procesar compilationfiles y executionfiles si existen
-            for file_type in ['compilationfiles', 'executionfiles']:
-                if file_type in data and isinstance(data[file_type], list):
-                    for file_item in data[file_type]:
-                        self._process_vpl_file_entry(file_item, saved_files, vplid, student_id)
+            # compilationfiles y executionfiles son del profesor: ni se guardan ni van al análisis
+            if teacher_files is None:
+                # VPL-aren hash-ak ez badaude, erantzun honetakoak erabili
+                teacher_files = self._vpl_teacher_hashes(data)
+            for file_type in VPL_TEACHER_FILE_TYPES:
+                data.pop(file_type, None)
+
+            if not entries:
+                return "Entrega no encontrada"
+
+        # Ikaslearen fitxategiak aldi berean deskodetu (deskargen pool-a), ordena mantenduz
+        exclude = frozenset(teacher_files or ())
+        results = self.downloads.run_many(
+            lambda entry: self._process_vpl_file_entry(entry, vplid, student_id, exclude),
+            [(entry,) for entry in entries])
+        saved_files = [path for path in results if isinstance(path, str)]
+
+        # Irakaslearen fitxategien kopiak besterik ez: ikasleak ez du ezer entregatu
+        if not saved_files and all(result is None for result in results):
+            return "Entrega no encontrada"
 
         # Si no se encontraron archivos, devolver la entrega cruda
         if not saved_files:
@@ -196,15 +258,17 @@ class MoodleClient:
 
         return saved_files
 
-    def _process_vpl_file_entry(self, file_entry, saved_files, vplid=None, student_id=None):
+    def _process_vpl_file_entry(self, file_entry, vplid=None, student_id=None, exclude=frozenset()):
         """Procesa una entrada de archivo de VPL y guarda el fichero localmente cuando es posible.
-        Añade la ruta al fichero guardado a la lista `saved_files`.
         
         Args:
             file_entry: Diccionario con información del archivo (name, data, filename, content, etc.)
-            saved_files: Lista donde se añadirán las rutas de archivos guardados
             vplid: ID del VPL (opcional, para organizar carpetas)
             student_id: ID del estudiante (opcional, para organizar carpetas)
+            exclude: SHA-256 de los archivos del profesor, que no se guardan
+
+        Returns:
+            Ruta del fichero guardado, None si es un archivo del profesor, False si no se ha podido guardar
         """
         if not isinstance(file_entry, dict):
             return False
@@ -221,39 +285,37 @@ class MoodleClient:
                 fileurl_with_token = f"{fileurl}{sep}token={self.token}"
             else:
                 fileurl_with_token = fileurl
+            # Ikasle bakoitzaren karpeta, base64 fitxategien antzera
+            destination = f"vpl_{vplid}/student_{student_id}/{filename}" if vplid and student_id else filename
             try:
-                saved = self.download_file(fileurl_with_token, filename)
-                saved_files.append(saved)
-                return True
+                return self.download_file(fileurl_with_token, destination,
+                                          filesize=file_entry.get("filesize"),
+                                          timemodified=file_entry.get("timemodified"))
             except Exception as e:
                 logger.error(f"Error downloading file {filename}: {e}")
                 return False
 
         # Si viene contenido codificado en base64 (formato típico de VPL)
         # VPL usa 'data' para el contenido del archivo
-        content_b64 = file_entry.get("data") or file_entry.get("content") or file_entry.get("filecontent") or file_entry.get("contentbase64")
-        if content_b64:
+        content_key = next((key for key in ("data", "content", "filecontent", "contentbase64")
+                            if file_entry.get(key)), None)
+        if content_key:
             try:
-                # Si el contenido ya es texto plano (no base64), intentar guardarlo directamente
-                try:
-                    decoded = base64.b64decode(content_b64)
-                except Exception:
-                    # Si falla la decodificación, asumir que es texto plano
-                    decoded = content_b64.encode('utf-8') if isinstance(content_b64, str) else content_b64
-                
                 # Asegurar carpeta (opcionalmente organizada por vplid/student_id)
                 if vplid and student_id:
                     dest_dir = os.path.join("downloads", f"vpl_{vplid}", f"student_{student_id}")
                 else:
                     dest_dir = "downloads"
-                
-                os.makedirs(dest_dir, exist_ok=True)
                 dest_path = os.path.join(dest_dir, filename)
-                
-                with open(dest_path, "wb") as fh:
-                    fh.write(decoded)
-                saved_files.append(dest_path)
-                return True
+
+                # Zatika deskodetu; hash-a diskoan badago ez da idazten (base64 ez bada, testu laua)
+                stored = self.blobs.put_base64(file_entry[content_key], dest_path, exclude=exclude)
+                # Gordeta (edo baztertuta) dago: base64 testua askatu ahal izateko
+                file_entry.pop(content_key)
+                if stored is None:
+                    logger.debug(f"  Archivo del profesor omitido: {filename}")
+                    return None
+                return dest_path
             except Exception as e:
                 logger.error(f"Error processing file {filename}: {e}")
                 return False
@@ -262,7 +324,7 @@ class MoodleClient:
 
 
     def get_courses(self, course_name):
-        response = requests.get(
+        response = self.session.get(
             self.base_url + "/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -277,16 +339,18 @@ class MoodleClient:
             raise ConnectionError("Error al conectar con la API de Moodle")
         return response.json()
     
-    def get_users(self, course_id):
-        response = requests.get(
-            self.base_url + "/webservice/rest/server.php",
-            params={
-                "wstoken": self.token,
-                "wsfunction": "core_enrol_get_enrolled_users",
-                "moodlewsrestformat": "json",
-                "courseid": course_id
-            }
-        )
+    def get_users(self, course_id, only_active=False):
+        params = {
+            "wstoken": self.token,
+            "wsfunction": "core_enrol_get_enrolled_users",
+            "moodlewsrestformat": "json",
+            "courseid": course_id
+        }
+        if only_active:
+            # Matrikula aktiboak bakarrik (ez etenak, ez iraungiak)
+            params["options[0][name]"] = "onlyactive"
+            params["options[0][value]"] = 1
+        response = self.session.get(self.base_url + "/webservice/rest/server.php", params=params)
 
         if response.status_code != 200:
             raise ConnectionError("Error al conectar con la API de Moodle")
@@ -294,7 +358,7 @@ class MoodleClient:
         return response.json()
     
     def get_assignmets(self, course_id):
-        response = requests.get(
+        response = self.session.get(
             self.base_url + "/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -309,26 +373,48 @@ class MoodleClient:
         return response.json()
     
     
-    def download_file(self, file_url, destination_path):
-        # Asegura que exista la carpeta downloads
-        os.makedirs(os.path.dirname(os.path.join("", f"downloads/{destination_path}")), exist_ok=True)
-        destination_path = f"downloads/{destination_path}"
-
+    def _with_token(self, file_url):
         # Si la URL ya contiene token, no añadir otro
-        file_url_with_token = file_url
-        if "token=" not in file_url:
-            sep = "&" if "?" in file_url else "?"
-            file_url_with_token = f"{file_url}{sep}token={self.token}"
-
-        response = requests.get(file_url_with_token, stream=True)
-        if response.status_code == 200:
-            with open(destination_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
-                    if chunk:
-                        f.write(chunk)
-            return destination_path
-        else:
-            raise ConnectionError(f"Failed to download file from Moodle. Status code: {response.status_code}")
+        if "token=" in file_url:
+            return file_url
+        sep = "&" if "?" in file_url else "?"
+        return f"{file_url}{sep}token={self.token}"
+
+    @staticmethod
+    def file_key(file_url):
+        """URL del archivo sin el token (identifica el archivo en el índice de blobs)"""
+        base, _, query = file_url.partition("?")
+        params = [p for p in query.split("&") if p and not p.startswith("token=")]
+        return f"{base}?{'&'.join(params)}" if params else base
+
+    def download_file(self, file_url, destination_path, filesize=None, timemodified=None):
+        """
+        Deja un archivo en downloads/<destination_path> y devuelve la ruta
+
+        Se guarda en el almacén de blobs; si `filesize` y `timemodified`
+        coinciden con los de la última descarga, no se vuelve a descargar.
+        """
+        return self.blobs.fetch(self._with_token(file_url), f"downloads/{destination_path}",
+                                key=self.file_key(file_url), filesize=filesize, timemodified=timemodified)
+
+    def download_files(self, files):
+        """
+        Descarga varios archivos en paralelo (ver download_file)
+
+        Args:
+            files: Lista de (file_url, destination_path) o (file_url, destination_path, doc),
+                   donde doc es la entrada de Moodle con 'filesize' y 'timemodified'
+
+        Returns:
+            Por cada archivo, en el mismo orden, la ruta o la excepción
+        """
+        items = []
+        for url, destination, *doc in files:
+            doc = doc[0] if doc else {}
+            items.append((self._with_token(url), f"downloads/{destination}",
+                          {'key': self.file_key(url), 'filesize': doc.get('filesize'),
+                           'timemodified': doc.get('timemodified')}))
+        return self.blobs.fetch_many(items)
 
     def get_quizzes(self, course_id):
         """
@@ -341,7 +427,7 @@ class MoodleClient:
             Lista de diccionarios con información de los quizzes:
             [{"name": "Quiz 1", "quizid": 123, "cmid": 456, "section": "Tema 1"}, ...]
         """
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -394,7 +480,7 @@ class MoodleClient:
         if student_id is not None:
             params["userid"] = student_id
         
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params=params
         )
@@ -424,7 +510,7 @@ class MoodleClient:
             Dict con información de la calificación o mensaje de error
         """
         # Usar mod_quiz_get_user_best_grade - más permisivo que gradereport
-        response = requests.get(
+        response = self.session.get(
             f"{self.base_url}/webservice/rest/server.php",
             params={
                 "wstoken": self.token,
@@ -536,7 +622,7 @@ class MoodleClient:
             Dict con información del quiz o None si hay error
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -606,7 +692,7 @@ class MoodleClient:
             Dict zehaztasun guztiekin
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -654,7 +740,7 @@ class MoodleClient:
             Dict rubrika/guia informazioarekin
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -746,7 +832,7 @@ class MoodleClient:
             cmid edo None
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -904,7 +990,7 @@ class MoodleClient:
             Foroen zerrenda: [{"id": 1, "name": "Foro 1", "type": "general", ...}, ...]
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -989,15 +1075,19 @@ class MoodleClient:
         all_forums = self.get_forums(course_id)
         return [f for f in all_forums if f.get('is_task', False)]
     
-    def get_forum_with_student_posts(self, forum_id: int) -> dict:
+    def get_forum_with_student_posts(self, forum_id: int, expected_discussions: int = 0) -> dict:
         """
         Lortu foroaren eduki osoa ikasleen mezuekin bilduta
         
         Args:
             forum_id: Foroaren IDa
+            expected_discussions: Eztabaida kopurua (get_forums()['numdiscussions']), orriak aldi berean eskatzeko
         
         Returns:
             Dict foroaren informazio osoarekin eta ikasle bakoitzaren mezuekin
+
+        Raises:
+            ConnectionError: Eztabaidaren bat edo mezuren bat ezin bada lortu (argazki osatugabea)
         """
         result = {
             'forum_id': forum_id,
@@ -1006,20 +1096,43 @@ class MoodleClient:
             'total_posts': 0
         }
         
-        discussions_data = self.get_forum_discussions(forum_id)
-        
-        for disc in discussions_data.get('discussions', []):
-            posts_data = self.get_discussion_posts(disc['id'])
+        discussions_data = self.get_forum_discussions(forum_id, expected=expected_discussions)
+        if 'error' in discussions_data:
+            raise ConnectionError(f"Eztabaidak ezin lortu: {discussions_data['error']}")
+        discussions = discussions_data.get('discussions', [])
+
+        # Aldatutako eztabaiden mezuak bakarrik, aldi berean (API_CONCURRENCY); besteak kopia lokaletik
+        stored = self.forums.load(forum_id)
+        changed = self.forums.changed(stored, discussions)
+        posts_results = self.map_concurrent(self.get_discussion_posts, [(disc['id'],) for disc in changed])
+
+        for disc, posts_data in zip(changed, posts_results):
+            if 'error' in posts_data:
+                raise ConnectionError(f"Eztabaida {disc['id']}: {posts_data['error']}")
+            stored[str(disc['id'])] = {'watermark': watermark(disc), 'name': disc['name'],
+                                       'posts': posts_data.get('posts', [])}
+
+        # Moodle-n ezabatutako eztabaidak kopiatik kendu
+        listed = {str(disc['id']) for disc in discussions}
+        removed = [key for key in stored if key not in listed]
+        for key in removed:
+            del stored[key]
+        if changed or removed:
+            self.forums.save(forum_id, stored)
+        result['sync'] = {'fetched': len(changed), 'reused': len(discussions) - len(changed), 'removed': len(removed)}
+
+        for disc in discussions:
+            posts = stored[str(disc['id'])]['posts']
             
             disc_info = {
                 'id': disc['id'],
                 'name': disc['name'],
-                'posts': posts_data.get('posts', [])
+                'posts': posts
             }
             result['discussions'].append(disc_info)
             
             # Bildu ikasle bakoitzaren mezuak
-            for post in posts_data.get('posts', []):
+            for post in posts:
                 author = post.get('author', {})
                 user_id = author.get('id')
                 
@@ -1037,7 +1150,8 @@ class MoodleClient:
         
         return result
 
-    def get_forum_discussions(self, forum_id: int, sort_by: str = "timemodified", sort_direction: str = "DESC", page: int = 0, per_page: int = 50) -> dict:
+    def get_forum_discussions(self, forum_id: int, sort_by: str = "timemodified", sort_direction: str = "DESC",
+                              page: int = None, per_page: int = None, expected: int = 0) -> dict:
         """
         Lortu foro bateko eztabaida guztiak
         
@@ -1045,69 +1159,132 @@ class MoodleClient:
             forum_id: Foroaren IDa
             sort_by: Ordenatzeko eremua (timemodified, created, replies, etc.)
             sort_direction: Ordena norabidea (ASC, DESC)
-            page: Orria (0-tik hasita)
-            per_page: Eztabaida kopurua orriko
+            page: Orria (0-tik hasita); None bada, orri guztiak
+            per_page: Eztabaida kopurua orriko (lehenetsia FORUM_PAGE_SIZE)
+            expected: Espero den eztabaida kopurua; lehen txandan behar diren orri guztiak eskatzen dira
         
         Returns:
-            Dict eztabaidekin eta metadatuekin
+            Dict eztabaidekin eta metadatuekin ('pages': eskatutako orriak)
         """
+        per_page = per_page or FORUM_PAGE_SIZE
         try:
-            response = requests.get(
-                f"{self.base_url}/webservice/rest/server.php",
-                params={
-                    "wstoken": self.token,
-                    "wsfunction": "mod_forum_get_forum_discussions",
-                    "moodlewsrestformat": "json",
-                    "forumid": forum_id,
-                    "sortby": sort_by,
-                    "sortdirection": sort_direction,
-                    "page": page,
-                    "perpage": per_page
-                }
-            )
-            
-            if response.status_code != 200:
-                raise ConnectionError(f"Error al conectar con Moodle API (status {response.status_code})")
-            
-            data = response.json()
-            
-            if isinstance(data, dict) and "exception" in data:
-                logger.error(f"Error obteniendo discusiones: {data.get('message', '')}")
-                return {"discussions": [], "error": data.get("message", "")}
-            
-            discussions = []
-            for disc in data.get("discussions", []):
-                discussions.append({
-                    "id": disc.get("id"),
-                    "discussion": disc.get("discussion"),
-                    "name": disc.get("name"),  # Título
-                    "subject": disc.get("subject"),
-                    "message": self._clean_html(disc.get("message", "")),
-                    "message_html": disc.get("message", ""),
-                    "userid": disc.get("userid"),
-                    "userfullname": disc.get("userfullname"),
-                    "usermodified": disc.get("usermodified"),
-                    "usermodifiedfullname": disc.get("usermodifiedfullname"),
-                    "created": disc.get("created", 0),
-                    "modified": disc.get("modified", 0),
-                    "timemodified": disc.get("timemodified", 0),
-                    "numreplies": disc.get("numreplies", 0),
-                    "pinned": disc.get("pinned", False),
-                    "locked": disc.get("locked", False),
-                    "starred": disc.get("starred", False),
-                    "attachment": disc.get("attachment", False),
-                    "attachments": disc.get("attachments", [])
-                })
+            if page is not None:
+                discussions, pages = self._get_discussions_page(forum_id, sort_by, sort_direction, page, per_page), 1
+            else:
+                discussions, pages = self._get_all_discussions(forum_id, sort_by, sort_direction, per_page, expected)
             
             return {
                 "forum_id": forum_id,
                 "total_discussions": len(discussions),
+                "pages": pages,
                 "discussions": discussions
             }
             
         except Exception as e:
             logger.error(f"Error lortu eztabaidak forum_id={forum_id}: {e}")
             return {"discussions": [], "error": str(e)}
+
+    def _get_all_discussions(self, forum_id: int, sort_by: str, sort_direction: str, per_page: int,
+                             expected: int = 0) -> tuple:
+        """
+        Orri guztiak, txandaka eta txanda bakoitzeko orriak aldi berean
+
+        Lehen txandan `expected` eztabaidentzako orriak (edo bat); hurrengoetan API_CONCURRENCY
+        orri. Orri bat osatu gabe dagoenean amaitzen da.
+
+        Returns:
+            (eztabaidak orrien ordenan eta errepikapenik gabe, eskatutako orriak)
+        """
+        discussions, seen = [], set()
+        first, requested = 0, 0
+        wave = max(1, -(-expected // per_page)) if expected else 1
+
+        while True:
+            pages = self.map_concurrent(
+                lambda page: self._get_discussions_page(forum_id, sort_by, sort_direction, page, per_page),
+                [(page,) for page in range(first, first + wave)])
+            requested += wave
+
+            for page_discussions in pages:
+                if isinstance(page_discussions, Exception):
+                    raise page_discussions
+                new = [disc for disc in page_discussions if disc['id'] not in seen]
+                seen.update(disc['id'] for disc in new)
+                discussions.extend(new)
+                # Orri osatugabea = azkena; berririk gabeko orri osoa = Moodle-k ez du orrikatzen
+                if len(page_discussions) < per_page or not new:
+                    return discussions, requested
+
+            first += wave
+            wave = API_CONCURRENCY
+
+    def _get_discussions_page(self, forum_id: int, sort_by: str, sort_direction: str, page: int,
+                              per_page: int) -> list:
+        """Orri bat mod_forum_get_forum_discussions-etik (ConnectionError huts egitean)"""
+        response = self.session.get(
+            f"{self.base_url}/webservice/rest/server.php",
+            params={
+                "wstoken": self.token,
+                "wsfunction": "mod_forum_get_forum_discussions",
+                "moodlewsrestformat": "json",
+                "forumid": forum_id,
+                "sortby": sort_by,
+                "sortdirection": sort_direction,
+                "page": page,
+                "perpage": per_page
+            }
+        )
+        
+        if response.status_code != 200:
+            raise ConnectionError(f"Error al conectar con Moodle API (status {response.status_code})")
+        
+        data = response.json()
+        
+        if isinstance(data, dict) and "exception" in data:
+            raise ConnectionError(f"Error obteniendo discusiones: {data.get('message', '')}")
+        
+        discussions = []
+        for disc in data.get("discussions", []):
+            discussions.append({
+                "id": disc.get("id"),
+                "discussion": disc.get("discussion"),
+                "name": disc.get("name"),  # Título
+                "subject": disc.get("subject"),
+                "message": self._clean_html(disc.get("message", "")),
+                "message_html": disc.get("message", ""),
+                "userid": disc.get("userid"),
+                "userfullname": disc.get("userfullname"),
+                "usermodified": disc.get("usermodified"),
+                "usermodifiedfullname": disc.get("usermodifiedfullname"),
+                "created": disc.get("created", 0),
+                "modified": disc.get("modified", 0),
+                "timemodified": disc.get("timemodified", 0),
+                "numreplies": disc.get("numreplies", 0),
+                "pinned": disc.get("pinned", False),
+                "locked": disc.get("locked", False),
+                "starred": disc.get("starred", False),
+                "attachment": disc.get("attachment", False),
+                "attachments": disc.get("attachments", [])
+            })
+        return discussions
+
+    def map_concurrent(self, fn, items: list) -> list:
+        """
+        fn(*item) para cada elemento, con como mucho API_CONCURRENCY llamadas a Moodle a la vez
+
+        No llamar desde dentro de `fn` (mismo pool).
+
+        Returns:
+            Por cada elemento, en el mismo orden, el resultado o la excepción
+        """
+        futures = [self.api_pool.submit(fn, *item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
     
     def get_discussion_posts(self, discussion_id: int) -> dict:
         """
@@ -1120,7 +1297,7 @@ class MoodleClient:
             Dict mezuekin hierarkian
         """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/webservice/rest/server.php",
                 params={
                     "wstoken": self.token,
@@ -1172,56 +1349,74 @@ class MoodleClient:
             logger.error(f"Error lortu mezuak discussion_id={discussion_id}: {e}")
             return {"posts": [], "error": str(e)}
     
-    def get_unanswered_discussions(self, course_id: int) -> list:
+    def get_unanswered_discussions(self, course_id: int, teacher_ids=None) -> list:
         """
         Lortu irakaslearen erantzunik gabeko eztabaidak
         (Ikasleen galdera edo mezuak)
+
+        Eztabaiden metadatuekin erabakitzen da (`numreplies`, `userid`, `usermodified`):
+        erantzunik gabe eta ikasle batek irekita, edo azken mezua ikasle batena. Azken
+        kasu horretan bakarrik irakurtzen dira mezuak (kopia lokaletik, marka aldatu ez bada).
         
         Args:
             course_id: Kurtsoko IDa
+            teacher_ids: Irakasleen IDak (Roster.teacher_ids); None bada, kurtsoko roster-etik
         
         Returns:
-            Erantzun gabe dauden eztabaiden zerrenda
+            Erantzun gabe dauden eztabaiden zerrenda ('last_post' azken mezuarekin, erantzunak badaude)
         """
+        if teacher_ids is None:
+            teacher_ids = UserDirectory(self).roster(course_id).teacher_ids
         unanswered = []
         
         # Lortu kurtso honetako foro guztiak
         forums = self.get_forums(course_id)
         
         for forum in forums:
-            # Lortu eztabaidak
-            result = self.get_forum_discussions(forum["id"])
+            # Lortu eztabaidak (metadatuak bakarrik)
+            result = self.get_forum_discussions(forum["id"], expected=forum.get("numdiscussions", 0))
+            student_last = []
             
             for disc in result.get("discussions", []):
-                # Eztabaida ireki eta erantzunik ez badu...
-                # edo azken mezua ikasle batena bada
                 if disc.get("numreplies", 0) == 0:
-                    disc["forum_name"] = forum["name"]
-                    disc["forum_id"] = forum["id"]
-                    disc["needs_response"] = True
-                    unanswered.append(disc)
+                    # Erantzunik gabe: ikasle batek irekita badago (irakaslearen iragarkiak ez)
+                    if disc.get("userid") in teacher_ids:
+                        continue
+                elif (disc.get("usermodified") or disc.get("userid")) in teacher_ids:
+                    # Azken mezua irakaslearena: erantzunda
+                    continue
                 else:
-                    # Egiaztatu azken mezua nork idatzi duen
-                    posts_result = self.get_discussion_posts(disc["id"])
-                    posts = posts_result.get("posts", [])
-                    
-                    if posts:
-                        # Azken mezua lortu
-                        last_post = max(posts, key=lambda p: p.get("timecreated", 0))
-                        
-                        # Hemen irakaslea den egiaztatu beharko litzateke
-                        # Oraingoz, parentid > 0 badu eta erantzunik ez badu markatu
-                        if last_post.get("parentid", 0) == 0:
-                            # Post originala da, ez erantzuna
-                            pass
-                        else:
-                            # Erantzun bat da
-                            disc["forum_name"] = forum["name"]
-                            disc["forum_id"] = forum["id"]
-                            disc["last_post"] = last_post
-                            disc["needs_response"] = False
-        
-        return unanswered
+                    student_last.append(disc)
+                disc["forum_name"] = forum["name"]
+                disc["forum_id"] = forum["id"]
+                disc["needs_response"] = True
+                unanswered.append(disc)
+
+            if not student_last:
+                continue
+
+            # Azken mezua ikasle batena: mezuak behar dira (kopia lokala marka berdina bada)
+            stored = self.forums.load(forum["id"])
+            changed = self.forums.changed(stored, student_last)
+            posts_results = self.map_concurrent(self.get_discussion_posts, [(disc["id"],) for disc in changed])
+            for disc, posts_result in zip(changed, posts_results):
+                if "error" not in posts_result:
+                    stored[str(disc["id"])] = {"watermark": watermark(disc), "name": disc["name"],
+                                               "posts": posts_result.get("posts", [])}
+            if changed:
+                self.forums.save(forum["id"], stored)
+
+            for disc in student_last:
+                posts = stored.get(str(disc["id"]), {}).get("posts", [])
+                if not posts:
+                    continue
+                last_post = max(posts, key=lambda p: p.get("timecreated", 0))
+                disc["last_post"] = last_post
+                # usermodified zaharkituta egon daiteke (edizioak): azken mezuaren egilea da erabakigarria
+                if last_post.get("author", {}).get("id") in teacher_ids:
+                    disc["needs_response"] = False
+        
+        return [disc for disc in unanswered if disc["needs_response"]]
     
     def get_all_forum_content(self, course_id: int) -> dict:
         """
@@ -1252,12 +1447,12 @@ class MoodleClient:
                 "discussions": []
             }
             
-            discussions_result = self.get_forum_discussions(forum["id"])
+            discussions_result = self.get_forum_discussions(forum["id"], expected=forum.get("numdiscussions", 0))
+            discussions = discussions_result.get("discussions", [])
+            # Lortu eztabaidako mezu guztiak (aldi berean, eztabaiden ordenan)
+            posts_results = self.map_concurrent(self.get_discussion_posts, [(disc["id"],) for disc in discussions])
             
-            for disc in discussions_result.get("discussions", []):
-                # Lortu eztabaidako mezu guztiak
-                posts_result = self.get_discussion_posts(disc["id"])
-                
+            for disc, posts_result in zip(discussions, posts_results):
                 disc_data = {
                     "id": disc["id"],
                     "name": disc["name"],
@@ -0,0 +1,323 @@
+"""
+Pool de servidores Ollama con comprobación de salud y reparto por carga.
+
+Se comporta como un `ollama.Client` (método `chat`), de modo que el motor de
+generación no necesita saber cuántos servidores hay detrás. Cada petición va al
+servidor sano con menos peticiones en curso (y menor latencia reciente); si un
+servidor falla por red o plazo se marca como caído y la petición se reintenta
+en otro.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import ollama
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+try:
+    import httpx
+    TRANSPORT_ERRORS = (ConnectionError, TimeoutError, httpx.TransportError)
+except ImportError:  # pragma: no cover - httpx viene con ollama
+    TRANSPORT_ERRORS = (ConnectionError, TimeoutError)
+
+
+class OllamaHost:
+    """Estado de un servidor del pool"""
+
+    def __init__(self, url: str, client, health_client):
+        self.url = url
+        self.client = client
+        self.health_client = health_client
+        self.healthy = True
+        self.in_flight = 0
+        self.latency = None          # EWMA de la latencia hasta la primera respuesta (s)
+        self.consecutive_errors = 0
+        self.requests = 0
+        self.errors = 0
+        self.last_check = 0.0
+        self.last_error = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'host': self.url,
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'requests': self.requests,
+            'errors': self.errors,
+            'last_error': self.last_error
+        }
+
+
+class OllamaHostPool:
+    """
+    Reparte peticiones entre varios servidores Ollama.
+
+    - Comprobación de salud con `/api/tags` al crear el pool y, para los
+      servidores caídos, de nuevo cada `health_interval` segundos.
+    - Envío al servidor sano menos cargado: menos peticiones en curso y,
+      a igualdad, menor latencia reciente.
+    - Un error de red o de plazo marca el servidor como caído y la petición
+      pasa al siguiente; otros errores lo marcan tras `max_errors` seguidos.
+    """
+
+    def __init__(self,
+                 hosts: List[str],
+                 timeout: Optional[float] = None,
+                 health_interval: float = 30.0,
+                 health_timeout: float = 5.0,
+                 max_errors: int = 3,
+                 client_factory: Callable[..., Any] = ollama.Client,
+                 check_on_start: bool = True):
+        """
+        Args:
+            hosts: URLs de los servidores Ollama
+            timeout: Plazo HTTP por petición para los clientes de generación
+            health_interval: Segundos entre comprobaciones de un servidor caído
+            health_timeout: Plazo de la comprobación de salud
+            max_errors: Errores seguidos (no de red) antes de marcar el servidor como caído
+            client_factory: Constructor de clientes (inyectable en pruebas)
+            check_on_start: Comprobar la salud al crear el pool; si no, se suponen sanos
+                            hasta el primer error
+        """
+        if not hosts:
+            raise ValueError("Se necesita al menos un servidor Ollama")
+
+        self.health_interval = health_interval
+        self.max_errors = max_errors
+        self._lock = threading.Lock()
+        self.hosts = [
+            OllamaHost(url,
+                       client_factory(host=url, timeout=timeout),
+                       client_factory(host=url, timeout=health_timeout))
+            for url in hosts
+        ]
+        if check_on_start:
+            self.check_health()
+
+    # ------------------------------------------------------------------
+    # Osasuna
+    # ------------------------------------------------------------------
+
+    def check_health(self, hosts: Optional[List[OllamaHost]] = None) -> Dict[str, bool]:
+        """
+        Comprueba los servidores indicados (todos por defecto)
+
+        Returns:
+            Dict {url: sano}
+        """
+        results = {}
+        for host in hosts or self.hosts:
+            try:
+                host.health_client.list()
+                healthy = True
+                error = None
+            except Exception as e:
+                healthy = False
+                error = str(e) or e.__class__.__name__
+
+            with self._lock:
+                was_healthy = host.healthy
+                host.healthy = healthy
+                host.last_check = time.monotonic()
+                if healthy:
+                    host.consecutive_errors = 0
+                else:
+                    host.last_error = error
+
+            if healthy and not was_healthy:
+                logger.info(f"  🟢 Ollama {host.url} disponible de nuevo")
+            elif not healthy and was_healthy:
+                logger.warning(f"  🔴 Ollama {host.url} no disponible: {error}")
+            results[host.url] = healthy
+        return results
+
+    def _refresh_unhealthy(self):
+        """Vuelve a comprobar los servidores caídos cuyo intervalo ha vencido"""
+        now = time.monotonic()
+        with self._lock:
+            due = [h for h in self.hosts if not h.healthy and now - h.last_check >= self.health_interval]
+        if due:
+            self.check_health(due)
+
+    # ------------------------------------------------------------------
+    # Banaketa
+    # ------------------------------------------------------------------
+
+    def _acquire(self, exclude: List[OllamaHost]) -> Optional[OllamaHost]:
+        """Reserva el servidor sano menos cargado que no esté en `exclude`"""
+        self._refresh_unhealthy()
+        with self._lock:
+            candidates = [h for h in self.hosts if h.healthy and h not in exclude]
+            if not candidates:
+                # Ninguno sano: probar igualmente los no intentados (pueden haberse recuperado)
+                candidates = [h for h in self.hosts if h not in exclude]
+            if not candidates:
+                return None
+            host = min(candidates, key=lambda h: (h.in_flight, h.latency if h.latency is not None else 0.0))
+            host.in_flight += 1
+            host.requests += 1
+            return host
+
+    def _release(self, host: OllamaHost, latency: Optional[float] = None, error: Optional[Exception] = None):
+        with self._lock:
+            host.in_flight = max(0, host.in_flight - 1)
+            if latency is not None:
+                host.latency = latency if host.latency is None else 0.7 * host.latency + 0.3 * latency
+            if error is None:
+                host.consecutive_errors = 0
+                return
+            host.errors += 1
+            host.consecutive_errors += 1
+            host.last_error = str(error) or error.__class__.__name__
+            if isinstance(error, TRANSPORT_ERRORS) or host.consecutive_errors >= self.max_errors:
+                if host.healthy:
+                    logger.warning(f"  🔴 Ollama {host.url} marcado como caído: {host.last_error}")
+                host.healthy = False
+                host.last_check = time.monotonic()
+
+    @contextmanager
+    def lease(self):
+        """Reserva un servidor para uso directo: `with pool.lease() as host: host.client...`"""
+        host = self._acquire([])
+        if host is None:
+            raise ConnectionError("No hay servidores Ollama disponibles")
+        error = None
+        started = time.monotonic()
+        try:
+            yield host
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(host, latency=time.monotonic() - started if error is None else None, error=error)
+
+    # ------------------------------------------------------------------
+    # ollama.Client interfazea
+    # ------------------------------------------------------------------
+
+    def chat(self, stream: bool = False, **kwargs):
+        """
+        Igual que `ollama.Client.chat`, repartido entre los servidores del pool
+
+        Si un servidor falla antes de devolver la primera respuesta, la petición
+        se reintenta en otro servidor.
+        """
+        tried: List[OllamaHost] = []
+        last_error = None
+
+        while True:
+            host = self._acquire(tried)
+            if host is None:
+                raise ConnectionError(f"Ningún servidor Ollama respondió: {last_error}")
+            tried.append(host)
+            started = time.monotonic()
+
+            try:
+                if not stream:
+                    response = host.client.chat(stream=False, **kwargs)
+                    self._release(host, latency=time.monotonic() - started)
+                    return response
+
+                iterator = iter(host.client.chat(stream=True, **kwargs))
+                first = next(iterator, None)
+            except Exception as e:
+                self._release(host, error=e)
+                last_error = e
+                logger.warning(f"  Ollama {host.url} falló ({e}), probando otro servidor")
+                continue
+
+            return PooledStream(self, host, iterator, first, time.monotonic() - started)
+
+    def list(self):
+        """Modelos del servidor menos cargado"""
+        with self.lease() as host:
+            return host.client.list()
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """Estado de cada servidor (salud, carga, latencia, errores)"""
+        with self._lock:
+            return [h.snapshot() for h in self.hosts]
+
+
+class PooledStream:
+    """
+    Stream de un servidor del pool: libera la reserva al terminar o cerrarse
+    y registra el error si la lectura falla a mitad.
+    """
+
+    def __init__(self, pool: OllamaHostPool, host: OllamaHost, iterator, first, latency: float):
+        self.pool = pool
+        self.host = host
+        self._iterator = iterator
+        self._first = first
+        self._latency = latency
+        self._released = False
+
+    def __iter__(self):
+        error = None
+        try:
+            if self._first is not None:
+                yield self._first
+                self._first = None
+            for chunk in self._iterator:
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._close_iterator()
+            self._finish(error)
+
+    def close(self):
+        self._close_iterator()
+        self._finish(None)
+
+    def _close_iterator(self):
+        # Itxi azpiko stream-a: konexioa mozten da eta zerbitzariak sorkuntza gelditzen du
+        close = getattr(self._iterator, 'close', None)
+        if close:
+            close()
+
+    def mark_failed(self, error: Exception):
+        """El consumidor abandona el stream por un fallo (plazo, etc.)"""
+        self._close_iterator()
+        self._finish(error)
+
+    def _finish(self, error: Optional[Exception]):
+        if self._released:
+            return
+        self._released = True
+        self.pool._release(self.host, latency=self._latency, error=error)
+
+
+def merge_status(status_lists: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Estado de los servidores visto por varios pools (p. ej. uno por proceso)
+
+    Suma peticiones y errores; un servidor está sano si lo está en el último
+    estado recibido que lo incluye.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for status in status_lists:
+        for host in status or []:
+            total = merged.setdefault(host['host'], {'host': host['host'], 'requests': 0, 'errors': 0,
+                                                     'in_flight': 0, 'latency': None, 'last_error': None})
+            total['healthy'] = host['healthy']
+            total['requests'] += host.get('requests', 0)
+            total['errors'] += host.get('errors', 0)
+            total['latency'] = host.get('latency') if host.get('latency') is not None else total['latency']
+            total['last_error'] = host.get('last_error') or total['last_error']
+    return list(merged.values())
+
+
+def status_delta(after: List[Dict[str, Any]], before: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Estado actual con las peticiones y errores hechos entre dos get_status()"""
+    old = {host['host']: host for host in before or []}
+    return [dict(host, requests=host['requests'] - old.get(host['host'], {}).get('requests', 0),
+                 errors=host['errors'] - old.get(host['host'], {}).get('errors', 0))
+            for host in after]
@@ -0,0 +1,201 @@
+"""
+Pipeline por etapas productor/consumidor con colas acotadas.
+
+Cada etapa tiene su propio número de hilos y lee de una cola de tamaño
+limitado, de modo que la red (Moodle), el disco y la GPU trabajan a la vez y
+una etapa lenta frena a las anteriores (backpressure) sin acumular elementos
+en memoria. El tiempo total se acerca al de la etapa más lenta en lugar de a
+la suma de todas.
+"""
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    """
+    Etapa del pipeline
+
+    Attributes:
+        name: Nombre (para logs y métricas)
+        func: Recibe un elemento (o una lista si `batch_size` > 1) y devuelve el
+              elemento para la siguiente etapa, una lista de elementos o None para descartarlo
+        workers: Hilos de la etapa
+        batch_size: Si > 1, cada llamada recibe hasta `batch_size` elementos ya disponibles
+                    en la cola (sin esperar a que se llene el lote)
+    """
+    name: str
+    func: Callable[[Any], Any]
+    workers: int = 1
+    batch_size: int = 1
+    stats: Dict[str, Any] = field(default_factory=lambda: {
+        'in': 0, 'out': 0, 'errors': 0, 'busy_seconds': 0.0
+    })
+
+
+class StagedPipeline:
+    """
+    Ejecuta una serie de etapas conectadas por colas acotadas.
+
+    Uso:
+        pipeline = StagedPipeline([
+            Stage('fetch', fetch, workers=4),
+            Stage('download', download, workers=4),
+            Stage('analyze', analyze, workers=2, batch_size=4),
+            Stage('persist', persist, workers=1),
+        ], queue_size=16)
+        pipeline.run(items)
+
+    Un error en una etapa se registra y descarta ese elemento; el resto sigue.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 16):
+        if not stages:
+            raise ValueError("El pipeline necesita al menos una etapa")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.wall_seconds = 0.0
+
+    def run(self, source: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Procesa todos los elementos de `source` y espera a que terminen todas las etapas
+
+        Returns:
+            Métricas por etapa (ver get_stats)
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads: List[List[threading.Thread]] = []
+        started = time.monotonic()
+
+        for index, stage in enumerate(self.stages):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+            remaining = [max(1, stage.workers)]
+            lock = threading.Lock()
+            stage_threads = []
+            for n in range(max(1, stage.workers)):
+                thread = threading.Thread(
+                    target=self._worker, name=f"{stage.name}-{n}",
+                    args=(stage, inbox, outbox, remaining, lock, self._downstream_workers(index)),
+                    daemon=True)
+                thread.start()
+                stage_threads.append(thread)
+            threads.append(stage_threads)
+
+        # Iturria: put() blokeatu egiten da lehen etapa beteta dagoenean (backpressure)
+        try:
+            for item in source:
+                queues[0].put(item)
+        finally:
+            for _ in range(max(1, self.stages[0].workers)):
+                queues[0].put(_STOP)
+
+        for stage_threads in threads:
+            for thread in stage_threads:
+                thread.join()
+
+        # Exekuzio guztiak metatzen dira (pipeline bera ikastaro bakoitzerako erabil daiteke)
+        self.wall_seconds += time.monotonic() - started
+        return self.get_stats()
+
+    def _downstream_workers(self, index: int) -> int:
+        if index + 1 >= len(self.stages):
+            return 0
+        return max(1, self.stages[index + 1].workers)
+
+    def _worker(self, stage: Stage, inbox: "queue.Queue", outbox: Optional["queue.Queue"],
+                remaining: List[int], lock: threading.Lock, downstream: int):
+        stopping = False
+        while not stopping:
+            item = inbox.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            if stage.batch_size > 1:
+                # Hartu jada prest dauden elementuak, itxaron gabe
+                while len(batch) < stage.batch_size:
+                    try:
+                        extra = inbox.get_nowait()
+                    except queue.Empty:
+                        break
+                    if extra is _STOP:
+                        stopping = True
+                        break
+                    batch.append(extra)
+
+            started = time.monotonic()
+            try:
+                result = stage.func(batch if stage.batch_size > 1 else item)
+            except Exception as e:
+                result = None
+                with lock:
+                    stage.stats['errors'] += len(batch)
+                logger.error(f"  [pipeline:{stage.name}] Error procesando elemento: {e}")
+            busy = time.monotonic() - started
+
+            outputs = []
+            if result is not None:
+                outputs = result if isinstance(result, list) else [result]
+            with lock:
+                stage.stats['in'] += len(batch)
+                stage.stats['out'] += len(outputs)
+                stage.stats['busy_seconds'] += busy
+            if outbox is not None:
+                for output in outputs:
+                    outbox.put(output)
+
+        # Azken langileak hurrengo etapari gelditzeko seinalea bidaltzen dio
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and outbox is not None:
+            for _ in range(downstream):
+                outbox.put(_STOP)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Métricas por etapa: elementos de entrada/salida, errores, tiempo ocupado y
+        utilización (tiempo ocupado / (tiempo total × hilos)); la etapa con mayor
+        utilización es el cuello de botella
+        """
+        stats = {}
+        for stage in self.stages:
+            s = dict(stage.stats)
+            capacity = self.wall_seconds * max(1, stage.workers)
+            s['busy_seconds'] = round(s['busy_seconds'], 2)
+            s['workers'] = stage.workers
+            s['wall_seconds'] = round(self.wall_seconds, 2)
+            s['utilization'] = round(stage.stats['busy_seconds'] / capacity, 2) if capacity else 0.0
+            stats[stage.name] = s
+        return stats
+
+
+def merge_stats(stats_list: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Suma las métricas de varios pipelines con las mismas etapas (p. ej. uno
+    por curso o por proceso) y recalcula la utilización sobre el total
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for stats in stats_list:
+        for name, s in stats.items():
+            total = merged.setdefault(name, {'in': 0, 'out': 0, 'errors': 0, 'busy_seconds': 0.0,
+                                             'workers': s['workers'], 'wall_seconds': 0.0})
+            for key in ('in', 'out', 'errors', 'busy_seconds', 'wall_seconds'):
+                total[key] += s.get(key, 0)
+
+    for total in merged.values():
+        capacity = total['wall_seconds'] * max(1, total['workers'])
+        total['busy_seconds'] = round(total['busy_seconds'], 2)
+        total['wall_seconds'] = round(total['wall_seconds'], 2)
+        total['utilization'] = round(total['busy_seconds'] / capacity, 2) if capacity else 0.0
+    return merged
@@ -3,6 +3,7 @@ Generador de informes en formato Markdown
 """
 from datetime import datetime
 from typing import List, Dict, Any
+import json
 import os
 
 class ReportGenerator:
@@ -194,6 +195,17 @@ class ReportGenerator:
         
         return filepath
     
+    def generate_run_summary(self, run_summary: Dict[str, Any]) -> str:
+        """Guarda el resumen de ejecución (tokens, tiempos, contadores) en JSON"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"run_summary_{timestamp}.json"
+        filepath = os.path.join(self.output_dir, filename)
+        
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(run_summary, f, indent=2, ensure_ascii=False, default=str)
+        
+        return filepath
+    
     def _format_risk_level(self, level: str) -> str:
         """Formatea el nivel de riesgo con emoji"""
         levels = {
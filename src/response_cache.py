@@ -0,0 +1,247 @@
+"""
+Índice de preguntas de foro ya respondidas, para reutilizar respuestas.
+
+Cada curso repite preguntas casi iguales ("¿cómo entrego el VPL?", "¿cuándo
+acaba el plazo?"). Se guarda cada pregunta con su respuesta (generada por la IA
+o aceptada por el profesor) y, ante una pregunta nueva, se busca la más parecida
+del mismo ámbito (el contexto del curso). Por encima de `RESPONSE_CACHE_THRESHOLD`
+se reutiliza la respuesta, personalizando solo el saludo, sin llamar al modelo.
+
+La similitud es el coseno entre vectores léxicos (palabras y pares de palabras,
+sin tildes ni palabras vacías). Los números pesan más que las palabras: "ejercicio
+3" y "ejercicio 7" son preguntas distintas. Un índice invertido por término hace que buscar
+solo recorra las preguntas que comparten algún término con la nueva.
+
+`cluster_questions` usa la misma similitud para agrupar las preguntas pendientes
+casi iguales y responderlas una sola vez.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "forum_responses.json")
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.8"))
+# Erantzunik gabeko galdera bikoiztuak multzokatzeko antzekotasuna (cluster_questions)
+CLUSTER_THRESHOLD = float(os.getenv("FORUM_CLUSTER_THRESHOLD", "0.6"))
+
+# Hitz hutsak (gaztelania eta euskara): ez dute galdera bereizten
+STOPWORDS = set("""
+a al algo como con cual cuando de del donde el ella en es esa ese esta este esto estoy hay
+la las le lo los me mi mis muy no nos o para pero por que se si sin sobre su sus te tengo
+tiene todo tu un una uno unos y ya yo hola buenas buenos dias tardes gracias saludos profe
+profesor profesora alguien favor
+bat da dut du eta edo ez ere baina nola zer non noiz nik zuk hau hori kaixo eskerrik asko
+""".split())
+# Bikoteen pisua hitz bakarrekoen aldean
+BIGRAM_WEIGHT = 0.5
+# Zenbakien pisua ("ejercicio 3" / "tema 5"): zenbaki desberdinak dituzten galderak ez dira berdinak
+NUMBER_WEIGHT = 3.0
+# Erantzun berrerabilien hasierako agurra, ikasle bakoitzaren izenarekin ordezteko
+GREETING = re.compile(r"^\s*(hola|buenas|kaixo|estimad[oa]|querid[oa])\b[^,.!\n]*[,.!]?\s*", re.IGNORECASE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Palabras normalizadas (minúsculas, sin tildes, sin palabras vacías); los números se conservan todos"""
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode('ascii').lower()
+    return [word for word in re.findall(r"[a-z0-9]+", text)
+            if word.isdigit() or (len(word) > 1 and word not in STOPWORDS)]
+
+
+def vectorize(text: str) -> Dict[str, float]:
+    """Vector léxico normalizado (norma 1): palabras, pares de palabras consecutivas y números con más peso"""
+    words = tokenize(text)
+    counts: Dict[str, float] = Counter()
+    for word in words:
+        counts[word] += NUMBER_WEIGHT if word.isdigit() else 1
+    for first, second in zip(words, words[1:]):
+        counts[f"{first} {second}"] += BIGRAM_WEIGHT
+    norm = math.sqrt(sum(weight * weight for weight in counts.values()))
+    return {term: weight / norm for term, weight in counts.items()} if norm else {}
+
+
+def question_text(discussion: Dict[str, Any]) -> str:
+    """Texto de la pregunta: título y mensaje original de la discusión"""
+    return f"{discussion.get('name') or discussion.get('subject') or ''}\n{discussion.get('message', '')}"
+
+
+def strip_greeting(response: str) -> str:
+    """Respuesta sin el saludo inicial ("Hola Ana, ...")"""
+    return GREETING.sub('', response or '', count=1)
+
+
+def personalize(response: str, name: Optional[str]) -> str:
+    """Cambia el saludo de una respuesta reutilizada por uno con el nombre del estudiante"""
+    if not name:
+        return response
+    first_name = name.split()[0]
+    return f"Hola {first_name}, {strip_greeting(response)}"
+
+
+def cosine(first: Dict[str, float], second: Dict[str, float]) -> float:
+    if len(second) < len(first):
+        first, second = second, first
+    return sum(weight * second.get(term, 0.0) for term, weight in first.items())
+
+
+def cluster_questions(texts: List[str], threshold: float = None) -> List[List[int]]:
+    """
+    Agrupa preguntas casi iguales
+
+    Cada pregunta se une al grupo cuyo primer elemento (líder) es el más parecido,
+    si llega a `threshold` y menciona los mismos números ("tema 2" y "tema 5" nunca
+    van juntos); si no, abre un grupo nuevo. Comparar solo con los líderes evita
+    que una cadena de preguntas parecidas junte temas distintos.
+
+    Returns:
+        Índices de `texts` por grupo, en el orden de aparición
+    """
+    threshold = CLUSTER_THRESHOLD if threshold is None else threshold
+    vectors = [vectorize(text) for text in texts]
+    numbers = [{term for term in vector if term.isdigit()} for vector in vectors]
+    clusters: List[List[int]] = []
+    for index, vector in enumerate(vectors):
+        best, best_score = None, threshold
+        for cluster in clusters:
+            if numbers[index] != numbers[cluster[0]]:
+                continue
+            score = cosine(vector, vectors[cluster[0]]) if vector else 0.0
+            if score >= best_score:
+                best, best_score = cluster, score
+        if best is None:
+            clusters.append([index])
+        else:
+            best.append(index)
+    return clusters
+
+
+class ForumResponseCache:
+    """Preguntas y respuestas por ámbito, con búsqueda por similitud léxica"""
+
+    def __init__(self, path: str = None, threshold: float = None):
+        self.path = path or RESPONSE_CACHE_FILE
+        self.threshold = RESPONSE_CACHE_THRESHOLD if threshold is None else threshold
+        self.entries: List[Dict[str, Any]] = []
+        # (esparrua, terminoa) → [(sarrera, pisua)]
+        self._postings: Dict[Tuple[str, str], List[Tuple[int, float]]] = defaultdict(list)
+        self._max_weight: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._vectors: List[Dict[str, float]] = []
+        self._by_discussion: Dict[Tuple[str, Any], int] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Índice de respuestas ilegible ({e}), se empieza vacío")
+            return
+        for entry in entries:
+            self._index(entry)
+
+    def _index(self, entry: Dict[str, Any]):
+        key = (entry['scope'], entry.get('discussion_id'))
+        if entry.get('discussion_id') is not None and key in self._by_discussion:
+            # Eztabaida bakoitzeko sarrera bat: irakasleak onartutakoa sortutakoaren gainetik
+            old = self.entries[self._by_discussion[key]]
+            if old.get('source') == 'accepted' and entry.get('source') != 'accepted':
+                return
+            old['removed'] = True
+        position = len(self.entries)
+        vector = vectorize(entry['question'])
+        self.entries.append(entry)
+        self._vectors.append(vector)
+        for term, weight in vector.items():
+            self._postings[(entry['scope'], term)].append((position, weight))
+            self._max_weight[(entry['scope'], term)] = max(self._max_weight[(entry['scope'], term)], weight)
+        if entry.get('discussion_id') is not None:
+            self._by_discussion[key] = position
+
+    def search(self, question: str, scope: str = "",
+               min_score: float = 0.0) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Pregunta más parecida del ámbito
+
+        Solo se recorren las listas de los términos poco frecuentes (MaxScore): los
+        términos más comunes cuya aportación máxima sumada no llega a `min_score` no
+        pueden traer candidatas nuevas, y solo se suman a las ya encontradas.
+
+        Returns:
+            (entrada, similitud) o None si ninguna comparte términos (o llega a `min_score`)
+        """
+        vector = vectorize(question)
+        scores: Dict[int, float] = defaultdict(float)
+        with self._lock:
+            terms = sorted(vector.items(), key=lambda item: len(self._postings.get((scope, item[0]), ())),
+                           reverse=True)
+            # Termino arruntenak (zerrenda luzeenak), haien ekarpen maximoa min_score-tik behera dagoen arte
+            skipped, bound = 0, 0.0
+            for term, weight in terms:
+                bound += weight * self._max_weight.get((scope, term), 0.0)
+                if bound >= min_score:
+                    break
+                skipped += 1
+
+            for term, weight in terms[skipped:]:
+                for position, entry_weight in self._postings.get((scope, term), ()):
+                    scores[position] += weight * entry_weight
+            for term, weight in terms[:skipped]:
+                for position in scores:
+                    scores[position] += weight * self._vectors[position].get(term, 0.0)
+
+            candidates = [(score, self.entries[position].get('source') == 'accepted', position)
+                          for position, score in scores.items()
+                          if score >= min_score and not self.entries[position].get('removed')]
+            if not candidates:
+                return None
+            score, _, position = max(candidates)
+            return self.entries[position], round(score, 4)
+
+    def lookup(self, question: str, scope: str = "") -> Optional[Tuple[Dict[str, Any], float]]:
+        """Como search(), solo si la similitud llega al umbral"""
+        return self.search(question, scope, min_score=self.threshold)
+
+    def add(self, question: str, response: Dict[str, Any], scope: str = "", source: str = "generated",
+            discussion_id: Any = None):
+        """
+        Añade una pregunta respondida y guarda el índice
+
+        Args:
+            question: Texto de la pregunta (question_text())
+            response: Respuesta (campos de generate_forum_response: proposed_response, key_points...)
+            scope: Ámbito en el que se puede reutilizar (contexto del curso)
+            source: 'generated' (IA) o 'accepted' (publicada o aprobada por el profesor)
+            discussion_id: Discusión de origen; una nueva entrada sustituye a la anterior
+        """
+        entry = {'question': question, 'response': response, 'scope': scope, 'source': source,
+                 'discussion_id': discussion_id, 'created_at': time.time()}
+        with self._lock:
+            self._index(entry)
+            self._save([e for e in self.entries if not e.get('removed')])
+
+    def _save(self, entries: List[Dict[str, Any]]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live = [e for e in self.entries if not e.get('removed')]
+        return {'entries': len(live), 'accepted': sum(1 for e in live if e.get('source') == 'accepted'),
+                'scopes': len({e['scope'] for e in live})}
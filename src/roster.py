@@ -0,0 +1,111 @@
+"""
+Matriculados de cada curso por rol (core_enrol_get_enrolled_users).
+
+`Roster` indexa los usuarios de un curso por ID y separa estudiantes y
+profesores según su rol en ese curso. `UserDirectory` guarda los rosters con un
+TTL y comparte los datos de cada usuario entre cursos: un estudiante
+matriculado en varios cursos es un único dict.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from logger_config import get_logger
+
+logger = get_logger(__name__)
+
+STUDENT_ROLES = {r.strip() for r in os.getenv("ROSTER_STUDENT_ROLES", "student").split(",") if r.strip()}
+TEACHER_ROLES = {r.strip() for r in os.getenv("ROSTER_TEACHER_ROLES", "editingteacher,teacher,manager").split(",")
+                 if r.strip()}
+ROSTER_TTL = float(os.getenv("ROSTER_TTL", "3600"))
+
+# Ikastaro bakoitzeko eremuak: ez dira direktorioko erabiltzailean gordetzen
+COURSE_FIELDS = ('roles', 'groups', 'enrolledcourses')
+
+
+class Roster:
+    """Usuarios matriculados en un curso con búsqueda por ID y vista de estudiantes"""
+
+    def __init__(self, course_id: int, users: List[Dict[str, Any]], roles: Dict[int, Set[str]],
+                 suspended: Iterable[int] = ()):
+        """
+        Args:
+            course_id: ID del curso
+            users: Usuarios (sin los campos propios del curso)
+            roles: Roles de cada usuario en este curso {id: {'student', ...}}; None si Moodle no los devuelve
+            suspended: IDs de usuarios suspendidos
+        """
+        self.course_id = course_id
+        self.users = users
+        self.by_id: Dict[int, Dict[str, Any]] = {user['id']: user for user in users}
+        self.roles = roles
+        self.suspended = set(suspended)
+        self.teacher_ids = {user_id for user_id, user_roles in roles.items() if user_roles & TEACHER_ROLES}
+        self.students = [user for user in users if self.is_student(user['id'])]
+
+    def get(self, user_id: int, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        return self.by_id.get(user_id, default)
+
+    def is_teacher(self, user_id: int) -> bool:
+        return user_id in self.teacher_ids
+
+    def is_student(self, user_id: int) -> bool:
+        """Estudiante activo: rol de estudiante, ninguno de profesor y cuenta no suspendida"""
+        if user_id in self.suspended or user_id in self.teacher_ids:
+            return False
+        user_roles = self.roles.get(user_id)
+        # Rolik ez badago (tokenak ezin ditu ikusi), ikasletzat hartzen da
+        return user_roles is None or bool(user_roles & STUDENT_ROLES)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+
+class UserDirectory:
+    """
+    Rosters de todos los cursos con TTL y un único dict por usuario
+
+    Se comparte entre hilos (pipeline) y pasadas del daemon.
+    """
+
+    def __init__(self, moodle_client, ttl: float = None):
+        self.moodle_client = moodle_client
+        self.ttl = ROSTER_TTL if ttl is None else ttl
+        self.users: Dict[int, Dict[str, Any]] = {}
+        self._rosters: Dict[int, Roster] = {}
+        self._fetched_at: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def get_user(self, user_id: int, default: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        return self.users.get(user_id, default)
+
+    def roster(self, course_id: int, refresh: bool = False) -> Roster:
+        """Roster del curso (se vuelve a pedir a Moodle cuando caduca el TTL)"""
+        with self._lock:
+            if not refresh and course_id in self._rosters and \
+                    time.time() - self._fetched_at[course_id] < self.ttl:
+                return self._rosters[course_id]
+
+        enrolled = self.moodle_client.get_users(course_id, only_active=True)
+        if isinstance(enrolled, dict) and 'exception' in enrolled:
+            raise ConnectionError(f"Error obteniendo matriculados: {enrolled.get('message', '')}")
+
+        with self._lock:
+            users, roles, suspended = [], {}, []
+            for data in enrolled:
+                user = self.users.setdefault(data['id'], {})
+                user.update({k: v for k, v in data.items() if k not in COURSE_FIELDS})
+                users.append(user)
+                if 'roles' in data:
+                    roles[data['id']] = {role.get('shortname') for role in data['roles']}
+                if data.get('suspended'):
+                    suspended.append(data['id'])
+
+            roster = Roster(course_id, users, roles, suspended)
+            self._rosters[course_id] = roster
+            self._fetched_at[course_id] = time.time()
+
+        logger.info(f"👥 Curso {course_id}: {len(roster)} matriculados | {len(roster.students)} estudiantes | "
+                    f"{len(roster.teacher_ids)} profesores")
+        return roster
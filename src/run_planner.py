@@ -0,0 +1,350 @@
+"""
+Estimación de una ejecución sin procesarla (`main.py --plan`).
+
+Con el caché de entregas y unas pocas consultas baratas a Moodle (una por curso
+y tipo de actividad, y una por tarea o foro) calcula lo que haría la ejecución
+real: llamadas a Moodle, descargas (con bytes) y análisis con IA (con tokens
+estimados), por curso y por tipo de actividad. El tiempo estimado sale de los
+últimos `reports/run_summary_*.json`; sin historial se usan valores por defecto.
+
+Precisión por tipo:
+
+- assign: exacta. Una llamada trae todas las entregas de la tarea con el
+  tamaño de los archivos, y se comparan con el caché igual que en la ejecución
+- vpl: máximo. Sin descargar no se ve si cambió una entrega ya cacheada; se
+  cuentan los estudiantes sin entrada en el caché
+- quiz: solo llamadas a Moodle (no hay análisis)
+- forum_task: aproximada. Se cuentan los autores de las discusiones
+  modificadas desde el último análisis del foro
+"""
+import glob
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from ai_analyzer import OLLAMA_HOSTS
+from logger_config import get_logger
+from roster import UserDirectory
+
+logger = get_logger(__name__)
+
+PLAN_HISTORY_RUNS = int(os.getenv("PLAN_HISTORY_RUNS", "5"))
+# Historialik gabe erabiltzen diren balioak
+PLAN_MOODLE_CALL_SECONDS = float(os.getenv("PLAN_MOODLE_CALL_SECONDS", "0.3"))
+PLAN_DOWNLOAD_MBPS = float(os.getenv("PLAN_DOWNLOAD_MBPS", "10"))
+PLAN_PROMPT_TOKENS_PER_SECOND = float(os.getenv("PLAN_PROMPT_TOKENS_PER_SECOND", "500"))
+PLAN_OUTPUT_TOKENS_PER_SECOND = float(os.getenv("PLAN_OUTPUT_TOKENS_PER_SECOND", "30"))
+
+CHARS_PER_TOKEN = 4
+# Plantilla del prompt + contenido máximo que se envía al modelo (ver ai_analyzer)
+PROMPT_OVERHEAD_TOKENS = 400
+MAX_CONTENT_CHARS = 4000
+DEFAULT_PROMPT_TOKENS = {'assign': 1500, 'vpl': 1500, 'forum_task': 2000}
+DEFAULT_OUTPUT_TOKENS = {'assign': 500, 'vpl': 500, 'forum_task': 500}
+
+ACTIVITY_TYPES = ['assign', 'vpl', 'quiz', 'forum_task']
+
+
+@dataclass
+class PlanEntry:
+    """Trabajo estimado de un tipo de actividad en un curso"""
+    course: str
+    type: str
+    activities: int = 0
+    moodle_calls: int = 0
+    downloads: int = 0
+    download_bytes: int = 0
+    analyses: int = 0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    # Analisi kopurua goi-muga edo hurbilketa da (vpl, forum_task)
+    approximate: bool = False
+
+    def add(self, other: 'PlanEntry'):
+        for name in ('activities', 'moodle_calls', 'downloads', 'download_bytes',
+                     'analyses', 'prompt_tokens', 'output_tokens'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.approximate = self.approximate or other.approximate
+
+
+def load_history(reports_dir: str = "reports", runs: int = PLAN_HISTORY_RUNS) -> Dict[str, Any]:
+    """
+    Rendimiento medio de las últimas ejecuciones (run_summary_*.json)
+
+    Returns:
+        Dict con 'runs', 'moodle_call_seconds', 'analysis_seconds' y
+        'tokens' {tipo: {'prompt': n, 'output': n}} (las claves que falten no tienen historial)
+    """
+    paths = sorted(glob.glob(os.path.join(reports_dir, "run_summary_*.json")))[-runs:]
+    fetch_busy = fetch_items = 0.0
+    gpu_seconds = calls = 0.0
+    by_type: Dict[str, Dict[str, float]] = {}
+
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Resumen ilegible {path}: {e}")
+            continue
+
+        # Fetch etapa: Moodle-ri dei bat elementu bakoitzeko
+        fetch = (summary.get('pipeline') or {}).get('fetch') or {}
+        fetch_busy += fetch.get('busy_seconds', 0)
+        fetch_items += fetch.get('in', 0)
+
+        usage = summary.get('usage') or {}
+        gpu_seconds += usage.get('prompt_eval_seconds', 0) + usage.get('eval_seconds', 0)
+        calls += usage.get('calls', 0) - usage.get('estimated', 0)
+
+        for entry in (summary.get('usage_by_assignment') or {}).values():
+            totals = by_type.setdefault(entry.get('type'), {'calls': 0, 'prompt': 0, 'output': 0})
+            totals['calls'] += entry['usage'].get('calls', 0)
+            totals['prompt'] += entry['usage'].get('prompt_tokens', 0)
+            totals['output'] += entry['usage'].get('output_tokens', 0)
+
+    history: Dict[str, Any] = {'runs': len(paths), 'tokens': {}}
+    if fetch_items:
+        history['moodle_call_seconds'] = fetch_busy / fetch_items
+    if calls > 0 and gpu_seconds:
+        history['analysis_seconds'] = gpu_seconds / calls
+    for activity_type, totals in by_type.items():
+        if totals['calls']:
+            history['tokens'][activity_type] = {'prompt': totals['prompt'] / totals['calls'],
+                                                'output': totals['output'] / totals['calls']}
+    return history
+
+
+def _estimate_tokens(entry: PlanEntry, history: Dict[str, Any], content_chars: Optional[int] = None):
+    """Suma a la entrada los tokens de un análisis (historial por tipo o estimación por caracteres)"""
+    known = history['tokens'].get(entry.type)
+    if content_chars is not None:
+        prompt = PROMPT_OVERHEAD_TOKENS + min(content_chars, MAX_CONTENT_CHARS) // CHARS_PER_TOKEN
+    elif known:
+        prompt = known['prompt']
+    else:
+        prompt = DEFAULT_PROMPT_TOKENS.get(entry.type, 1500)
+    entry.prompt_tokens += int(prompt)
+    entry.output_tokens += int(known['output'] if known else DEFAULT_OUTPUT_TOKENS.get(entry.type, 500))
+
+
+def _cache_timestamp(entry: Dict[str, Any]) -> float:
+    try:
+        return datetime.fromisoformat(entry.get('last_updated', '')).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RunPlanner:
+    """Estima por curso y tipo de actividad el trabajo de una ejecución de main.py"""
+
+    def __init__(self, moodle_client, cache, history: Optional[Dict[str, Any]] = None):
+        self.moodle_client = moodle_client
+        self.cache = cache
+        self.history = history if history is not None else load_history()
+        self.directory = UserDirectory(moodle_client)
+        # Planifikatzaileak berak egindako deiak (ez dira exekuzioaren parte)
+        self.plan_calls = 0
+
+    def plan_course(self, course) -> List[PlanEntry]:
+        """Estimación de un curso (todas las partes de COURSE_PARTS)"""
+        course_data = self.moodle_client.get_courses(course)
+        course_id = course_data['courses'][0]['id']
+        # La ejecución solo consulta a los estudiantes activos
+        students = self.directory.roster(course_id).students
+        self.plan_calls += 2
+        user_ids = {user['id'] for user in students}
+
+        entries = [self._plan_assign(course, course_id, user_ids),
+                   self._plan_vpl(course, course_id, user_ids),
+                   self._plan_quizzes(course, course_id, user_ids),
+                   self._plan_task_forums(course, course_id)]
+        # Ikastaroaren datuak eta erabiltzaileak
+        entries[0].moodle_calls += 2
+        return entries
+
+    def _plan_assign(self, course, course_id: int, user_ids) -> PlanEntry:
+        entry = PlanEntry(course=str(course), type='assign', moodle_calls=1)
+        assignments = self.moodle_client.get_assignmets(course_id)
+        self.plan_calls += 1
+        courses = assignments.get('courses') or [{}]
+
+        for assignment in courses[0].get('assignments', []):
+            entry.activities += 1
+            # get_full_assignment_info (3) + una consulta por estudiante
+            entry.moodle_calls += 3 + len(user_ids)
+            submissions = self.moodle_client.get_assignment_submissions(assignment['id'])
+            self.plan_calls += 1
+            if isinstance(submissions, str):
+                logger.warning(f"  {assignment['name']}: {submissions}")
+                continue
+
+            for user_id, submission in submissions.items():
+                if user_id not in user_ids or not self.cache.has_changed(
+                        course_id, assignment['id'], user_id, submission, 'assign'):
+                    continue
+                files = [doc for plugin in submission.get('plugins', [])
+                         for filearea in plugin.get('fileareas', [])
+                         for doc in filearea.get('files', [])]
+                size = sum(doc.get('filesize', 0) for doc in files)
+                # Almacenean metadatu berberekin daudenak ez dira deskargatzen
+                pending = [doc for doc in files if not self.moodle_client.blobs.is_current(
+                    self.moodle_client.file_key(doc['fileurl']), doc.get('filesize'), doc.get('timemodified'))]
+                entry.downloads += len(pending)
+                entry.download_bytes += sum(doc.get('filesize', 0) for doc in pending)
+                if files:
+                    entry.analyses += 1
+                    _estimate_tokens(entry, self.history, len(assignment.get('intro', '')) + size)
+        return entry
+
+    def _plan_vpl(self, course, course_id: int, user_ids) -> PlanEntry:
+        entry = PlanEntry(course=str(course), type='vpl', moodle_calls=1, approximate=True)
+        vpl_assignments = self.moodle_client.get_vpl_assignments(course_id)
+        self.plan_calls += 1
+
+        for vpl in vpl_assignments:
+            entry.activities += 1
+            # get_vpl_info + get_grading_definition + mod_vpl_open por estudiante (trae los archivos)
+            entry.moodle_calls += 2 + len(user_ids)
+            for user_id in user_ids:
+                if self.cache.get_entry(course_id, vpl['vplid'], user_id, 'vpl') is None:
+                    entry.analyses += 1
+                    _estimate_tokens(entry, self.history)
+        return entry
+
+    def _plan_quizzes(self, course, course_id: int, user_ids) -> PlanEntry:
+        entry = PlanEntry(course=str(course), type='quiz', moodle_calls=1)
+        quizzes = self.moodle_client.get_quizzes(course_id)
+        self.plan_calls += 1
+
+        for quiz in quizzes:
+            entry.activities += 1
+            # Mejor nota por estudiante; con nota, también la información del quiz
+            graded = sum(1 for user_id in user_ids
+                         if self.cache.get_entry(course_id, quiz['quizid'], user_id, 'quiz'))
+            entry.moodle_calls += len(user_ids) + graded
+        return entry
+
+    def _plan_task_forums(self, course, course_id: int) -> PlanEntry:
+        entry = PlanEntry(course=str(course), type='forum_task', moodle_calls=1, approximate=True)
+        task_forums = self.moodle_client.get_task_forums(course_id)
+        self.plan_calls += 1
+
+        for forum in task_forums:
+            entry.activities += 1
+            result = self.moodle_client.get_forum_discussions(forum['id'], expected=forum.get('numdiscussions', 0))
+            discussions = result.get('discussions', [])
+            self.plan_calls += result.get('pages', 1)
+            # Páginas de discusiones + los mensajes de las que han cambiado desde la copia local
+            stored = self.moodle_client.forums.load(forum['id'])
+            entry.moodle_calls += result.get('pages', 1) + len(self.moodle_client.forums.changed(stored, discussions))
+
+            # Marca de agua: el último análisis guardado de este foro
+            analyzed = [e for e in self.cache.get_all_entries(course_id=course_id, assignment_id=forum['id'])
+                        if e.get('assignment_type') == 'forum_task']
+            watermark = max((_cache_timestamp(e) for e in analyzed), default=0.0)
+            authors = set()
+            for discussion in discussions:
+                if max(discussion.get('timemodified', 0), discussion.get('modified', 0)) > watermark:
+                    authors.update(a for a in (discussion.get('userid'), discussion.get('usermodified')) if a)
+            entry.analyses += len(authors)
+            for _ in authors:
+                _estimate_tokens(entry, self.history)
+        return entry
+
+    def plan(self, courses: List[str]) -> Dict[str, Any]:
+        """
+        Estima la ejecución de todos los cursos
+
+        Returns:
+            Dict con 'entries' (PlanEntry por curso y tipo), 'errors' y 'plan_calls'
+        """
+        entries: List[PlanEntry] = []
+        errors: Dict[str, str] = {}
+        for course in courses:
+            try:
+                entries.extend(self.plan_course(course))
+            except Exception as e:
+                errors[str(course)] = f"{type(e).__name__}: {e}"
+                logger.error(f"❌ Error estimando el curso {course}: {errors[str(course)]}")
+        return {'entries': entries, 'errors': errors, 'plan_calls': self.plan_calls}
+
+
+def estimate_seconds(totals: PlanEntry, history: Dict[str, Any], settings: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Duración estimada por recurso y total
+
+    Las etapas del pipeline se solapan, así que cuenta la más lenta. Las llamadas
+    a Moodle se reparten entre los hilos de consulta, los análisis entre los
+    servidores Ollama y los cursos entre los procesos.
+    """
+    workers = settings.get('pipeline_workers', {})
+    call_seconds = history.get('moodle_call_seconds', PLAN_MOODLE_CALL_SECONDS)
+    moodle = totals.moodle_calls * call_seconds / max(1, workers.get('fetch', 1))
+    download = totals.download_bytes / (PLAN_DOWNLOAD_MBPS * 1024 * 1024)
+
+    if 'analysis_seconds' in history:
+        llm = totals.analyses * history['analysis_seconds']
+    else:
+        llm = (totals.prompt_tokens / PLAN_PROMPT_TOKENS_PER_SECOND
+               + totals.output_tokens / PLAN_OUTPUT_TOKENS_PER_SECOND)
+    llm /= max(1, len(OLLAMA_HOSTS))
+
+    total = max(moodle, download, llm) / max(1, settings.get('processes', 1))
+    return {'moodle': moodle, 'download': download, 'llm': llm, 'total': total}
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+
+def print_plan(plan: Dict[str, Any], history: Dict[str, Any], settings: Dict[str, Any]):
+    """Tabla por curso y tipo de actividad, totales y tiempo estimado"""
+    header = f"  {'curso':<10} {'tipo':<11} {'activ.':>6} {'Moodle':>7} {'descargas':>9} {'bytes':>10} {'análisis':>9} {'tok. entrada':>12} {'tok. salida':>11}"
+
+    def row(entry: PlanEntry, course: str = None):
+        mark = '~' if entry.approximate and entry.analyses else ' '
+        return (f"  {course if course is not None else entry.course:<10} {entry.type:<11} {entry.activities:>6} "
+                f"{entry.moodle_calls:>7} {entry.downloads:>9} {_format_bytes(entry.download_bytes):>10} "
+                f"{mark}{entry.analyses:>8} {entry.prompt_tokens:>12} {entry.output_tokens:>11}")
+
+    print("=" * 100)
+    print("🗺️  PLAN DE EJECUCIÓN (estimación, no se descarga ni se analiza nada)")
+    print("=" * 100)
+    print(header)
+    print("-" * 100)
+
+    by_type = {activity_type: PlanEntry(course='TOTAL', type=activity_type) for activity_type in ACTIVITY_TYPES}
+    totals = PlanEntry(course='TOTAL', type='todos')
+    for entry in plan['entries']:
+        print(row(entry))
+        by_type[entry.type].add(entry)
+        totals.add(entry)
+
+    print("-" * 100)
+    for entry in by_type.values():
+        print(row(entry))
+    print(row(totals))
+    print("  ~ máximo o aproximado: vpl cuenta los estudiantes sin caché, foros los autores de discusiones nuevas")
+
+    for course, error in plan['errors'].items():
+        print(f"  ❌ {course}: {error}")
+
+    eta = estimate_seconds(totals, history, settings)
+    source = f"historial de {history['runs']} ejecución(es)" if history['runs'] else "valores por defecto"
+    print("-" * 100)
+    print(f"⏱️  Tiempo estimado: {_format_duration(eta['total'])} ({source})")
+    print(f"    Moodle {_format_duration(eta['moodle'])} | descargas {_format_duration(eta['download'])} | "
+          f"IA {_format_duration(eta['llm'])} | {settings.get('processes', 1)} proceso(s)")
+    print(f"    Consultas hechas para estimar: {plan['plan_calls']}")
@@ -0,0 +1,266 @@
+"""
+Reparto de cursos entre varios nodos (`main.py --shard`).
+
+Cada unidad de trabajo (un curso, o un curso × tipo de actividad con
+`--shard-split`) es un trabajo en una tabla de leases SQLite compartida
+(`SHARD_DB`). Cada nodo ejecuta `main.py --shard`, reserva unidades hasta que no
+quedan y mantiene vivo su lease mientras procesa. Si un nodo muere, su lease
+caduca y otro nodo retoma la unidad.
+
+El coordinador muestra el progreso y libera el trabajo de nodos caídos:
+
+    python src/sharding.py --plan                 # Crea las unidades de la ejecución
+    python src/sharding.py --plan --split         # Una unidad por curso y tipo de actividad
+    python src/sharding.py --status               # Progreso por unidad y nodos activos
+    python src/sharding.py --status --watch 10    # Refresca cada 10 segundos
+    python src/sharding.py --reassign             # Libera los leases caducados
+    python src/sharding.py --reassign NODO        # Libera las unidades de un nodo concreto
+    python src/sharding.py --requeue-dead         # Reintenta las unidades fallidas
+
+Los nodos no generan informes: cada unidad terminada guarda su RunState en la
+tabla y `main.py --shard-report` los fusiona y genera los informes una vez, cuando
+todas las unidades de la ejecución han terminado.
+
+Para probarlo en una sola máquina basta con lanzar varios `main.py --shard`
+con el mismo `SHARD_DB` (un fichero local hace de almacén compartido).
+"""
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from job_queue import JobQueue
+from logger_config import get_main_logger
+
+logger = get_main_logger()
+
+SHARD_DB = os.getenv("SHARD_DB", "shard_queue.db")
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "600"))
+SHARD_POLL_INTERVAL = float(os.getenv("SHARD_POLL_INTERVAL", "15"))
+
+# Tipos de actividad en los que se puede partir un curso (ver main.process_course)
+COURSE_PARTS = ['submissions', 'quizzes', 'task_forums']
+SHARD_KIND = 'shard'
+
+
+def open_shard_queue(db_path: str = None) -> JobQueue:
+    """Tabla de leases de unidades (misma estructura que la cola de análisis)"""
+    return JobQueue(db_path=db_path or SHARD_DB, lease_seconds=SHARD_LEASE_SECONDS, retry_delay=60)
+
+
+def default_run_id() -> str:
+    """Identificador de la ejecución: una por día salvo que se indique SHARD_RUN_ID"""
+    return os.getenv("SHARD_RUN_ID") or datetime.now().strftime("%Y%m%d")
+
+
+def plan_units(shard_queue: JobQueue, courses: List[str], run_id: str, split: bool = False) -> int:
+    """
+    Crea las unidades de trabajo de la ejecución `run_id`
+
+    Es idempotente: volver a planificar la misma ejecución no repite las
+    unidades terminadas; una ejecución nueva (otro run_id) las vuelve a abrir.
+
+    Returns:
+        Número de unidades pendientes tras planificar
+    """
+    pending = 0
+    for course in courses:
+        course = course.strip()
+        for parts in ([[part] for part in COURSE_PARTS] if split else [None]):
+            unit = f"{course}:{parts[0]}" if parts else course
+            payload = {'run_id': run_id, 'course': course, 'parts': parts}
+            if shard_queue.enqueue(f"shard_{unit}", SHARD_KIND, payload):
+                pending += 1
+    return pending
+
+
+def _heartbeat(shard_queue: JobQueue, job_id: int, worker_id: str, stop: threading.Event):
+    """Prolonga el lease de la unidad mientras se procesa"""
+    while not stop.wait(shard_queue.lease_seconds / 3):
+        if not shard_queue.heartbeat(job_id, worker_id):
+            logger.warning(f"  Lease perdido en la unidad {job_id}")
+            return
+
+
+def run_shard_worker(shard_queue: JobQueue, run_unit: Callable[[str, Optional[List[str]]], Any],
+                     worker_id: str = None) -> List[Any]:
+    """
+    Procesa unidades de la tabla de leases hasta que no quede ninguna
+
+    Mientras otros nodos tengan unidades reservadas se sigue esperando, por si
+    alguno muere y su lease caduca.
+
+    Args:
+        shard_queue: Tabla de leases (open_shard_queue)
+        run_unit: Procesa (curso, partes) y devuelve un resultado con `error`
+                  (main.CourseResult)
+        worker_id: Identificador del nodo (por defecto host-pid-aleatorio)
+
+    Returns:
+        Resultados de las unidades procesadas por este nodo
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    results = []
+    logger.info(f"🛰️  Nodo {worker_id} | unidades: {shard_queue.stats()}")
+
+    while True:
+        job = shard_queue.lease(worker_id, kinds=[SHARD_KIND])
+        if job is None:
+            stats = shard_queue.stats()
+            if not stats['pending'] and not stats['leased']:
+                break
+            time.sleep(SHARD_POLL_INTERVAL)
+            continue
+
+        payload = job['payload']
+        logger.info(f"\n▶️  [{worker_id}] {job['job_key']} (intento {job['attempts']}/{job['max_attempts']})")
+        stop = threading.Event()
+        threading.Thread(target=_heartbeat, args=(shard_queue, job['id'], worker_id, stop), daemon=True).start()
+        try:
+            result = run_unit(payload['course'], payload.get('parts'))
+        except Exception as e:
+            result = None
+            error = f"{type(e).__name__}: {e}"
+        else:
+            error = result.error
+        finally:
+            stop.set()
+
+        if error:
+            status = shard_queue.fail(job['id'], worker_id, error)
+            logger.error(f"  ❌ {job['job_key']}: {error} → {status or 'lease perdido'}")
+            # Azken saiakera bada, nodo honen laburpenean agertzen da
+            if status == 'dead' and result is not None:
+                results.append(result)
+            continue
+
+        shard_queue.complete(job['id'], worker_id, {
+            'worker': worker_id,
+            'new_or_modified': result.state.new_submissions,
+            'unchanged': result.state.unchanged_submissions,
+            'queued_jobs': result.state.queued_jobs,
+            # Informeak exekuzio osoarekin sortzeko (collect_run_results)
+            'state': result.state.to_dict(),
+            'course_info': asdict(result.course_info) if result.course_info else None
+        })
+        results.append(result)
+        logger.info(f"  ✅ {job['job_key']} terminado")
+
+    logger.info(f"🛰️  Nodo {worker_id}: {len(results)} unidad(es) procesadas")
+    return results
+
+
+def collect_run_results(shard_queue: JobQueue, run_id: str) -> Dict[str, Any]:
+    """
+    Resultados guardados de las unidades de la ejecución `run_id`
+
+    Returns:
+        {'results': [resultado de cada unidad terminada], 'unfinished': [unidades sin terminar]}
+    """
+    results, unfinished = [], []
+    for job in shard_queue.jobs(kinds=[SHARD_KIND]):
+        if job['payload'].get('run_id') != run_id:
+            continue
+        if job['status'] == 'done' and (job['result'] or {}).get('state') is not None:
+            results.append(job['result'])
+        else:
+            unfinished.append(f"{job['job_key'].replace('shard_', '', 1)} ({job['status']})")
+    return {'results': results, 'unfinished': unfinished}
+
+
+def get_progress(shard_queue: JobQueue) -> Dict[str, Any]:
+    """Unidades por estado, detalle de cada una y nodos con leases activos"""
+    now = time.time()
+    units = []
+    workers: Dict[str, Dict[str, Any]] = {}
+
+    for job in shard_queue.jobs(kinds=[SHARD_KIND]):
+        expired = job['status'] == 'leased' and (job['lease_expires'] or 0) < now
+        units.append({
+            'unit': job['job_key'].replace('shard_', '', 1),
+            'run_id': job['payload'].get('run_id'),
+            'status': 'expired' if expired else job['status'],
+            'owner': job['lease_owner'] or (job['result'] or {}).get('worker'),
+            'attempts': job['attempts'],
+            'lease_left': round(job['lease_expires'] - now) if job['status'] == 'leased' and not expired else None,
+            'error': job['last_error']
+        })
+        if job['status'] == 'leased':
+            worker = workers.setdefault(job['lease_owner'], {'units': 0, 'alive': True})
+            worker['units'] += 1
+            worker['alive'] = worker['alive'] and not expired
+
+    return {'stats': shard_queue.stats(), 'units': units, 'workers': workers}
+
+
+def print_progress(progress: Dict[str, Any]):
+    icons = {'pending': '⏳', 'leased': '▶️ ', 'expired': '⏰', 'done': '✅', 'dead': '💀'}
+    stats = progress['stats']
+    total = sum(stats.values())
+    print("=" * 80)
+    print(f"📊 PROGRESO: {stats['done']}/{total} terminadas | {stats['leased']} en curso | "
+          f"{stats['pending']} pendientes | {stats['dead']} fallidas")
+    print("=" * 80)
+    for unit in progress['units']:
+        line = f"  {icons.get(unit['status'], '?')} {unit['unit']:<24} {unit['status']:<8} intentos {unit['attempts']}"
+        if unit['owner']:
+            line += f" | {unit['owner']}"
+        if unit['lease_left'] is not None:
+            line += f" | lease {unit['lease_left']}s"
+        if unit['error'] and unit['status'] != 'done':
+            line += f" | {unit['error'][:60]}"
+        print(line)
+    if progress['workers']:
+        print("-" * 80)
+        for worker_id, worker in progress['workers'].items():
+            state = 'activo' if worker['alive'] else 'SIN LATIDO (lease caducado)'
+            print(f"  🛰️  {worker_id}: {worker['units']} unidad(es) | {state}")
+
+
+def main():
+    load_dotenv()
+    shard_queue = open_shard_queue()
+    argv = sys.argv[1:]
+
+    def option(name):
+        if name in argv:
+            index = argv.index(name)
+            if index + 1 < len(argv) and not argv[index + 1].startswith('--'):
+                return argv[index + 1]
+            return ''
+        return None
+
+    if option('--plan') is not None:
+        run_id = option('--run-id') or default_run_id()
+        courses = os.getenv("COURSE_LIST", "").split(",")
+        pending = plan_units(shard_queue, [c for c in courses if c.strip()], run_id, split='--split' in argv)
+        print(f"🗂️  Ejecución {run_id}: {pending} unidad(es) pendientes en {shard_queue.db_path}")
+        return
+
+    reassign = option('--reassign')
+    if reassign is not None:
+        released = shard_queue.release_leases(reassign or None)
+        print(f"↩️  {released} unidad(es) liberadas" + (f" del nodo {reassign}" if reassign else " (leases caducados)"))
+        return
+
+    if '--requeue-dead' in argv:
+        print(f"↩️  {shard_queue.requeue_dead()} unidad(es) fallidas devueltas a la cola")
+        return
+
+    watch = option('--watch')
+    while True:
+        print_progress(get_progress(shard_queue))
+        if not watch:
+            break
+        time.sleep(float(watch))
+
+
+if __name__ == "__main__":
+    main()
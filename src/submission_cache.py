@@ -1,20 +1,35 @@
 import json
 import hashlib
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Optional, Dict, Any
 from logger_config import get_logger
 
 logger = get_logger(__name__)
 
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
 class SubmissionCache:
     """
     Gestiona el caché de entregas para evitar reprocesar trabajos que no han cambiado.
     Guarda información sobre cada entrega (usuario, tarea, hash, timestamp, estado).
+    
+    Varios procesos (la descarga y los workers de análisis) pueden compartir el
+    mismo fichero: al guardar se bloquea el fichero, se relee y solo se escriben
+    las claves modificadas por este proceso.
     """
     
     def __init__(self, cache_file: str = "submission_cache.json"):
         self.cache_file = cache_file
+        self._lock = threading.RLock()
+        self._dirty = set()
+        self._removed = set()
+        self._cleared = False
         self.cache = self._load_cache()
     
     def _load_cache(self) -> Dict:
@@ -28,13 +43,50 @@ class SubmissionCache:
                 return {}
         return {}
     
+    @contextmanager
+    def _file_lock(self):
+        """Bloqueo exclusivo entre procesos sobre `<cache_file>.lock`"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.cache_file + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
     def _save_cache(self):
-        """Guarda el caché en el archivo JSON."""
-        try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.cache, f, indent=2, ensure_ascii=False)
-        except IOError as e:
-            logger.error(f"Error guardando caché: {e}")
+        """Guarda el caché en el archivo JSON, fusionándolo con los cambios de otros procesos."""
+        with self._lock:
+            try:
+                with self._file_lock():
+                    merged = {} if self._cleared else self._load_cache()
+                    for key in self._removed:
+                        merged.pop(key, None)
+                    for key in self._dirty:
+                        if key in self.cache:
+                            merged[key] = self.cache[key]
+                    
+                    # Idatzi fitxategi lagun batera eta ordeztu (ez da inoiz erdizka geratzen)
+                    tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+                    with open(tmp_file, 'w', encoding='utf-8') as f:
+                        json.dump(merged, f, indent=2, ensure_ascii=False)
+                    os.replace(tmp_file, self.cache_file)
+                
+                self.cache = merged
+                self._dirty.clear()
+                self._removed.clear()
+                self._cleared = False
+            except IOError as e:
+                logger.error(f"Error guardando caché: {e}")
+    
+    def reload(self):
+        """Vuelve a leer el fichero (p. ej. para ver lo que han guardado los workers)."""
+        with self._lock:
+            self.cache = self._load_cache()
+            self._dirty.clear()
+            self._removed.clear()
     
     def _compute_hash(self, data: Any) -> str:
         """
@@ -137,8 +189,10 @@ class SubmissionCache:
         if additional_info:
             entry.update(additional_info)
         
-        self.cache[key] = entry
-        self._save_cache()
+        with self._lock:
+            self.cache[key] = entry
+            self._dirty.add(key)
+            self._save_cache()
     
     def get_entry(self, course_id: int, assignment_id: int, student_id: int, 
                   assignment_type: str = "vpl") -> Optional[Dict]:
@@ -174,18 +228,24 @@ class SubmissionCache:
     
     def clear_cache(self):
         """Limpia todo el caché."""
-        self.cache = {}
-        self._save_cache()
+        with self._lock:
+            self.cache = {}
+            self._dirty.clear()
+            self._cleared = True
+            self._save_cache()
         logger.info("Caché limpiado completamente")
     
     def remove_entry(self, course_id: int, assignment_id: int, student_id: int, 
                      assignment_type: str = "vpl"):
         """Elimina una entrada específica del caché."""
         key = self._get_key(course_id, assignment_id, student_id, assignment_type)
-        if key in self.cache:
-            del self.cache[key]
-            self._save_cache()
-            return True
+        with self._lock:
+            if key in self.cache:
+                del self.cache[key]
+                self._dirty.discard(key)
+                self._removed.add(key)
+                self._save_cache()
+                return True
         return False
     
     def get_stats(self) -> Dict:
@@ -0,0 +1,161 @@
+"""
+Worker de análisis con IA: consume la cola de trabajos que encola `main.py --queue`.
+
+Uso:
+    python src/worker.py                      # Procesa trabajos indefinidamente
+    python src/worker.py --once               # Termina cuando la cola está vacía
+    python src/worker.py --threads 4          # Varios trabajos en paralelo
+    python src/worker.py --stats              # Trabajos por estado
+    python src/worker.py --dead               # Lista los trabajos en dead-letter
+    python src/worker.py --requeue-dead       # Devuelve los trabajos muertos a la cola
+"""
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from ai_analyzer import AIAnalyzer
+from analysis_jobs import persist_job_result, run_job
+from job_queue import JobQueue
+from logger_config import get_main_logger
+from submission_cache import SubmissionCache
+
+logger = get_main_logger()
+
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "5"))
+
+
+class AnalysisWorker:
+    """Reserva trabajos de la cola, los analiza y guarda el resultado en el caché"""
+
+    def __init__(self, job_queue: JobQueue, cache: SubmissionCache, ai_analyzer: AIAnalyzer,
+                 worker_id: str = None):
+        self.queue = job_queue
+        self.cache = cache
+        self.ai_analyzer = ai_analyzer
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _heartbeat(self, job_id: int, stop: threading.Event, lease_id: str):
+        """Prolonga el lease mientras el análisis sigue en marcha"""
+        interval = self.queue.lease_seconds / 3
+        while not stop.wait(interval):
+            if not self.queue.heartbeat(job_id, lease_id):
+                logger.warning(f"  Lease perdido en el trabajo {job_id}")
+                return
+
+    def process_one(self, lease_id: str) -> bool:
+        """
+        Procesa un trabajo
+
+        Returns:
+            False si no había trabajos disponibles
+        """
+        job = self.queue.lease(lease_id)
+        if job is None:
+            return False
+
+        payload = job['payload']
+        logger.info(f"▶️  [{lease_id}] {job['job_key']} (intento {job['attempts']}/{job['max_attempts']}) "
+                    f"- {payload.get('student_username')} / {payload.get('assignment_name')}")
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job['id'], stop, lease_id), daemon=True)
+        heartbeat.start()
+        try:
+            ai_analysis = run_job(job['kind'], payload, self.ai_analyzer)
+            if ai_analysis.get('status') != 'success' or ai_analysis.get('fallback'):
+                raise RuntimeError(ai_analysis.get('error') or "El modelo no devolvió una respuesta válida")
+
+            persist_job_result(self.cache, job['kind'], payload, ai_analysis)
+            self.queue.complete(job['id'], lease_id, {
+                'status': ai_analysis.get('status'),
+                'grade': ai_analysis.get('suggested_grade', ai_analysis.get('grade')),
+                'usage': ai_analysis.get('usage')
+            })
+            with self._lock:
+                self.processed += 1
+            logger.info(f"  ✅ {job['job_key']}: calificación sugerida "
+                        f"{ai_analysis.get('suggested_grade', ai_analysis.get('grade'))}")
+        except Exception as e:
+            status = self.queue.fail(job['id'], lease_id, str(e))
+            with self._lock:
+                self.failed += 1
+            icon = '💀' if status == 'dead' else '↩️'
+            logger.error(f"  {icon} {job['job_key']}: {e} → {status or 'lease perdido'}")
+        finally:
+            stop.set()
+        return True
+
+    def run(self, threads: int = 1, once: bool = False):
+        """Bucle principal; con `once` termina cuando no quedan trabajos disponibles"""
+        def loop(index: int):
+            lease_id = f"{self.worker_id}/{index}"
+            while True:
+                if self.process_one(lease_id):
+                    continue
+                if once:
+                    return
+                time.sleep(POLL_INTERVAL)
+
+        workers = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+
+def main():
+    load_dotenv()
+    job_queue = JobQueue()
+
+    if '--stats' in sys.argv:
+        logger.info(f"📊 Cola de trabajos ({job_queue.db_path}): {job_queue.stats()}")
+        return
+    if '--dead' in sys.argv:
+        for job in job_queue.dead_letters():
+            logger.info(f"💀 {job['job_key']} ({job['attempts']} intentos): {job['last_error']}")
+        return
+    if '--requeue-dead' in sys.argv:
+        logger.info(f"↩️  {job_queue.requeue_dead()} trabajo(s) devueltos a la cola")
+        return
+
+    threads = 1
+    worker_id = None
+    i = 1
+    while i < len(sys.argv):
+        arg = sys.argv[i]
+        if arg in ['--threads', '-t'] and i + 1 < len(sys.argv):
+            threads = max(1, int(sys.argv[i + 1]))
+            i += 2
+        elif arg == '--worker-id' and i + 1 < len(sys.argv):
+            worker_id = sys.argv[i + 1]
+            i += 2
+        else:
+            i += 1
+
+    cache = SubmissionCache("submission_cache.json")
+    ai_analyzer = AIAnalyzer(think=False, max_concurrency=threads)
+    worker = AnalysisWorker(job_queue, cache, ai_analyzer, worker_id=worker_id)
+
+    logger.info("=" * 60)
+    logger.info(f"WORKER DE ANÁLISIS: {worker.worker_id} ({threads} hilo(s))")
+    logger.info(f"Cola: {job_queue.db_path} {job_queue.stats()}")
+    logger.info("=" * 60)
+
+    try:
+        worker.run(threads=threads, once='--once' in sys.argv)
+    except KeyboardInterrupt:
+        logger.info("Detenido por el usuario (los trabajos en curso se retomarán al caducar su lease)")
+
+    logger.info(f"Procesados: {worker.processed} | Fallidos: {worker.failed} | Cola: {job_queue.stats()}")
+
+
+if __name__ == "__main__":
+    main()